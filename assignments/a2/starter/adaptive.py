@@ -0,0 +1,331 @@
+"""
+Adaptive Huffman coding, with the FGK (Faller-Gallager-Knuth) algorithm.
+
+Unlike the static codes of compress.py, the adaptive code needs no frequency
+count of the whole input and no tree in the header: the encoder and decoder
+start from the same empty tree and update it in the same way after every
+symbol. Data can therefore be compressed in a single pass as it arrives, and
+each piece of compressed output is available as soon as its input is.
+"""
+from __future__ import annotations
+from typing import BinaryIO, List, Tuple
+from utils import BitWriter, get_bit
+
+# A symbol seen for the first time is written as the code of the NYT leaf
+# followed by the symbol in ESCAPE_BITS bits. The escaped value END, which is
+# not a byte, marks the end of the data.
+ESCAPE_BITS = 9
+END = 256
+
+# The number of bytes read from a stream at a time.
+CHUNK_SIZE = 1 << 16
+
+# The largest number of nodes in a tree: a leaf for each of the 256 symbols,
+# the NYT leaf, and the internal nodes joining them.
+_MAX_NODES = 2 * 256 + 1
+
+
+class AdaptiveHuffmanTree:
+    """ A Huffman tree that is updated after each symbol is coded.
+
+    The tree starts as a single NYT ("not yet transmitted") leaf. When a
+    symbol is seen for the first time, the NYT leaf is split into a new NYT
+    leaf and a leaf for the symbol. After each symbol, the weights on the path
+    from its leaf to the root are incremented, and nodes are swapped as needed
+    to keep the sibling property: listing the nodes in order of their numbers,
+    weights never decrease, and siblings are next to each other.
+
+    Nodes are identified by their index in parallel arrays. Leaves have no
+    children (-1).
+
+    Public Attributes:
+    ===========
+    root: the index of the root node
+    nyt: the index of the NYT leaf
+    left: the left child of each node
+    right: the right child of each node
+    symbol: the symbol of each leaf, or -1
+    """
+    root: int
+    nyt: int
+    left: List[int]
+    right: List[int]
+    symbol: List[int]
+    # === Private Attributes ===
+    # _parent: the parent of each node, or -1 for the root
+    # _weight: the number of occurrences of the symbols below each node
+    # _number: the number of each node in the sibling property order
+    # _by_number: the node with each number, or -1
+    # _leaf: the leaf of each symbol, or -1 if it has not been seen yet
+    _parent: List[int]
+    _weight: List[int]
+    _number: List[int]
+    _by_number: List[int]
+    _leaf: List[int]
+
+    def __init__(self) -> None:
+        """ Create a new tree made of the NYT leaf only."""
+        self.root, self.nyt = 0, 0
+        self.left, self.right, self.symbol = [-1], [-1], [-1]
+        self._parent, self._weight = [-1], [0]
+        self._number = [_MAX_NODES - 1]
+        self._by_number = [-1] * _MAX_NODES
+        self._by_number[_MAX_NODES - 1] = 0
+        self._leaf = [-1] * 256
+
+    def code(self, symbol: int) -> Tuple[int, int]:
+        """ Return the code of <symbol> in the current tree, as an integer and
+        its length in bits. For a symbol not seen yet, or END, the code is the
+        code of the NYT leaf followed by the symbol in ESCAPE_BITS bits.
+
+        >>> tree = AdaptiveHuffmanTree()
+        >>> tree.code(65)
+        (65, 9)
+        >>> tree.update(65)
+        >>> tree.code(65), tree.code(66)
+        ((1, 1), (66, 10))
+        """
+        if symbol == END or self._leaf[symbol] == -1:
+            value, length = self._path(self.nyt)
+            return value << ESCAPE_BITS | symbol, length + ESCAPE_BITS
+        return self._path(self._leaf[symbol])
+
+    def _path(self, node: int) -> Tuple[int, int]:
+        """ Return the code of the path from the root to <node>, as an integer
+        and its length in bits.
+        """
+        value, length = 0, 0
+        parent = self._parent[node]
+        while parent != -1:
+            if self.right[parent] == node:
+                value |= 1 << length
+            length += 1
+            node, parent = parent, self._parent[parent]
+        return value, length
+
+    def update(self, symbol: int) -> None:
+        """ Update the tree after coding <symbol>.
+        """
+        node = self._leaf[symbol]
+        if node == -1:
+            node = self._split_nyt(symbol)
+        while node != -1:
+            leader = self._leader(node)
+            if leader != node and leader != self._parent[node]:
+                self._swap(node, leader)
+            self._weight[node] += 1
+            node = self._parent[node]
+
+    def _split_nyt(self, symbol: int) -> int:
+        """ Give the NYT leaf two children, a new NYT leaf and a leaf for
+        <symbol>, and return the new leaf for <symbol>.
+        """
+        old = self.nyt
+        self.nyt = self._new_node(old, self._number[old] - 2, -1)
+        leaf = self._new_node(old, self._number[old] - 1, symbol)
+        self.left[old], self.right[old] = self.nyt, leaf
+        self._leaf[symbol] = leaf
+        return leaf
+
+    def _new_node(self, parent: int, number: int, symbol: int) -> int:
+        """ Add a leaf with weight 0 and return its index.
+        """
+        node = len(self.left)
+        self.left.append(-1)
+        self.right.append(-1)
+        self.symbol.append(symbol)
+        self._parent.append(parent)
+        self._weight.append(0)
+        self._number.append(number)
+        self._by_number[number] = node
+        return node
+
+    def _leader(self, node: int) -> int:
+        """ Return the node with the highest number among the nodes with the
+        same weight as <node>.
+        """
+        number = self._number[node]
+        weight = self._weight[node]
+        while (number + 1 < _MAX_NODES and
+               self._weight[self._by_number[number + 1]] == weight):
+            number += 1
+        return self._by_number[number]
+
+    def _swap(self, a: int, b: int) -> None:
+        """ Swap the positions of nodes <a> and <b>, with their subtrees, in
+        the tree.
+
+        Precondition: neither of <a> and <b> is an ancestor of the other.
+        """
+        parent_a, parent_b = self._parent[a], self._parent[b]
+        if parent_a == parent_b:
+            self.left[parent_a], self.right[parent_a] = \
+                self.right[parent_a], self.left[parent_a]
+        else:
+            if self.left[parent_a] == a:
+                self.left[parent_a] = b
+            else:
+                self.right[parent_a] = b
+            if self.left[parent_b] == b:
+                self.left[parent_b] = a
+            else:
+                self.right[parent_b] = a
+            self._parent[a], self._parent[b] = parent_b, parent_a
+        number_a, number_b = self._number[a], self._number[b]
+        self._number[a], self._number[b] = number_b, number_a
+        self._by_number[number_a], self._by_number[number_b] = b, a
+
+
+class AdaptiveEncoder:
+    """ An encoder of text with an adaptive Huffman code.
+
+    Text may be fed to the encoder in consecutive pieces, and the complete
+    bytes of its compressed form are returned as soon as each piece is
+    encoded.
+    """
+    # === Private Attributes ===
+    # _tree: the tree for the text encoded so far
+    # _writer: the writer holding the bits of an incomplete last byte
+    _tree: AdaptiveHuffmanTree
+    _writer: BitWriter
+
+    def __init__(self) -> None:
+        """ Create a new encoder."""
+        self._tree = AdaptiveHuffmanTree()
+        self._writer = BitWriter()
+
+    def encode(self, text: bytes) -> bytes:
+        """ Return the complete bytes of the compressed form of <text>,
+        following the text encoded so far.
+        """
+        code, update, write = \
+            self._tree.code, self._tree.update, self._writer.write
+        for byte in text:
+            write(*code(byte))
+            update(byte)
+        return self._writer.take()
+
+    def finish(self) -> bytes:
+        """ Return the rest of the compressed text: the end marker, and the
+        last incomplete byte padded with zeroes to the right.
+        """
+        self._writer.write(*self._tree.code(END))
+        return self._writer.getvalue()
+
+
+class AdaptiveDecoder:
+    """ A decoder of text compressed with AdaptiveEncoder.
+
+    The compressed text may be fed to the decoder in consecutive pieces.
+
+    Public Attributes:
+    ===========
+    finished: whether the end marker has been decoded
+    """
+    finished: bool
+    # === Private Attributes ===
+    # _tree: the tree for the text decoded so far
+    # _node: the node reached while reading a code
+    # _escape_bits: the number of bits of an escaped symbol still to read, or
+    #     0 if a code is being read
+    # _escaped: the bits of the escaped symbol read so far
+    _tree: AdaptiveHuffmanTree
+    _node: int
+    _escape_bits: int
+    _escaped: int
+
+    def __init__(self) -> None:
+        """ Create a new decoder."""
+        self._tree = AdaptiveHuffmanTree()
+        self._node = self._tree.root
+        # the empty tree's only code is the empty code of the NYT leaf
+        self._escape_bits, self._escaped = ESCAPE_BITS, 0
+        self.finished = False
+
+    def decode(self, text: bytes) -> bytes:
+        """ Return the symbols decoded from <text>, following the text decoded
+        so far. Bits after the end marker are ignored.
+
+        >>> encoder = AdaptiveEncoder()
+        >>> data = encoder.encode(b'abracadabra') + encoder.finish()
+        >>> decoder = AdaptiveDecoder()
+        >>> decoder.decode(data[:3]) + decoder.decode(data[3:])
+        b'abracadabra'
+        >>> decoder.finished
+        True
+        """
+        tree = self._tree
+        result = bytearray()
+        for byte in text:
+            for bit_num in range(7, -1, -1):
+                if self.finished:
+                    return bytes(result)
+                bit = get_bit(byte, bit_num)
+                if self._escape_bits:
+                    self._escaped = self._escaped << 1 | bit
+                    self._escape_bits -= 1
+                    if not self._escape_bits:
+                        self._emit(self._escaped, result)
+                    continue
+                self._node = tree.right[self._node] if bit \
+                    else tree.left[self._node]
+                if self._node == tree.nyt:
+                    self._escape_bits, self._escaped = ESCAPE_BITS, 0
+                elif tree.left[self._node] == -1:
+                    self._emit(tree.symbol[self._node], result)
+        return bytes(result)
+
+    def _emit(self, symbol: int, result: bytearray) -> None:
+        """ Append the decoded <symbol> to <result> and update the tree, or
+        finish decoding if <symbol> is END.
+        """
+        self._node = self._tree.root
+        if symbol == END:
+            self.finished = True
+            return
+        result.append(symbol)
+        self._tree.update(symbol)
+
+
+def encode_stream(src: BinaryIO, dst: BinaryIO) -> None:
+    """ Compress everything read from the open binary stream <src> into the
+    open binary stream <dst>, writing and flushing the compressed form of each
+    piece as soon as it is read.
+    """
+    encoder = AdaptiveEncoder()
+    read = getattr(src, "read1", src.read)
+    chunk = read(CHUNK_SIZE)
+    while chunk:
+        dst.write(encoder.encode(chunk))
+        dst.flush()
+        chunk = read(CHUNK_SIZE)
+    dst.write(encoder.finish())
+    dst.flush()
+
+
+def decode_stream(src: BinaryIO, dst: BinaryIO) -> None:
+    """ Decompress the output of encode_stream read from the open binary
+    stream <src> into the open binary stream <dst>, writing and flushing each
+    decoded piece as soon as it is available.
+    """
+    decoder = AdaptiveDecoder()
+    read = getattr(src, "read1", src.read)
+    while not decoder.finished:
+        chunk = read(CHUNK_SIZE)
+        if not chunk:
+            break
+        dst.write(decoder.decode(chunk))
+        dst.flush()
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
+
+    import python_ta
+    python_ta.check_all(config={
+        'allowed-io': ['encode_stream', 'decode_stream'],
+        'allowed-import-modules': [
+            'python_ta', 'doctest', '__future__', 'typing', 'utils'
+        ]
+    })
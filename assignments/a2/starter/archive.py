@@ -0,0 +1,341 @@
+"""
+Archives: many files compressed into one container.
+
+For many small files, a separate compressed file for each has a header with
+its own code, and costs an open and close per file. An archive instead holds
+all the files, called its members, one after the other. Optionally, the
+archive starts with one shared canonical code, built from the frequencies of
+all the members, which members use instead of a code of their own when that
+is smaller.
+
+A central directory at the end of the archive records the name, kind, offset
+and sizes of each member, so a single member can be extracted by reading the
+directory and seeking straight to it. The archive ends with the offset of the
+directory and the number of members.
+
+The archive starts with FORMAT_MARKER, FORMAT_ARCHIVE, and a byte that is 1 if
+a shared code follows (as code lengths, see lengths_to_bytes) or 0 if not.
+"""
+from __future__ import annotations
+import io
+import os
+from typing import BinaryIO, Dict, List, Optional, Tuple
+from utils import bytes_to_int, int32_to_bytes, int64_to_bytes
+from compress import FORMAT_MARKER, FORMAT_ARCHIVE, FORMAT_STORED, \
+    HuffmanDecoder, build_frequency_dict, build_huffman_tree, \
+    canonical_codes, code_lengths, compress_bytes, is_compressible, \
+    lengths_to_bytes, context_cost, decode_chunks, decompress_stream, \
+    read_lengths, tree_header
+
+# A member that is a compressed stream of its own, as written by
+# compress_file(canonical=True) or stored uncompressed.
+MEMBER_STREAM = 0
+# A member coded with the archive's shared code, without a header.
+MEMBER_SHARED = 1
+
+# The size of the trailer: the offset of the directory and the number of
+# members.
+TRAILER_SIZE = 12
+
+
+class ArchiveEntry:
+    """ The central directory entry of an archive member.
+
+    Public Attributes:
+    ===========
+    name: the name of the member
+    kind: MEMBER_STREAM or MEMBER_SHARED
+    offset: the position of the member's compressed data in the archive
+    compressed_size: the number of bytes of compressed data
+    size: the size of the member in bytes
+    """
+    name: str
+    kind: int
+    offset: int
+    compressed_size: int
+    size: int
+
+    def __init__(self, name: str, kind: int, offset: int,
+                 compressed_size: int, size: int) -> None:
+        """ Create a new ArchiveEntry with the given parameters."""
+        self.name, self.kind = name, kind
+        self.offset, self.compressed_size = offset, compressed_size
+        self.size = size
+
+    def __repr__(self) -> str:
+        """ Return constructor-style string representation of this entry."""
+        return 'ArchiveEntry({!r}, {}, {}, {}, {})'.format(
+            self.name, self.kind, self.offset, self.compressed_size,
+            self.size)
+
+    def to_bytes(self) -> bytes:
+        """ Return the bytes of this entry in the central directory.
+
+        >>> list(ArchiveEntry('a', 1, 2, 3, 4).to_bytes())[:2]
+        [1, 2]
+        """
+        name = self.name.encode("utf-8")
+        return (bytes([self.kind]) + int64_to_bytes(self.offset) +
+                int64_to_bytes(self.compressed_size) +
+                int64_to_bytes(self.size) + int32_to_bytes(len(name)) + name)
+
+
+def create_archive(out_file: str, paths: List[str],
+                   names: Optional[List[str]] = None,
+                   shared_tree: bool = False) -> List[ArchiveEntry]:
+    """ Compress the files <paths> into the archive <out_file>, and return
+    its central directory. Members are named <names>, by default the base
+    names of <paths>.
+
+    If <shared_tree> is True, the archive has a shared code for all the
+    members, and each member uses it unless its own code, counting its
+    header, is smaller. The files are then read twice, once to count their
+    frequencies and once to compress them.
+
+    Each member without the shared code gets its own canonical code, or is
+    stored uncompressed if that would not shrink it (see is_compressible).
+    Empty files are allowed.
+
+    Raise a ValueError if two members have the same name.
+
+    >>> import tempfile
+    >>> with tempfile.TemporaryDirectory() as tmp:
+    ...     for name in ['a', 'b']:
+    ...         with open(os.path.join(tmp, name), 'wb') as f:
+    ...             _ = f.write(name.encode() * 100)
+    ...     archive = os.path.join(tmp, 'archive.huf')
+    ...     _ = create_archive(archive, [os.path.join(tmp, 'a'),
+    ...                                  os.path.join(tmp, 'b')])
+    ...     extract_member(archive, 'b') == b'b' * 100
+    True
+    """
+    if names is None:
+        names = [os.path.basename(path) for path in paths]
+    if len(set(names)) < len(names):
+        duplicates = sorted({name for name in names if names.count(name) > 1})
+        raise ValueError("Duplicate member names: {}".format(
+            ", ".join(duplicates)))
+    shared = None
+    if shared_tree:
+        total = {}
+        for path in paths:
+            freq = build_frequency_dict(_read(path))
+            for symbol in freq:
+                total[symbol] = total.get(symbol, 0) + freq[symbol]
+        shared = code_lengths(build_huffman_tree(total or {0: 1}))
+
+    directory = []
+    with open(out_file, "wb") as f:
+        f.write(bytes([FORMAT_MARKER, FORMAT_ARCHIVE, shared is not None]))
+        if shared is not None:
+            f.write(lengths_to_bytes(shared))
+            shared_codes = canonical_codes(shared)
+        for path, name in zip(paths, names):
+            text = _read(path)
+            kind, data = MEMBER_STREAM, b''
+            if text:
+                freq = build_frequency_dict(text)
+                kind, data = _compress_member(text, freq, shared)
+                if kind == MEMBER_SHARED:
+                    data = compress_bytes(text, shared_codes)
+            directory.append(ArchiveEntry(name, kind, f.tell(), len(data),
+                                          len(text)))
+            f.write(data)
+        offset = f.tell()
+        for entry in directory:
+            f.write(entry.to_bytes())
+        f.write(int64_to_bytes(offset) + int32_to_bytes(len(directory)))
+    return directory
+
+
+def _read(path: str) -> bytes:
+    """ Return the contents of the file <path>."""
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def _compress_member(text: bytes, freq: Dict[int, int],
+                     shared: Optional[Dict[int, int]]) -> Tuple[int, bytes]:
+    """ Return the kind of member that stores <text>, whose frequencies are
+    <freq>, most compactly, given the code lengths <shared> of the shared code
+    or None. For a MEMBER_STREAM, also return its compressed stream, and for a
+    MEMBER_SHARED, return empty data.
+    """
+    if not is_compressible(freq):
+        stream = bytes([FORMAT_MARKER, FORMAT_STORED]) + text
+    else:
+        header, codes = tree_header(build_huffman_tree(freq), True)
+        stream = header + int32_to_bytes(len(text)) + \
+            compress_bytes(text, codes)
+    if shared is not None and \
+            (context_cost(shared, freq) + 7) // 8 <= len(stream):
+        return MEMBER_SHARED, b''
+    return MEMBER_STREAM, stream
+
+
+def read_directory(in_file: str) -> List[ArchiveEntry]:
+    """ Return the central directory of the archive <in_file>.
+
+    Raise a ValueError if <in_file> is not an archive.
+    """
+    with open(in_file, "rb") as f:
+        return _read_directory(f)
+
+
+def _read_directory(f: BinaryIO) -> List[ArchiveEntry]:
+    """ Return the central directory of the archive open as <f>.
+
+    Raise a ValueError if <f> does not start like an archive.
+    """
+    if f.read(2) != bytes([FORMAT_MARKER, FORMAT_ARCHIVE]):
+        raise ValueError("{} is not an archive".format(
+            getattr(f, "name", "The file")))
+    f.seek(-TRAILER_SIZE, os.SEEK_END)
+    trailer = f.read(TRAILER_SIZE)
+    f.seek(bytes_to_int(trailer[:8]))
+    data = f.read()
+    directory = []
+    pos = 0
+    for _ in range(bytes_to_int(trailer[8:])):
+        length = bytes_to_int(data[pos + 25:pos + 29])
+        directory.append(ArchiveEntry(
+            data[pos + 29:pos + 29 + length].decode("utf-8"), data[pos],
+            bytes_to_int(data[pos + 1:pos + 9]),
+            bytes_to_int(data[pos + 9:pos + 17]),
+            bytes_to_int(data[pos + 17:pos + 25])))
+        pos += 29 + length
+    return directory
+
+
+def extract_member(in_file: str, name: str) -> bytes:
+    """ Return the contents of the member <name> of the archive <in_file>,
+    reading only the header, the central directory and that member.
+
+    Raise a KeyError if there is no member <name>, and a ValueError if
+    <in_file> is not an archive.
+    """
+    with open(in_file, "rb") as f:
+        for entry in _read_directory(f):
+            if entry.name == name:
+                return _extract(f, entry)
+    raise KeyError(name)
+
+
+def extract_all(in_file: str, out_dir: str) -> List[ArchiveEntry]:
+    """ Extract every member of the archive <in_file> into the directory
+    <out_dir>, under its name, and return the central directory.
+
+    Each member is decompressed a chunk at a time, straight into its file, so
+    memory use does not grow with the size of the members.
+
+    Raise a ValueError, before extracting anything, if the name of a member
+    is an absolute path or would put it outside <out_dir>.
+    """
+    with open(in_file, "rb") as f:
+        directory = _read_directory(f)
+        out_paths = [_member_path(out_dir, entry.name) for entry in directory]
+        for entry, out_path in zip(directory, out_paths):
+            os.makedirs(os.path.dirname(out_path) or ".", exist_ok=True)
+            with open(out_path, "wb") as g:
+                _extract_to(f, entry, g)
+    return directory
+
+
+def _member_path(out_dir: str, name: str) -> str:
+    """ Return the path in <out_dir> to extract the member <name> to.
+
+    Raise a ValueError if <name> is an absolute path, has a ".." component,
+    or otherwise resolves to a path outside <out_dir>.
+
+    >>> _member_path('out', 'a/b.txt')
+    'out/a/b.txt'
+    >>> _member_path('out', '../b.txt')
+    Traceback (most recent call last):
+    ...
+    ValueError: Unsafe member name '../b.txt'
+    """
+    out_path = os.path.join(out_dir, name)
+    parts = name.replace("\\", "/").split("/")
+    root = os.path.realpath(out_dir)
+    if os.path.isabs(name) or ".." in parts or \
+            os.path.commonpath([root, os.path.realpath(out_path)]) != root:
+        raise ValueError("Unsafe member name {!r}".format(name))
+    return out_path
+
+
+def _extract(f: BinaryIO, entry: ArchiveEntry) -> bytes:
+    """ Return the contents of the member with the directory entry <entry> of
+    the archive open as <f>.
+    """
+    out = io.BytesIO()
+    _extract_to(f, entry, out)
+    return out.getvalue()
+
+
+def _extract_to(f: BinaryIO, entry: ArchiveEntry, g: BinaryIO) -> None:
+    """ Decompress the member with the directory entry <entry> of the archive
+    open as <f> into the open file <g>.
+    """
+    if entry.size == 0:
+        return
+    member = _MemberReader(f, entry.offset, entry.compressed_size)
+    if entry.kind == MEMBER_SHARED:
+        f.seek(3)
+        decoder = HuffmanDecoder(canonical_codes(read_lengths(f)))
+        decode_chunks(decoder, member, entry.size, g.write, None)
+    else:
+        decompress_stream(member, g)
+
+
+class _MemberReader:
+    """ A file open for reading the compressed data of one archive member,
+    which reads it from the archive as it is needed.
+    """
+    # === Private Attributes ===
+    # _f: the archive, open for reading
+    # _start: the position of the member's data in the archive
+    # _end: the position just past the member's data
+    # _pos: the position in the archive of the next byte to read
+    _f: BinaryIO
+    _start: int
+    _end: int
+    _pos: int
+
+    def __init__(self, f: BinaryIO, offset: int, size: int) -> None:
+        """ Create a reader of the <size> bytes at <offset> in the archive
+        open as <f>.
+        """
+        self._f = f
+        self._start = self._pos = offset
+        self._end = offset + size
+
+    def read(self, size: int = -1) -> bytes:
+        """ Read and return at most <size> bytes of the member, or all that is
+        left if <size> is negative.
+        """
+        if size < 0 or size > self._end - self._pos:
+            size = self._end - self._pos
+        self._f.seek(self._pos)
+        data = self._f.read(size)
+        self._pos += len(data)
+        return data
+
+    def tell(self) -> int:
+        """ Return the number of bytes of the member read so far."""
+        return self._pos - self._start
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
+
+    import python_ta
+    python_ta.check_all(config={
+        'allowed-io': ['create_archive', '_read', 'read_directory',
+                       'extract_member', 'extract_all', '_read_directory',
+                       '_extract', '_extract_to', 'read'],
+        'allowed-import-modules': [
+            'python_ta', 'doctest', '__future__', 'typing', 'io', 'os',
+            'utils', 'compress'
+        ]
+    })
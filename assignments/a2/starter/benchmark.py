@@ -0,0 +1,213 @@
+"""
+Benchmarks for the Huffman compressor in compress.py.
+
+Each input file is compressed with compress_file and decompressed with
+decompress_file. For each file, the benchmark reports the throughput of both
+stages in MB/s, the compression ratio, the bits per symbol of the compressed
+file next to the Shannon entropy of the input, and the peak memory allocated
+by each stage. Results are printed as a table and can be saved as JSON, so
+that runs of different versions can be compared.
+
+Usage: python benchmark.py [FILE ...] [--json OUT] [--repeat N] [--compare]
+                           [options]
+With no FILE, every file in the files/ directory is used. With --compare, the
+files are also benchmarked with plain Huffman coding, and the two are compared.
+"""
+from __future__ import annotations
+import argparse
+import contextlib
+import io
+import json
+import math
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List
+from compress import build_frequency_dict, compress_file, decompress_file
+
+# The directory with the default benchmark corpus.
+FILES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "files")
+
+
+def entropy(freq_dict: Dict[int, int]) -> float:
+    """ Return the Shannon entropy, in bits per symbol, of the symbols and
+    frequencies in <freq_dict>.
+
+    >>> entropy({65: 1, 66: 1})
+    1.0
+    >>> entropy({65: 2, 66: 1, 67: 1})
+    1.5
+    """
+    total = sum(freq_dict.values())
+    result = 0.0
+    for symbol in freq_dict:
+        p = freq_dict[symbol] / total
+        result -= p * math.log2(p)
+    return result
+
+
+def _measure(stage: Callable[[], None], size: int,
+             repeat: int) -> Dict[str, float]:
+    """ Run <stage>, which processes <size> bytes of original data, <repeat>
+    times, and return its best time in seconds, its throughput in MB/s, and
+    the peak memory it allocates in bytes, measured in one more run.
+    """
+    best = math.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        stage()
+        best = min(best, time.perf_counter() - start)
+
+    # tracemalloc slows Python down, so memory is measured in a separate run
+    tracemalloc.start()
+    stage()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {"seconds": best,
+            "mb_per_s": size / best / 1e6 if best > 0 else math.inf,
+            "peak_memory": peak}
+
+
+def benchmark_file(path: str, repeat: int = 3,
+                   options: Dict[str, Any] = None) -> Dict[str, Any]:
+    """ Return the benchmark results for compressing and decompressing the
+    file <path>, with the best of <repeat> runs for each stage, passing the
+    keyword arguments <options> to compress_file.
+    """
+    options = options or {}
+    with open(path, "rb") as f:
+        text = f.read()
+    size = len(text)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        compressed = os.path.join(tmp, "compressed.huf")
+        decompressed = os.path.join(tmp, "decompressed")
+        # compress_file prints the bits per symbol, which is reported below
+        with contextlib.redirect_stdout(io.StringIO()):
+            compression = _measure(
+                lambda: compress_file(path, compressed, **options),
+                size, repeat)
+        decompression = _measure(
+            lambda: decompress_file(compressed, decompressed), size, repeat)
+        compressed_size = os.path.getsize(compressed)
+        with open(decompressed, "rb") as f:
+            correct = f.read() == text
+
+    return {"file": os.path.basename(path),
+            "size": size,
+            "compressed_size": compressed_size,
+            "ratio": compressed_size / size,
+            "bits_per_symbol": 8 * compressed_size / size,
+            "entropy": entropy(build_frequency_dict(text)),
+            "correct": correct,
+            "compress": compression,
+            "decompress": decompression}
+
+
+def run_benchmarks(paths: List[str], repeat: int = 3,
+                   options: Dict[str, Any] = None) -> Dict[str, Any]:
+    """ Return the benchmark results for each of the files <paths>, together
+    with a description of the environment and <options> they were run with.
+    """
+    return {"python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "options": options or {},
+            "repeat": repeat,
+            "results": [benchmark_file(path, repeat, options)
+                        for path in paths]}
+
+
+def print_results(report: Dict[str, Any]) -> None:
+    """ Print the benchmark results in <report> as a table.
+    """
+    print("{:<32} {:>9} {:>6} {:>6} {:>6} {:>9} {:>9} {:>8} {:>8}".format(
+        "file", "size", "ratio", "bits", "H", "c MB/s", "d MB/s",
+        "c MiB", "d MiB"))
+    for result in report["results"]:
+        print("{:<32} {:>9} {:>6.3f} {:>6.3f} {:>6.3f} {:>9.2f} {:>9.2f} "
+              "{:>8.1f} {:>8.1f}{}".format(
+                  result["file"], result["size"], result["ratio"],
+                  result["bits_per_symbol"], result["entropy"],
+                  result["compress"]["mb_per_s"],
+                  result["decompress"]["mb_per_s"],
+                  result["compress"]["peak_memory"] / 2 ** 20,
+                  result["decompress"]["peak_memory"] / 2 ** 20,
+                  "" if result["correct"] else "  MISMATCH"))
+
+
+def print_comparison(report: Dict[str, Any]) -> None:
+    """ Print the compression ratios and throughputs in <report> next to those
+    of plain Huffman coding in its "baseline" results.
+    """
+    print("{:<32} {:>8} {:>8} {:>9} {:>9} {:>9} {:>9}".format(
+        "file", "ratio", "base", "c MB/s", "base", "d MB/s", "base"))
+    for result, base in zip(report["results"], report["baseline"]):
+        print("{:<32} {:>8.3f} {:>8.3f} {:>9.2f} {:>9.2f} {:>9.2f} "
+              "{:>9.2f}".format(
+                  result["file"], result["ratio"], base["ratio"],
+                  result["compress"]["mb_per_s"],
+                  base["compress"]["mb_per_s"],
+                  result["decompress"]["mb_per_s"],
+                  base["decompress"]["mb_per_s"]))
+    total = sum(result["size"] for result in report["results"])
+    print("total: {} bytes compressed to {}, or {} with plain Huffman".format(
+        total, sum(result["compressed_size"] for result in report["results"]),
+        sum(base["compressed_size"] for base in report["baseline"])))
+
+
+def _parse_args(argv: List[str]) -> argparse.Namespace:
+    """ Return the command line arguments <argv>, parsed.
+    """
+    parser = argparse.ArgumentParser(
+        description="Benchmark compress_file and decompress_file.")
+    parser.add_argument("files", nargs="*",
+                        help="files to benchmark (default: files/*)")
+    parser.add_argument("--json", metavar="OUT",
+                        help="also write the results as JSON to OUT")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="runs per stage; the best time is kept")
+    parser.add_argument("--compare", action="store_true",
+                        help="compare with plain Huffman coding")
+    parser.add_argument("--streaming", action="store_true")
+    parser.add_argument("--canonical", action="store_true")
+    parser.add_argument("--block-size", type=int)
+    parser.add_argument("--processes", type=int)
+    parser.add_argument("--max-length", type=int)
+    parser.add_argument("--mmap", dest="use_mmap", action="store_true")
+    parser.add_argument("--context", action="store_true")
+    parser.add_argument("--lz77-window", type=int)
+    parser.add_argument("--lz77-effort", type=int)
+    parser.add_argument("--bwt-block-size", type=int)
+    return parser.parse_args(argv)
+
+
+def main(argv: List[str]) -> None:
+    """ Run the benchmarks described by the command line arguments <argv>.
+    """
+    args = _parse_args(argv)
+    paths = args.files or sorted(
+        os.path.join(FILES_DIR, name) for name in os.listdir(FILES_DIR))
+    options = {}
+    for name in ("streaming", "canonical", "block_size", "processes",
+                 "max_length", "use_mmap", "context", "lz77_window",
+                 "lz77_effort", "bwt_block_size"):
+        if getattr(args, name) not in (None, False):
+            options[name] = getattr(args, name)
+
+    report = run_benchmarks(paths, args.repeat, options)
+    print_results(report)
+    if args.compare:
+        report["baseline"] = run_benchmarks(paths, args.repeat)["results"]
+        print()
+        print_comparison(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,306 @@
+"""
+The Burrows-Wheeler transform, move-to-front coding and run-length coding, as
+a reversible stage before Huffman coding, in the style of bzip2.
+
+The Burrows-Wheeler transform (BWT) sorts the rotations of a block of text and
+keeps the last byte of each. Bytes that come before similar contexts end up
+next to each other, so the result has long runs and few distinct bytes in
+each region. Move-to-front (MTF) coding then turns recently seen bytes into
+small numbers, mostly zeros, and run-length coding (RLE) shortens the runs,
+leaving data whose byte frequencies are skewed enough for an order-0 Huffman
+code to exploit.
+"""
+from __future__ import annotations
+from typing import List, Tuple
+from utils import bytes_to_int, int32_to_bytes
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# The default number of bytes of text transformed at a time. Sorting needs
+# about 50 bytes of working memory per byte of block with NumPy.
+BLOCK_SIZE = 1 << 22
+
+# The number of equal bytes after which RLE writes a count of the rest.
+RUN_LENGTH = 4
+
+
+def suffix_array(text: bytes) -> List[int]:
+    """ Return the starting positions of the suffixes of <text>, in sorted
+    order. A suffix that is a prefix of another comes first.
+
+    Suffixes are sorted by prefix doubling: after sorting them by their first
+    k bytes, the rank of each suffix among those gives a key for its first 2k
+    bytes together with the rank of the suffix k bytes later. Each round is a
+    sort, done by NumPy if it is installed, and there are at most log2 of the
+    length of <text> rounds.
+
+    >>> suffix_array(b'banana')
+    [5, 3, 1, 0, 4, 2]
+    """
+    n = len(text)
+    if n == 0:
+        return []
+    if np is not None:
+        return _suffix_array_numpy(text)
+    rank = list(text)
+    k = 1
+    while True:
+        keys = [(rank[i], rank[i + k] + 1 if i + k < n else 0)
+                for i in range(n)]
+        order = sorted(range(n), key=keys.__getitem__)
+        rank[order[0]] = 0
+        for j in range(1, n):
+            rank[order[j]] = rank[order[j - 1]] + \
+                (keys[order[j]] != keys[order[j - 1]])
+        if rank[order[-1]] == n - 1:
+            return order
+        k *= 2
+
+
+def _suffix_array_numpy(text: bytes) -> List[int]:
+    """ Return suffix_array(<text>), computed with NumPy.
+
+    Precondition: <text> is not empty.
+    """
+    n = len(text)
+    # ranks must be below n + 1 for the keys below
+    rank = np.unique(np.frombuffer(text, np.uint8),
+                     return_inverse=True)[1].astype(np.int64)
+    k = 1
+    while True:
+        # the rank of the suffix k bytes later, plus 1, or 0 past the end
+        later = np.zeros(n, np.int64)
+        later[:n - k] = rank[k:] + 1
+        keys = rank * (n + 1) + later
+        order = np.argsort(keys, kind="stable")
+        sorted_keys = keys[order]
+        rank = np.empty(n, np.int64)
+        rank[order] = np.concatenate(
+            ([0], np.cumsum(sorted_keys[1:] != sorted_keys[:-1])))
+        if rank[order[-1]] == n - 1 or k >= n:
+            return order.tolist()
+        k *= 2
+
+
+def bwt(text: bytes) -> Tuple[bytes, int]:
+    """ Return the Burrows-Wheeler transform of <text>, and its primary index.
+
+    The rotations of <text> followed by an end marker, which sorts before every
+    byte, are sorted, and the transform is the last byte of each rotation,
+    leaving out the end marker. The primary index is the position where the end
+    marker was left out, which inverse_bwt needs.
+
+    >>> bwt(b'banana')
+    (b'annbaa', 4)
+    """
+    if not text:
+        return b'', 0
+    result = bytearray([text[-1]])
+    primary = 0
+    for i, start in enumerate(suffix_array(text)):
+        if start == 0:
+            primary = i + 1
+        else:
+            result.append(text[start - 1])
+    return bytes(result), primary
+
+
+def inverse_bwt(data: bytes, primary: int) -> bytes:
+    """ Return the text whose Burrows-Wheeler transform is <data> with the
+    primary index <primary>.
+
+    >>> inverse_bwt(b'annbaa', 4)
+    b'banana'
+    """
+    n = len(data)
+    if n == 0:
+        return b''
+    # the last column, with the end marker back in as the smallest key
+    if np is not None:
+        keys = np.insert(np.frombuffer(data, np.uint8).astype(np.int16) + 1,
+                         primary, 0)
+        order = np.argsort(keys, kind="stable").tolist()
+    else:
+        keys = [b + 1 for b in data]
+        keys.insert(primary, 0)
+        order = sorted(range(n + 1), key=keys.__getitem__)
+    # sorted row k moved one byte to the left is row order[k], and starts
+    # with the byte keys[order[order[k]]], so following order from the row
+    # that starts with the end marker reads the text from the start
+    result = bytearray(n)
+    row = 0
+    for i in range(n):
+        row = order[row]
+        result[i] = keys[order[row]] - 1
+    return bytes(result)
+
+
+def mtf(data: bytes) -> bytes:
+    """ Return the move-to-front coding of <data>: each byte is replaced by its
+    position in a list of all bytes, and then moved to the front of the list.
+
+    >>> list(mtf(b'aaabbb'))
+    [97, 0, 0, 98, 0, 0]
+    """
+    order = bytearray(range(256))
+    result = bytearray(len(data))
+    for i, b in enumerate(data):
+        j = order.index(b)
+        result[i] = j
+        if j:
+            del order[j]
+            order.insert(0, b)
+    return bytes(result)
+
+
+def inverse_mtf(data: bytes) -> bytes:
+    """ Return the bytes whose move-to-front coding is <data>.
+
+    >>> inverse_mtf(bytes([97, 0, 0, 98, 0, 0]))
+    b'aaabbb'
+    """
+    order = bytearray(range(256))
+    result = bytearray(len(data))
+    for i, j in enumerate(data):
+        b = order[j]
+        result[i] = b
+        if j:
+            del order[j]
+            order.insert(0, b)
+    return bytes(result)
+
+
+def rle(data: bytes) -> bytes:
+    """ Return the run-length coding of <data>: after RUN_LENGTH equal bytes,
+    a byte counts how many more times, up to 255, the byte repeats.
+
+    >>> list(rle(bytes([0] * 10 + [1])))
+    [0, 0, 0, 0, 6, 1]
+    """
+    result = bytearray()
+    i, n = 0, len(data)
+    while i < n:
+        b = data[i]
+        j = i + 1
+        while j < n and j - i < RUN_LENGTH + 255 and data[j] == b:
+            j += 1
+        run = j - i
+        if run < RUN_LENGTH:
+            result += data[i:j]
+        else:
+            result += data[i:i + RUN_LENGTH]
+            result.append(run - RUN_LENGTH)
+        i = j
+    return bytes(result)
+
+
+def inverse_rle(data: bytes) -> bytes:
+    """ Return the bytes whose run-length coding is <data>.
+
+    >>> list(inverse_rle(bytes([0, 0, 0, 0, 6, 1])))
+    [0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 1]
+    """
+    result = bytearray()
+    i, n = 0, len(data)
+    while i < n:
+        b = data[i]
+        j = i + 1
+        while j < n and j - i < RUN_LENGTH and data[j] == b:
+            j += 1
+        result += data[i:j]
+        if j - i == RUN_LENGTH and j < n:
+            result += bytes([b]) * data[j]
+            j += 1
+        i = j
+    return bytes(result)
+
+
+def transform(text: bytes, block_size: int = BLOCK_SIZE) -> bytes:
+    """ Return <text> with BWT, MTF and RLE applied to each block of
+    <block_size> bytes. Each block starts with the size of its coded form and
+    its primary index.
+
+    >>> text = b'mississippi' * 10
+    >>> inverse_transform(transform(text, 16)) == text
+    True
+    """
+    result = bytearray()
+    for start in range(0, len(text), block_size):
+        data, primary = bwt(text[start:start + block_size])
+        data = rle(mtf(data))
+        result += int32_to_bytes(len(data)) + int32_to_bytes(primary) + data
+    return bytes(result)
+
+
+def inverse_transform(data: bytes) -> bytes:
+    """ Return the text whose transform is <data>.
+    """
+    inverse = InverseTransform()
+    result = inverse.decode(data)
+    if inverse.pending:
+        raise ValueError("The data ends in the middle of a block")
+    return result
+
+
+class InverseTransform:
+    """ An inverse of transform that may be given the transformed data in
+    consecutive pieces. The text of each block is returned as soon as the whole
+    block has been given, so only one block is held in memory at a time.
+
+    Public Attributes:
+    ===========
+    pending: the number of bytes given that are not yet part of a whole block
+    """
+    pending: int
+    # === Private Attributes ===
+    # _buffer: the bytes given of the blocks not yet inverted
+    _buffer: bytearray
+
+    def __init__(self) -> None:
+        """ Create a new inverse transform, given no data yet."""
+        self._buffer = bytearray()
+        self.pending = 0
+
+    def decode(self, data: bytes) -> bytes:
+        """ Return the text of the blocks completed by <data>, which follows
+        the data given so far.
+
+        >>> data = transform(b'banana' * 3, 6)
+        >>> inverse = InverseTransform()
+        >>> inverse.decode(data[:20]), inverse.pending
+        (b'banana', 6)
+        >>> inverse.decode(data[20:])
+        b'bananabanana'
+        """
+        buffer = self._buffer
+        buffer += data
+        result = bytearray()
+        pos = 0
+        while len(buffer) - pos >= 8:
+            size = bytes_to_int(buffer[pos:pos + 4])
+            if len(buffer) - pos - 8 < size:
+                break
+            primary = bytes_to_int(buffer[pos + 4:pos + 8])
+            pos += 8
+            result += inverse_bwt(
+                inverse_mtf(inverse_rle(bytes(buffer[pos:pos + size]))),
+                primary)
+            pos += size
+        del buffer[:pos]
+        self.pending = len(buffer)
+        return bytes(result)
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
+
+    import python_ta
+    python_ta.check_all(config={
+        'allowed-import-modules': [
+            'python_ta', 'doctest', '__future__', 'typing', 'utils', 'numpy'
+        ]
+    })
@@ -14,10 +14,98 @@ Copyright (c) 2020 Bogdan Simion, Michael Liut, Paul Vrbik, Dan Zingaro
 """
 from __future__ import annotations
 import time
-from typing import Dict, Tuple
+import io
+import os
+import functools
+import heapq
+import mmap
+import contextlib
+import copy
+import shutil
+import multiprocessing
+import zlib
+from collections import deque
+from typing import Dict, List, Tuple, Optional, Callable, Iterable, \
+    Iterator, BinaryIO, ContextManager, Union
 from utils import *
-from huffman import HuffmanTree
-
+from huffman import HuffmanTree, TreeArrays
+from stats import Stats, StageStats
+import adaptive
+import lz77
+import bwt
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# The number of bytes read from or written to a file at a time when
+# compressing or decompressing in chunks.
+CHUNK_SIZE = 1 << 16
+
+# Files in the assignment format start with the number of tree nodes, which is
+# never 0. Files in any other format start with FORMAT_MARKER followed by a
+# byte saying which format they are in.
+FORMAT_MARKER = 0
+# Independently compressed blocks, described by a block index in the header.
+FORMAT_BLOCKS = 1
+# Canonical codes, described by their code lengths in the header.
+FORMAT_CANONICAL = 2
+# A seek index for random access, followed by a stream in the assignment
+# format or FORMAT_CANONICAL.
+FORMAT_INDEXED = 3
+# An adaptive Huffman code (see adaptive.py), with no header and an end marker.
+FORMAT_ADAPTIVE = 4
+# The original data, stored uncompressed.
+FORMAT_STORED = 5
+# Order-1 context modelling: a code for each preceding byte.
+FORMAT_CONTEXT = 6
+# An LZ77 stage before Huffman coding of its literals, lengths and distances.
+FORMAT_LZ77 = 7
+# Huffman coding after a Burrows-Wheeler transform, MTF and RLE stage.
+FORMAT_BWT = 8
+# A multi-file archive (see archive.py), which decompress_file cannot read.
+FORMAT_ARCHIVE = 9
+# Huffman coding with a pre-trained codebook, referenced by its ID.
+FORMAT_CODEBOOK = 10
+
+# The default number of bytes of input in each block of FORMAT_BLOCKS.
+BLOCK_SIZE = 1 << 20
+
+# When choosing a format automatically, data is stored uncompressed unless
+# Huffman coding is expected to save at least MIN_SAVING of its size.
+MIN_SAVING = 0.02
+
+# The options of compress_file that choose a coder other than a Huffman tree,
+# of which at most one can be given, and none with the TREE_OPTIONS, which
+# only apply to a Huffman tree. Neither can the pairs INCOMPATIBLE_OPTIONS.
+CODER_OPTIONS = ("adaptive_code", "context", "lz77_window", "bwt_block_size",
+                 "codebook")
+TREE_OPTIONS = ("streaming", "block_size", "processes", "canonical",
+                "max_length", "use_mmap", "index_interval")
+INCOMPATIBLE_OPTIONS = (("adaptive_code", "auto_select"),
+                        ("block_size", "streaming"),
+                        ("block_size", "index_interval"))
+
+# Whether to count frequencies and encode text with NumPy. It is used when it
+# is installed, and the results are the same either way.
+USE_NUMPY = np is not None
+# The number of bytes of text encoded at a time with NumPy, which needs about
+# 40 bytes of working memory per byte of text.
+NUMPY_SLICE = 1 << 20
+
+# The most contexts given their own code in FORMAT_CONTEXT. This bounds the
+# size of the decoding table.
+MAX_CONTEXT_CODES = 64
+
+# The longest code in FORMAT_LZ77, which sets the size of its decoding tables.
+LZ77_MAX_LENGTH = 15
+
+# The directory where trained codebooks are saved, and the longest code in a
+# codebook.
+CODEBOOK_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            "codebooks")
+CODEBOOK_MAX_LENGTH = 16
 
 # ====================
 # Functions for compression
@@ -32,6 +120,14 @@ def build_frequency_dict(text: bytes) -> Dict[int, int]:
     True
     """
     # TODO: Implement this function
+    if USE_NUMPY:
+        counts = np.bincount(np.frombuffer(text, np.uint8), minlength=256)
+        # keep the symbols in order of first appearance, as below; each
+        # search stops at the symbol's first occurrence, usually near the
+        # start of the text
+        symbols = sorted(np.flatnonzero(counts).tolist(),
+                         key=lambda s: text.find(bytes([s])))
+        return {symbol: int(counts[symbol]) for symbol in symbols}
     dict_b = {}
     for b in text:
         if b in dict_b:
@@ -41,10 +137,24 @@ def build_frequency_dict(text: bytes) -> Dict[int, int]:
     return dict_b
 
 
-def build_huffman_tree(freq_dict: Dict[int, int]) -> HuffmanTree:
+def build_huffman_tree(freq_dict: Dict[int, int],
+                       presorted: bool = False,
+                       max_length: Optional[int] = None) -> HuffmanTree:
     """ Return the Huffman tree corresponding to the frequency dictionary
     <freq_dict>.
 
+    The two least frequent trees are merged first. Ties are broken in favour
+    of the tree created first, where leaves are created in the order of
+    <freq_dict> before any merged tree, so the result is deterministic.
+
+    If <presorted> is True, <freq_dict> must be in order of nondecreasing
+    frequency, and the tree is built in linear time with two queues. The
+    result is the same as without <presorted>.
+
+    If <max_length> is given and some code of the Huffman tree would be longer
+    than <max_length> bits, return instead the tree of the optimal codes whose
+    lengths are at most <max_length> (see limited_code_lengths).
+
     Precondition: freq_dict is not empty.
 
     >>> freq = {2: 6, 3: 4}
@@ -78,52 +188,218 @@ def build_huffman_tree(freq_dict: Dict[int, int]) -> HuffmanTree:
             left = HuffmanTree(item)
             right = HuffmanTree((item + 1) % 256)
         return HuffmanTree(None, left, right)
+    elif max_length is not None:
+        tree = build_huffman_tree(freq_dict, presorted)
+        if max(code_lengths(tree).values()) <= max_length:
+            return tree
+        return tree_from_codes(
+            canonical_codes(limited_code_lengths(freq_dict, max_length)))
+    elif presorted:
+        return _build_huffman_tree_sorted(freq_dict)
     else:  # freq_dict has more than one item.
-        lst = []  # list of tuple where (freq, node)
+        # the nodes are built directly in one set of arrays; a node's index
+        # is also its creation order
+        arrays = TreeArrays()
+        heap = []  # list of tuple where (freq, node)
         for value in freq_dict:
-            lst.append((freq_dict[value], HuffmanTree(value)))
-        lst.sort(reverse=True)
+            heap.append((freq_dict[value], arrays.add(value)))
+        heapq.heapify(heap)
+
+        while len(heap) > 1:
+            left_f, left = heapq.heappop(heap)
+            right_f, right = heapq.heappop(heap)
+            heapq.heappush(heap, (left_f + right_f, arrays.join(left, right)))
+
+        return arrays.view(heap[0][1])
+
+
+def _build_huffman_tree_sorted(freq_dict: Dict[int, int]) -> HuffmanTree:
+    """ Return the Huffman tree corresponding to the frequency dictionary
+    <freq_dict>, which is in order of nondecreasing frequency.
+
+    Merged trees are created in order of nondecreasing frequency too, so the
+    least frequent tree is always at the front of one of two queues: the
+    leaves, or the merged trees.
+
+    Precondition: freq_dict has more than one item.
+    """
+    arrays = TreeArrays()
+    leaves = deque()
+    for value in freq_dict:
+        leaves.append((freq_dict[value], arrays.add(value)))
+    merged = deque()
+
+    while len(leaves) + len(merged) > 1:
+        left_f, left = _pop_least(leaves, merged)
+        right_f, right = _pop_least(leaves, merged)
+        merged.append((left_f + right_f, arrays.join(left, right)))
 
-        while len(lst) > 1:
-            left_f, left = lst.pop()
-            right_f, right = lst.pop()
+    return arrays.view(merged.pop()[1])
 
-            tree = HuffmanTree(None, left, right)
-            new_f = left_f + right_f
-            lst.append((new_f, tree))
-            lst.sort(reverse=True)
 
-        return lst.pop()[1]
+def _pop_least(leaves: deque, merged: deque) -> Tuple[int, int]:
+    """ Remove and return the least frequent (freq, node) pair at the front of
+    <leaves> or <merged>, preferring <leaves> on a tie.
+    """
+    if not merged or (leaves and leaves[0][0] <= merged[0][0]):
+        return leaves.popleft()
+    return merged.popleft()
+
+
+def limited_code_lengths(freq_dict: Dict[int, int],
+                         max_length: int) -> Dict[int, int]:
+    """ Return the code lengths of an optimal prefix code for the frequency
+    dictionary <freq_dict> in which no code is longer than <max_length> bits.
+
+    This is the package-merge algorithm. Starting from the symbols sorted by
+    frequency, the list for the next code length is the symbols merged with
+    the packages made by pairing up consecutive items of the previous list.
+    After <max_length> lists, the length of each symbol's code is the number
+    of times it occurs in the first 2n - 2 items, for n symbols.
+
+    Precondition: freq_dict has more than one item, and no more than
+    2 ** max_length items.
+
+    >>> freq = {1: 1, 2: 1, 3: 2, 4: 4, 5: 8}
+    >>> d = code_lengths(build_huffman_tree(freq))
+    >>> d == {1: 4, 2: 4, 3: 3, 4: 2, 5: 1}
+    True
+    >>> d = limited_code_lengths(freq, 3)
+    >>> d == {1: 3, 2: 3, 3: 3, 4: 3, 5: 1}
+    True
+    """
+    if len(freq_dict) > 1 << max_length:
+        raise ValueError("Cannot code {} symbols in at most {} bits".format(
+            len(freq_dict), max_length))
+    # Each item is a (weight, symbol) leaf or a (weight, (item, item))
+    # package; leaves come first among items of equal weight.
+    leaves = sorted([(freq_dict[value], value) for value in freq_dict],
+                    key=lambda item: item[0])
+    items = leaves
+    for _ in range(max_length - 1):
+        packages = [(items[i][0] + items[i + 1][0], (items[i], items[i + 1]))
+                    for i in range(0, len(items) - 1, 2)]
+        items = list(heapq.merge(leaves, packages, key=lambda item: item[0]))
+
+    lengths = dict.fromkeys(freq_dict, 0)
+    stack = items[:2 * len(freq_dict) - 2]
+    while stack:
+        _, content = stack.pop()
+        if isinstance(content, tuple):
+            stack.extend(content)
+        else:
+            lengths[content] += 1
+    return lengths
+
 
+def tree_from_codes(codes: Dict[int, str]) -> HuffmanTree:
+    """ Return the Huffman tree whose codes are <codes>.
 
-def get_codes(tree: HuffmanTree) -> Dict[int, str]:
+    Precondition: <codes> is a complete prefix code with no empty codes.
+
+    >>> tree_from_codes({9: "0", 2: "10", 3: "11"})
+    HuffmanTree(None, HuffmanTree(9, None, None), \
+HuffmanTree(None, HuffmanTree(2, None, None), HuffmanTree(3, None, None)))
+    """
+    arrays = TreeArrays()
+    root = arrays.add(None)
+    for symbol in codes:
+        node = root
+        for bit in codes[symbol]:
+            if arrays.left[node] == -1:
+                left, right = arrays.add(None), arrays.add(None)
+                arrays.left[node], arrays.right[node] = left, right
+                arrays.parent[left] = arrays.parent[right] = node
+            node = arrays.right[node] if bit == "1" else arrays.left[node]
+        arrays.symbol[node] = symbol
+    return arrays.view(root)
+
+
+def get_codes(tree: HuffmanTree, canonical: bool = False) -> Dict[int, str]:
     """ Return a dictionary which maps symbols from the Huffman tree <tree>
     to codes.
 
+    If <canonical> is True, return the canonical codes with the same code
+    lengths as the tree's (see canonical_codes) instead.
+
     >>> tree = HuffmanTree(None, HuffmanTree(3), HuffmanTree(2))
     >>> d = get_codes(tree)
     >>> d == {3: "0", 2: "1"}
     True
+    >>> d = get_codes(tree, True)
+    >>> d == {2: "0", 3: "1"}
+    True
     """
     # TODO: Implement this function
-    if tree.symbol is None and tree.left is None and tree.right is None:
-        return {}
-    else:
-        code_map = {}
-        _get_codes_helper(tree, code_map, '')
-        return code_map
+    if canonical:
+        return canonical_codes(code_lengths(tree))
+    # the codes are cached by the tree's arrays until a node in it changes
+    return dict(tree.arrays.codes(tree.index))
 
 
-def _get_codes_helper(tree: HuffmanTree, code_map: dict, curr_code: str) ->\
-        None:
-    """ Helper function for get_codes. Recursively goes through the tree and
-    creates a code for each leaf.
+def code_lengths(tree: HuffmanTree) -> Dict[int, int]:
+    """ Return a dictionary which maps symbols from the Huffman tree <tree>
+    to the lengths of their codes.
+
+    >>> left = HuffmanTree(None, HuffmanTree(3), HuffmanTree(2))
+    >>> tree = HuffmanTree(None, left, HuffmanTree(9))
+    >>> code_lengths(tree) == {3: 2, 2: 2, 9: 1}
+    True
     """
-    if tree.is_leaf():
-        code_map[tree.symbol] = curr_code
+    codes = tree.arrays.codes(tree.index)
+    lengths = {}
+    for symbol in codes:
+        lengths[symbol] = len(codes[symbol])
+    return lengths
+
+
+def canonical_codes(lengths: Dict[int, int]) -> Dict[int, str]:
+    """ Return the canonical Huffman codes for the code lengths <lengths>.
+
+    Symbols are sorted by code length and then by symbol. The first symbol gets
+    the code made of zeroes, and each following symbol gets the previous code
+    plus one, with zeroes appended to the right to reach its length. The codes
+    are determined by their lengths alone, so only the lengths need to be
+    stored to rebuild them.
+
+    Precondition: <lengths> are the code lengths of a prefix code.
+
+    >>> d = canonical_codes({3: 2, 2: 2, 9: 1})
+    >>> d == {9: "0", 2: "10", 3: "11"}
+    True
+    """
+    codes = {}
+    code, prev_length = 0, 0
+    for symbol in sorted(lengths, key=lambda s: (lengths[s], s)):
+        code <<= lengths[symbol] - prev_length
+        prev_length = lengths[symbol]
+        codes[symbol] = format(code, "0{}b".format(prev_length))
+        code += 1
+    return codes
+
+
+def lengths_to_bytes(lengths: Dict[int, int]) -> bytes:
+    """ Return a bytes representation of the code lengths <lengths>.
+
+    The first byte is the number of symbols, followed by a (symbol, length)
+    pair for each symbol. When that would take more than 256 bytes, the first
+    byte is 0 instead, followed by the length of each of the 256 symbols (0 for
+    symbols without a code).
+
+    >>> list(lengths_to_bytes({3: 2, 2: 2, 9: 1}))
+    [3, 2, 2, 3, 2, 9, 1]
+    >>> len(lengths_to_bytes(dict.fromkeys(range(200), 8)))
+    257
+    """
+    if 2 * len(lengths) <= 256:
+        result = [len(lengths)]
+        for symbol in sorted(lengths):
+            result.extend([symbol, lengths[symbol]])
     else:
-        _get_codes_helper(tree.left, code_map, curr_code + '0')
-        _get_codes_helper(tree.right, code_map, curr_code + '1')
+        result = [0] * 257
+        for symbol in lengths:
+            result[symbol + 1] = lengths[symbol]
+    return bytes(result)
 
 
 def number_nodes(tree: HuffmanTree) -> None:
@@ -142,21 +418,9 @@ def number_nodes(tree: HuffmanTree) -> None:
     2
     """
     # TODO: Implement this function
-    if not tree.is_leaf():
-        _number_nodes_helper(tree, 0)
-
-
-def _number_nodes_helper(tree: HuffmanTree, num_node: int) -> int:
-    """ Helper function for number_nodes. Numbers each internal node in
-    postorder starting at 0, until all internal nodes have been numbered.
-
-    """
-    if not tree.left.is_leaf():
-        num_node = _number_nodes_helper(tree.left, num_node)
-    if not tree.right.is_leaf():
-        num_node = _number_nodes_helper(tree.right, num_node)
-    tree.number = num_node
-    return num_node + 1
+    arrays = tree.arrays
+    for number, node in enumerate(arrays.postorder(tree.index)):
+        arrays.number[node] = number
 
 
 def avg_length(tree: HuffmanTree, freq_dict: Dict[int, int]) -> float:
@@ -179,7 +443,7 @@ def avg_length(tree: HuffmanTree, freq_dict: Dict[int, int]) -> float:
     if freq_dict == {}:
         return 0
 
-    code_map = get_codes(tree)
+    code_map = tree.arrays.codes(tree.index)
     all_symbol_freq = 0
     for value in freq_dict:
         if value in code_map:
@@ -193,6 +457,143 @@ def avg_length(tree: HuffmanTree, freq_dict: Dict[int, int]) -> float:
     return weighted_sum_symbols / all_symbol_freq
 
 
+class HuffmanEncoder:
+    """ An encoder of text using the mapping from a dictionary of codes.
+
+    Text may be fed to the encoder in consecutive pieces: the bits of a final,
+    incomplete byte are held back and written before the bits of the next
+    piece, so the concatenated output is the same as for the whole text.
+
+    When USE_NUMPY is set, codes are looked up and packed into bytes for a
+    whole slice of text at once with NumPy, unless some code is too long to
+    fit in a 64-bit integer.
+
+    Public Attributes:
+    ===========
+    num_bits: the number of bits of compressed text produced so far, including
+        the bits held back
+    """
+    num_bits: int
+    # === Private Attributes ===
+    # _table: the (code as an integer, code length) of each byte, or None for
+    #     bytes without a code
+    # _values, _lengths: NumPy arrays of the code and code length of each byte
+    #     (0 for bytes without a code), or None when NumPy is not used
+    # _carry: the bits of the last incomplete byte
+    # _carry_bits: the number of bits in _carry
+    _table: List[Optional[Tuple[int, int]]]
+    _values: Optional[np.ndarray]
+    _lengths: Optional[np.ndarray]
+    _carry: int
+    _carry_bits: int
+
+    def __init__(self, codes: Dict[int, str]) -> None:
+        """ Create a new encoder for the mapping <codes>."""
+        self._table = [None] * 256
+        for symbol in codes:
+            code = codes[symbol]
+            self._table[symbol] = (int(code, 2) if code else 0, len(code))
+        self._carry, self._carry_bits = 0, 0
+        self.num_bits = 0
+
+        self._values, self._lengths = None, None
+        if USE_NUMPY and all(len(codes[s]) < 63 for s in codes):
+            self._values = np.zeros(256, np.int64)
+            self._lengths = np.zeros(256, np.int64)
+            for symbol in codes:
+                self._values[symbol], self._lengths[symbol] = \
+                    self._table[symbol]
+
+    def encode(self, text: bytes) -> bytes:
+        """ Return the complete bytes of the compressed form of <text>,
+        following the text encoded so far.
+
+        >>> encoder = HuffmanEncoder({0: "0", 1: "10", 2: "11"})
+        >>> [byte_to_bits(byte) for byte in encoder.encode(bytes([1, 2]))]
+        []
+        >>> [byte_to_bits(byte) for byte in encoder.encode(bytes([1, 0, 2]))]
+        ['10111001']
+        >>> [byte_to_bits(byte) for byte in encoder.flush()]
+        ['10000000']
+        """
+        if self._values is not None:
+            return b''.join([self._encode_numpy(text[i:i + NUMPY_SLICE])
+                             for i in range(0, len(text), NUMPY_SLICE)])
+
+        table = self._table
+        freq = build_frequency_dict(text)
+        num_bits = self._carry_bits + sum(
+            table[symbol][1] * freq[symbol] for symbol in freq
+            if table[symbol] is not None)
+
+        writer = BitWriter(num_bits)
+        write = writer.write
+        write(self._carry, self._carry_bits)
+        for byte in text:
+            if table[byte] is not None:
+                write(*table[byte])
+        return self._hold_back(writer.getvalue(), num_bits)
+
+    def _encode_numpy(self, text: bytes) -> bytes:
+        """ Return the complete bytes of the compressed form of <text> as in
+        encode, computed with NumPy.
+
+        """
+        symbols = np.frombuffer(text, np.uint8)
+        result, num_bits = _pack_codes(
+            self._values[symbols], self._lengths[symbols],
+            self._carry, self._carry_bits)
+        return self._hold_back(result, num_bits)
+
+    def _hold_back(self, result: bytes, num_bits: int) -> bytes:
+        """ Return <result>, which holds <num_bits> bits padded to a whole
+        number of bytes, without its last incomplete byte, which is kept to be
+        written before the next piece of text.
+        """
+        self.num_bits += num_bits - self._carry_bits
+        self._carry_bits = num_bits % 8
+        if self._carry_bits:
+            self._carry = result[-1] >> (8 - self._carry_bits)
+            return result[:-1]
+        self._carry = 0
+        return result
+
+    def flush(self) -> bytes:
+        """ Return the last incomplete byte, padded with zeroes to the right,
+        or no bytes if the encoded text ends on a byte boundary.
+        """
+        if not self._carry_bits:
+            return b''
+        result = bytes([self._carry << (8 - self._carry_bits) & 0xFF])
+        self._carry, self._carry_bits = 0, 0
+        return result
+
+
+def _pack_codes(values: np.ndarray, lengths: np.ndarray, carry: int = 0,
+                carry_bits: int = 0) -> Tuple[bytes, int]:
+    """ Return the codes with the given <values> and <lengths>, written one
+    after the other after the <carry_bits> bits of <carry> and padded with
+    zeroes to a whole number of bytes, together with the number of bits
+    written. The work is done with NumPy.
+
+    Every bit of output gets one byte of a working array: bit j of each code is
+    placed at the code's starting position plus j, for each j up to the longest
+    code length, and the array is then packed into bytes.
+
+    Precondition: no length is more than 62.
+    """
+    starts = np.cumsum(lengths) - lengths + carry_bits
+    num_bits = carry_bits + int(lengths.sum())
+
+    bits = np.zeros(num_bits, np.uint8)
+    for j in range(carry_bits):
+        bits[j] = carry >> (carry_bits - 1 - j) & 1
+    for j in range(int(lengths.max(initial=0))):
+        mask = lengths > j
+        bits[starts[mask] + j] = values[mask] >> (lengths[mask] - 1 - j) & 1
+    return np.packbits(bits).tobytes(), num_bits
+
+
 def compress_bytes(text: bytes, codes: Dict[int, str]) -> bytes:
     """ Return the compressed form of <text>, using the mapping from <codes>
     for each symbol.
@@ -210,9 +611,8 @@ def compress_bytes(text: bytes, codes: Dict[int, str]) -> bytes:
     ['10111001', '10000000']
     """
     # TODO: Implement this function
-    ans = ''.join([codes[byte] for byte in text if byte in codes])
-    ans_b = [bits_to_byte(ans[i:i + 8]) for i in range(0, len(ans), 8)]
-    return bytes(ans_b)
+    encoder = HuffmanEncoder(codes)
+    return encoder.encode(text) + encoder.flush()
 
 
 def tree_to_bytes(tree: HuffmanTree) -> bytes:
@@ -242,56 +642,465 @@ def tree_to_bytes(tree: HuffmanTree) -> bytes:
     1, 3, 1, 2, 1, 4]
     """
     # TODO: Implement this function
-    if tree.symbol is None and tree.left is None and tree.right is None:
-        return bytes([])
-    else:
-        byte_l = []
-        _tree_to_byte_helper(byte_l, tree)
-        return bytes(byte_l)
+    arrays = tree.arrays
+    byte_l = []
+    for node in arrays.postorder(tree.index):
+        for child in (arrays.left[node], arrays.right[node]):
+            if arrays.is_leaf(child):
+                byte_l.extend([0, arrays.symbol[child]])
+            else:
+                byte_l.extend([1, arrays.number[child]])
+    return bytes(byte_l)
+
+
+def tree_header(tree: HuffmanTree,
+                 canonical: bool) -> Tuple[bytes, Dict[int, str]]:
+    """ Return the header describing the codes of the Huffman tree <tree>,
+    and those codes.
+
+    The header is the tree itself, as in the assignment format, or if
+    <canonical> is True, FORMAT_MARKER, FORMAT_CANONICAL and the code lengths
+    of the canonical codes.
+    """
+    if canonical:
+        lengths = code_lengths(tree)
+        return (bytes([FORMAT_MARKER, FORMAT_CANONICAL]) +
+                lengths_to_bytes(lengths), canonical_codes(lengths))
+    codes = get_codes(tree)
+    number_nodes(tree)
+    return tree.num_nodes_to_bytes() + tree_to_bytes(tree), codes
+
+
+def compress_file(in_file: str, out_file: str,
+                  streaming: bool = False,
+                  block_size: Optional[int] = None,
+                  processes: Optional[int] = None,
+                  canonical: bool = False,
+                  max_length: Optional[int] = None,
+                  use_mmap: bool = False,
+                  index_interval: Optional[int] = None,
+                  adaptive_code: bool = False,
+                  auto_select: bool = False,
+                  context: bool = False,
+                  lz77_window: Optional[int] = None,
+                  lz77_effort: int = lz77.EFFORT,
+                  bwt_block_size: Optional[int] = None,
+                  codebook: Optional[int] = None,
+                  stats: Optional[Stats] = None) -> None:
+    """ Compress contents of the file <in_file> and store results in <out_file>.
+    Both <in_file> and <out_file> are string objects representing the names of
+    the input and output files.
 
+    If <streaming> is True, <in_file> is read twice in chunks of CHUNK_SIZE
+    bytes, once to count the symbol frequencies and once to encode them, so
+    memory use does not depend on the size of the file. The output is the same
+    either way.
+
+    If <block_size> is given, <in_file> is instead split into blocks of
+    <block_size> bytes that are compressed independently, each with its own
+    tree, by a pool of <processes> worker processes (by default, one per CPU).
+
+    If <canonical> is True, canonical codes are used, and the header stores
+    only their code lengths instead of the tree.
+
+    If <max_length> is given, no code is longer than <max_length> bits (see
+    build_huffman_tree), which bounds the size of decoding tables at a small
+    cost in compression.
+
+    If <use_mmap> is True, <in_file> is read through a memory map instead of
+    being copied into memory, and it is compressed in streaming or block mode
+    (streaming mode if no <block_size> is given).
+
+    If <index_interval> is given, the file starts with a seek index that
+    records where decoding can resume every <index_interval> bytes of original
+    data, so that ranges can be read back with decompress_range. The file is
+    compressed in streaming mode, and <block_size> must not be given. Raise a
+    ValueError if <index_interval> is not positive.
+
+    If <adaptive_code> is True, an adaptive Huffman code is used instead, and
+    none of the other options can be given. The input is read and compressed
+    in a single pass, and each piece of output is written as soon as its input
+    has been read, so <in_file> may also be a pipe.
+
+    If <auto_select> is True, data that Huffman coding would not shrink by at
+    least MIN_SAVING, such as data that is already compressed, is stored
+    uncompressed instead (see is_compressible). In block mode this is decided
+    for each block from its frequencies, and otherwise from the frequencies of
+    the whole file.
+
+    If <context> is True, an order-1 context model is used instead (see
+    compress_context), reading the whole file into memory, and of the other
+    options only <auto_select> can be given.
+
+    If <lz77_window> is given, repeated strings up to <lz77_window> bytes back
+    are replaced with matches first, searching as hard as the effort level
+    <lz77_effort> says (see compress_lz77). The whole file is read into
+    memory, and of the other options only <auto_select> can be given.
+
+    If <bwt_block_size> is given, each block of <bwt_block_size> bytes goes
+    through a Burrows-Wheeler transform, move-to-front and run-length coding
+    before Huffman coding (see compress_bwt). The whole file is read into
+    memory, and of the other options only <auto_select> can be given.
+
+    If <codebook> is given, the pre-trained codebook with that ID is used
+    instead of building a tree (see train_codebook), and the header only
+    refers to it. Of the other options, only <auto_select> can be given.
+
+    If <stats> is given, the time, bytes and memory of each stage are added to
+    it (see stats.py). Reading the whole file into memory, the stages are
+    "read", "frequencies", "tree", "codes", "encode" and "write". The modes
+    that read the file in pieces, or in other processes, have a single
+    "compress" stage instead. With <auto_select>, the frequencies of the
+    whole file are counted first, as the stage "select", and are not counted
+    again.
+
+    Raise a ValueError if options that cannot be combined are given together,
+    or <processes> is given without <block_size>, or <lz77_effort> without
+    <lz77_window>.
 
-def _tree_to_byte_helper(byte_l: list, tree: HuffmanTree) -> None:
-    """ Mutates byte_l to match the byte representation of tree_to_bytes.
+    Precondition: The contents of the file <in_file> are not empty.
+    """
+    _check_options([name for name, used in [
+        ("streaming", streaming), ("block_size", block_size is not None),
+        ("processes", processes is not None), ("canonical", canonical),
+        ("max_length", max_length is not None), ("use_mmap", use_mmap),
+        ("index_interval", index_interval is not None),
+        ("adaptive_code", adaptive_code), ("auto_select", auto_select),
+        ("context", context), ("lz77_window", lz77_window is not None),
+        ("lz77_effort", lz77_effort != lz77.EFFORT),
+        ("bwt_block_size", bwt_block_size is not None),
+        ("codebook", codebook is not None)] if used])
+    if index_interval is not None and index_interval <= 0:
+        raise ValueError("The index interval must be positive, not {}".format(
+            index_interval))
+    # the frequencies and size of the file, if auto_select counts them, so
+    # that the Huffman tree can be built without counting them again
+    counted = None
+    if auto_select and block_size is None and not adaptive_code:
+        # the frequencies of the whole file are needed: a sample may
+        # contain headers or other parts that compress better than the rest
+        with _stage(stats, "select") as record, open(in_file, "rb") as f:
+            counted = _file_frequencies(f)
+            freq, size = counted
+            record.bytes_in += size
+            stored = not is_compressible(freq)
+        if stored:
+            with _stage(stats, "compress") as record, \
+                    open(in_file, "rb") as f1, open(out_file, "wb") as f2:
+                f2.write(bytes([FORMAT_MARKER, FORMAT_STORED]))
+                shutil.copyfileobj(f1, f2, CHUNK_SIZE)
+                record.bytes_in += f1.tell()
+                record.bytes_out += f2.tell()
+            return
+    if context or lz77_window is not None or bwt_block_size is not None or \
+            codebook is not None:
+        text = _read_file(in_file, stats)
+        with _stage(stats, "compress") as record:
+            if codebook is not None:
+                result = compress_codebook(text, codebook)
+            elif context:
+                result = compress_context(text)
+            elif lz77_window is not None:
+                result = compress_lz77(text, lz77_window, lz77_effort)
+            else:
+                result = compress_bwt(text, bwt_block_size)
+            record.bytes_in += len(text)
+            record.bytes_out += len(result)
+        _write_file(out_file, result, stats)
+        return
+    if adaptive_code or block_size is not None or streaming or use_mmap or \
+            index_interval is not None:
+        with _stage(stats, "compress") as record:
+            if adaptive_code:
+                with open(in_file, "rb") as f1, open(out_file, "wb") as f2:
+                    f2.write(bytes([FORMAT_MARKER, FORMAT_ADAPTIVE]))
+                    adaptive.encode_stream(f1, f2)
+            elif block_size is not None:
+                _compress_file_blocks(in_file, out_file, block_size,
+                                      processes, canonical, max_length,
+                                      use_mmap, auto_select)
+            else:
+                _compress_file_streaming(in_file, out_file, canonical,
+                                         max_length, use_mmap, index_interval,
+                                         counted)
+            record.bytes_in += os.path.getsize(in_file)
+            record.bytes_out += os.path.getsize(out_file)
+        return
+    text = _read_file(in_file, stats)
+    if counted is None:
+        with _stage(stats, "frequencies") as record:
+            freq = build_frequency_dict(text)
+            record.bytes_in += len(text)
+    with _stage(stats, "tree"):
+        tree = build_huffman_tree(freq, max_length=max_length)
+    with _stage(stats, "codes") as record:
+        header, codes = tree_header(tree, canonical)
+        record.bytes_out += len(header)
+    _print_avg_length(tree, freq, max_length)
+    with _stage(stats, "encode") as record:
+        result = header + int32_to_bytes(len(text))
+        result += compress_bytes(text, codes)
+        record.bytes_in += len(text)
+        record.bytes_out += len(result) - len(header)
+    _write_file(out_file, result, stats)
+
+
+def _check_options(used: List[str]) -> None:
+    """ Raise a ValueError if two of the options of compress_file named in
+    <used> cannot be combined, or one of them is given without the option it
+    depends on.
+
+    >>> _check_options(["canonical", "block_size", "auto_select"])
+    >>> _check_options(["context", "canonical"])
+    Traceback (most recent call last):
+    ...
+    ValueError: The options context and canonical cannot be combined
+    """
+    pairs = list(INCOMPATIBLE_OPTIONS)
+    for i, coder in enumerate(CODER_OPTIONS):
+        pairs += [(coder, other)
+                  for other in CODER_OPTIONS[i + 1:] + TREE_OPTIONS]
+    for option, other in pairs:
+        if option in used and other in used:
+            raise ValueError("The options {} and {} cannot be combined"
+                             .format(option, other))
+    for option, needed in [("processes", "block_size"),
+                           ("lz77_effort", "lz77_window")]:
+        if option in used and needed not in used:
+            raise ValueError("The option {} needs {}".format(option, needed))
+
+
+def _stage(stats: Optional[Stats], name: str) -> ContextManager[StageStats]:
+    """ Return a context manager that measures the stage <name> in <stats>, or
+    if <stats> is None, only gives statistics for the stage to be discarded.
+    """
+    if stats is None:
+        return contextlib.nullcontext(StageStats(name))
+    return stats.stage(name)
 
+
+def _read_file(in_file: str, stats: Optional[Stats]) -> bytes:
+    """ Return the contents of <in_file>, as the stage "read" of <stats>.
     """
-    if not tree.left.is_leaf():
-        _tree_to_byte_helper(byte_l, tree.left)
-    if not tree.right.is_leaf():
-        _tree_to_byte_helper(byte_l, tree.right)
+    with _stage(stats, "read") as record, open(in_file, "rb") as f:
+        text = f.read()
+        record.bytes_out += len(text)
+    return text
 
-    if tree.left.is_leaf() and tree.right.is_leaf():
-        byte_l.extend([0, tree.left.symbol])
-        byte_l.extend([0, tree.right.symbol])
-    elif tree.left.is_leaf() and not tree.right.is_leaf():
-        byte_l.extend([0, tree.left.symbol])
-        byte_l.extend([1, tree.right.number])
-    elif not tree.left.is_leaf() and tree.right.is_leaf():
-        byte_l.extend([1, tree.left.number])
-        byte_l.extend([0, tree.right.symbol])
-    elif not tree.left.is_leaf() and not tree.right.is_leaf():
-        byte_l.extend([1, tree.left.number])
-        byte_l.extend([1, tree.right.number])
 
+def _write_file(out_file: str, data: bytes, stats: Optional[Stats]) -> None:
+    """ Write <data> to <out_file>, as the stage "write" of <stats>.
+    """
+    with _stage(stats, "write") as record, open(out_file, "wb") as f:
+        f.write(data)
+        record.bytes_in += len(data)
 
-def compress_file(in_file: str, out_file: str) -> None:
-    """ Compress contents of the file <in_file> and store results in <out_file>.
-    Both <in_file> and <out_file> are string objects representing the names of
-    the input and output files.
 
-    Precondition: The contents of the file <in_file> are not empty.
+def is_compressible(freq_dict: Dict[int, int]) -> bool:
+    """ Return True iff Huffman coding text with the symbols and frequencies
+    in <freq_dict> is expected to save at least MIN_SAVING of its size,
+    counting the bits of the codes and about 4 bytes of header per symbol.
+
+    >>> is_compressible({65: 90, 66: 10})
+    True
+    >>> is_compressible(dict.fromkeys(range(256), 100))
+    False
+    """
+    total = sum(freq_dict.values())
+    tree = build_huffman_tree(freq_dict)
+    size = avg_length(tree, freq_dict) * total / 8 + 4 * len(freq_dict)
+    return size <= (1 - MIN_SAVING) * total
+
+
+def _file_frequencies(f: BinaryIO) -> Tuple[Dict[int, int], int]:
+    """ Return the frequency dictionary of the rest of the open file <f>, and
+    its size, reading CHUNK_SIZE bytes at a time.
+    """
+    freq = {}
+    size = 0
+    chunk = f.read(CHUNK_SIZE)
+    while chunk:
+        chunk_freq = build_frequency_dict(chunk)
+        for symbol in chunk_freq:
+            freq[symbol] = freq.get(symbol, 0) + chunk_freq[symbol]
+        size += len(chunk)
+        chunk = f.read(CHUNK_SIZE)
+    return freq, size
+
+
+def _print_avg_length(tree: HuffmanTree, freq: Dict[int, int],
+                      max_length: Optional[int]) -> None:
+    """ Print the average number of bits per symbol of the Huffman tree <tree>
+    for the frequencies <freq>, and, if the code lengths were limited to
+    <max_length>, the average without the limit to compare with.
+    """
+    if max_length is None:
+        print("Bits per symbol:", avg_length(tree, freq))
+    else:
+        print("Bits per symbol: {} ({} with no limit on code length)".format(
+            avg_length(tree, freq),
+            avg_length(build_huffman_tree(freq), freq)))
+
+
+def _open_input(f: BinaryIO, use_mmap: bool) -> ContextManager[BinaryIO]:
+    """ Return a context manager for reading the open file <f>: a read-only
+    memory map of it if <use_mmap> is True, or else <f> itself.
+    """
+    if use_mmap:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return contextlib.nullcontext(f)
+
+
+def _input_pieces(f: BinaryIO, size: int) -> Iterator[bytes]:
+    """ Yield the rest of the input <f>, opened with _open_input, <size> bytes
+    at a time. The pieces of a memory map are slices of a memoryview of it,
+    so they are not copied.
+    """
+    if not isinstance(f, mmap.mmap):
+        piece = f.read(size)
+        while piece:
+            yield piece
+            piece = f.read(size)
+        return
+    # every slice must be released before the map can be closed
+    with memoryview(f) as view:
+        for start in range(f.tell(), len(view), size):
+            with view[start:start + size] as piece:
+                yield piece
+
+
+def _compress_file_streaming(in_file: str, out_file: str,
+                             canonical: bool,
+                             max_length: Optional[int],
+                             use_mmap: bool,
+                             index_interval: Optional[int] = None,
+                             counted: Optional[Tuple[Dict[int, int], int]]
+                             = None) -> None:
+    """ Compress <in_file> into <out_file> as compress_file does, reading and
+    writing CHUNK_SIZE bytes at a time. If the frequency dictionary and size
+    of <in_file> are <counted> already (see _file_frequencies), the file is
+    read only once.
+
+    If <index_interval> is given, the input is instead encoded
+    <index_interval> bytes at a time, and the output starts with
+    FORMAT_MARKER, FORMAT_INDEXED, <index_interval>, the number of index
+    entries, and for each piece the 64-bit offset in bits, from the end of the
+    stream's header, where its compressed bits start.
+    """
+    with open(in_file, "rb") as f, _open_input(f, use_mmap) as f1:
+        if counted is None:
+            counted = _file_frequencies(f1)
+            f1.seek(0)
+        freq, size = counted
+        tree = build_huffman_tree(freq, max_length=max_length)
+        header, codes = tree_header(tree, canonical)
+        encoder = HuffmanEncoder(codes)
+        _print_avg_length(tree, freq, max_length)
+        with open(out_file, "wb") as f2:
+            piece_size = index_interval or CHUNK_SIZE
+            num_pieces = -(-size // piece_size)
+            if index_interval is not None:
+                f2.write(bytes([FORMAT_MARKER, FORMAT_INDEXED]) +
+                         int32_to_bytes(index_interval) +
+                         int32_to_bytes(num_pieces))
+                index_pos = f2.tell()
+                f2.write(bytes(8 * num_pieces))
+            f2.write(header + int32_to_bytes(size))
+
+            offsets = []
+            for piece in _input_pieces(f1, piece_size):
+                offsets.append(encoder.num_bits)
+                f2.write(encoder.encode(piece))
+            f2.write(encoder.flush())
+
+            if index_interval is not None:
+                f2.seek(index_pos)
+                f2.write(b''.join([int64_to_bytes(offset)
+                                   for offset in offsets]))
+
+
+def _compress_block(text: bytes, canonical: bool = False,
+                    max_length: Optional[int] = None,
+                    auto_select: bool = False) -> bytes:
+    """ Return <text> compressed as a single stream: the header describing the
+    codes (see tree_header), the size of <text>, and the compressed bits.
+
+    If <auto_select> is True and <text> is not compressible, return it stored
+    uncompressed instead, after FORMAT_MARKER and FORMAT_STORED.
+
+    Precondition: <text> is not empty.
     """
-    with open(in_file, "rb") as f1:
-        text = f1.read()
     freq = build_frequency_dict(text)
-    tree = build_huffman_tree(freq)
-    codes = get_codes(tree)
-    number_nodes(tree)
-    print("Bits per symbol:", avg_length(tree, freq))
-    result = (tree.num_nodes_to_bytes() + tree_to_bytes(tree) +
-              int32_to_bytes(len(text)))
-    result += compress_bytes(text, codes)
-    with open(out_file, "wb") as f2:
-        f2.write(result)
+    if auto_select and not is_compressible(freq):
+        return bytes([FORMAT_MARKER, FORMAT_STORED]) + text
+    header, codes = tree_header(
+        build_huffman_tree(freq, max_length=max_length), canonical)
+    return header + int32_to_bytes(len(text)) + compress_bytes(text, codes)
+
+
+def _compress_file_blocks(in_file: str, out_file: str, block_size: int,
+                          processes: Optional[int], canonical: bool,
+                          max_length: Optional[int], use_mmap: bool,
+                          auto_select: bool) -> None:
+    """ Compress <in_file> into <out_file> in FORMAT_BLOCKS, with blocks of
+    <block_size> bytes compressed by a pool of <processes> processes.
+
+    The header is FORMAT_MARKER, FORMAT_BLOCKS, the number of blocks, and for
+    each block the 32-bit sizes of its compressed and original data. The
+    compressed blocks follow, in order.
+    """
+    num_blocks = -(-os.path.getsize(in_file) // block_size)
+    with open(in_file, "rb") as f, _open_input(f, use_mmap) as f1, \
+            open(out_file, "wb") as f2:
+        f2.write(bytes([FORMAT_MARKER, FORMAT_BLOCKS]) +
+                 int32_to_bytes(num_blocks))
+        index_pos = f2.tell()
+        f2.write(bytes(8 * num_blocks))
+
+        index = []
+        blocks = _read_pieces(f1, [block_size] * num_blocks)
+        compress = functools.partial(_compress_block, canonical=canonical,
+                                     max_length=max_length,
+                                     auto_select=auto_select)
+        for block in _map_blocks(compress, blocks, processes):
+            f2.write(block)
+            index.append(len(block))
+
+        f2.seek(index_pos)
+        for i in range(num_blocks):
+            size = min(block_size, os.path.getsize(in_file) - i * block_size)
+            f2.write(int32_to_bytes(index[i]) + int32_to_bytes(size))
+
+
+def _read_pieces(f: BinaryIO, sizes: List[int]) -> Iterator[bytes]:
+    """ Yield consecutive pieces of the open file <f>, of the given <sizes>.
+    """
+    for size in sizes:
+        yield f.read(size)
+
+
+def _map_blocks(func: Callable[[bytes], bytes], blocks: Iterable[bytes],
+                processes: Optional[int]) -> Iterator[bytes]:
+    """ Yield func(block) for each of the <blocks>, in order.
+
+    The blocks are processed by a pool of <processes> worker processes (by
+    default, one per CPU), with at most two blocks per process in flight at a
+    time so that memory use stays bounded. With a single process, the blocks
+    are processed in this process instead.
+    """
+    processes = processes or os.cpu_count() or 1
+    if processes == 1:
+        for block in blocks:
+            yield func(block)
+        return
+    with multiprocessing.Pool(processes) as pool:
+        pending = deque()
+        for block in blocks:
+            pending.append(pool.apply_async(func, (block,)))
+            if len(pending) >= 2 * processes:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
 
 
 # ====================
@@ -335,6 +1144,53 @@ def _gen_tree_g_helper(node_lst: List[ReadNode],
     return HuffmanTree(None, left, right)
 
 
+def header_codes(buf: Union[bytes, memoryview],
+                 root_index: int) -> Dict[int, str]:
+    """ Return the codes of the Huffman tree whose nodes are stored in <buf>,
+    4 bytes each as read by bytes_to_nodes, with its root at node
+    <root_index>.
+
+    This gives the same codes as generating the tree from ReadNodes and
+    calling get_codes, but reads the nodes straight from <buf> without
+    creating a ReadNode or HuffmanTree for each.
+
+    Raise a ValueError if the nodes refer to a node that is not in <buf>, or
+    to each other in a cycle.
+
+    >>> header_codes(bytes([0, 5, 0, 7, 0, 10, 0, 12, 1, 1, 1, 0]), 2)
+    {10: '00', 12: '01', 5: '10', 7: '11'}
+    >>> header_codes(bytes([0, 5, 1, 3, 0, 6, 0, 7]), 0)
+    Traceback (most recent call last):
+    ...
+    ValueError: The tree in the header refers to node 3 of 2
+    """
+    unpack_from = NODE_STRUCT.unpack_from
+    codes = {}
+    stack = [(root_index, "")]
+    num_nodes = len(buf) // 4
+    # a tree has one node for each node in <buf> at most, so more means the
+    # nodes refer to each other in a cycle
+    steps = num_nodes
+    while stack:
+        steps -= 1
+        if steps < 0:
+            raise ValueError("The tree in the header has a cycle")
+        index, code = stack.pop()
+        if index >= num_nodes:
+            raise ValueError("The tree in the header refers to node {} of {}"
+                             .format(index, num_nodes))
+        l_type, l_data, r_type, r_data = unpack_from(buf, 4 * index)
+        if not l_type:
+            codes[l_data] = code + "0"
+        if not r_type:
+            codes[r_data] = code + "1"
+        if r_type:
+            stack.append((r_data, code + "1"))
+        if l_type:
+            stack.append((l_data, code + "0"))
+    return codes
+
+
 def generate_tree_postorder(node_lst: List[ReadNode],
                             root_index: int) -> HuffmanTree:
     """ Return the Huffman tree corresponding to node_lst[root_index].
@@ -375,6 +1231,145 @@ def _gen_tree_p_helper(node_lst: List[ReadNode],
         return HuffmanTree(None, left, right)
 
 
+class HuffmanDecoder:
+    """ A table-driven decoder for a mapping from symbols to codes.
+
+    The codes are laid out as the internal nodes of a binary trie, held in
+    flat arrays rather than as HuffmanTree objects. Instead of reading the
+    compressed text one bit at a time, the decoder consumes a whole byte per
+    step. Its state is the internal node reached so far, and for each
+    (state, byte) pair a table records the symbols emitted while following the
+    byte's 8 bits from that node, together with the node the walk ends at.
+    Table entries are filled in lazily, the first time each pair is seen.
+
+    The decoder keeps its state between calls to decode, so compressed text
+    may be fed to it in consecutive pieces.
+
+    Public Attributes:
+    ===========
+    state: the index of the internal node where decoding resumes
+    """
+    state: int
+    # === Private Attributes ===
+    # _left, _right: the children of each internal node, indexed by node. The
+    #     root is node 0. An internal child is stored as its index, a leaf as
+    #     ~symbol (so leaves are always negative).
+    # _table: the decode table, indexed by (state << 8 | byte). Each entry is
+    #     None until filled, then a (symbols, next state) tuple.
+    _left: List[int]
+    _right: List[int]
+    _table: List[Optional[Tuple[bytes, int]]]
+
+    def __init__(self, codes: Dict[int, str]) -> None:
+        """ Create a new decoder for the mapping from symbols to codes <codes>,
+        as returned by get_codes.
+
+        Precondition: <codes> is a prefix code with no empty codes.
+        """
+        self.state = 0
+        self._left, self._right = [0], [0]
+        self._insert(codes, 0)
+        self._table = [None] * (len(self._left) << 8)
+
+    def _insert(self, codes: Dict[int, str], root: int) -> None:
+        """ Add the codes <codes> to the trie below the internal node <root>.
+        """
+        for symbol in codes:
+            code = codes[symbol]
+            node = root
+            for bit in code[:-1]:
+                children = self._right if bit == '1' else self._left
+                if children[node] == 0:
+                    children[node] = len(self._left)
+                    self._left.append(0)
+                    self._right.append(0)
+                node = children[node]
+            children = self._right if code[-1] == '1' else self._left
+            children[node] = ~symbol
+
+    def copy(self) -> HuffmanDecoder:
+        """ Return a new decoder for the same codes, starting at the root,
+        that shares the trie and the decode table of this one.
+
+        >>> decoder = HuffmanDecoder({3: '0', 2: '1'})
+        >>> decoder.decode(bytes([0b01100000]), 3)
+        b'\\x03\\x02\\x02'
+        >>> decoder.copy().decode(bytes([0b10000000]), 1)
+        b'\\x02'
+        """
+        decoder = copy.copy(self)
+        decoder.state = 0
+        return decoder
+
+    def _restart(self, symbol: int) -> int:
+        """ Return the node where decoding continues after <symbol>.
+        """
+        return 0
+
+    def _fill(self, key: int) -> Tuple[bytes, int]:
+        """ Compute, store and return the table entry for <key>.
+        """
+        node, byte = key >> 8, key & 0xFF
+        left, right = self._left, self._right
+        symbols = []
+        for mask in (128, 64, 32, 16, 8, 4, 2, 1):
+            child = right[node] if byte & mask else left[node]
+            if child < 0:
+                symbols.append(~child)
+                node = self._restart(~child)
+            else:
+                node = child
+        self._table[key] = (bytes(symbols), node)
+        return self._table[key]
+
+    def resume(self, byte: int, bit_num: int) -> bytes:
+        """ Start decoding again from the root, at bit number <bit_num> from
+        the left within the <byte> byte, and return the symbols decoded from
+        the rest of that byte.
+
+        >>> decoder = HuffmanDecoder({3: '0', 2: '1'})
+        >>> decoder.resume(0b01100000, 2)
+        b'\\x02\\x03\\x03\\x03\\x03\\x03'
+        """
+        node = 0
+        symbols = []
+        for bit in range(7 - bit_num, -1, -1):
+            if get_bit(byte, bit):
+                child = self._right[node]
+            else:
+                child = self._left[node]
+            if child < 0:
+                symbols.append(~child)
+                node = 0
+            else:
+                node = child
+        self.state = node
+        return bytes(symbols)
+
+    def decode(self, text: bytes, size: int) -> bytes:
+        """ Decode at most <size> symbols from <text>, continuing from the
+        current state, and return them.
+
+        >>> decoder = HuffmanDecoder({3: '0', 2: '1'})
+        >>> decoder.decode(bytes([0b01100000]), 4)
+        b'\\x03\\x02\\x02\\x03'
+        """
+        table = self._table
+        state = self.state
+        result = bytearray()
+        for byte in text:
+            entry = table[state << 8 | byte]
+            if entry is None:
+                entry = self._fill(state << 8 | byte)
+            symbols, state = entry
+            result += symbols
+            if len(result) >= size:
+                del result[size:]
+                break
+        self.state = state
+        return bytes(result)
+
+
 def decompress_bytes(tree: HuffmanTree, text: bytes, size: int) -> bytes:
     """ Use Huffman tree <tree> to decompress <size> bytes from <text>.
 
@@ -385,44 +1380,835 @@ def decompress_bytes(tree: HuffmanTree, text: bytes, size: int) -> bytes:
     b'helloworld'
     """
     # TODO: Implement this function
-    d = get_codes(tree)
-    d_inv = {}
-
-    for key in d:
-        d_inv[d[key]] = key
-
-    msg_c = ''.join([byte_to_bits(byte) for byte in text])
-
-    curr_code = ''
-    uncoded = []
-    for num in msg_c:
-        curr_code += num
-        if curr_code in d_inv:
-            uncoded.append(d_inv[curr_code])
-            curr_code = ''
-        if len(uncoded) == size:
-            break
-
-    return bytes(uncoded)
+    if tree.is_leaf():
+        # A single symbol has the empty code, so there are no bits to read.
+        return bytes([tree.symbol]) * size if tree.symbol is not None else b''
+    return HuffmanDecoder(get_codes(tree)).decode(text, size)
 
 
-def decompress_file(in_file: str, out_file: str) -> None:
+def decompress_file(in_file: str, out_file: str,
+                    processes: Optional[int] = None,
+                    use_mmap: bool = False,
+                    stats: Optional[Stats] = None) -> None:
     """ Decompress contents of <in_file> and store results in <out_file>.
     Both <in_file> and <out_file> are string objects representing the names of
     the input and output files.
 
+    Files made of independent blocks are decompressed by a pool of <processes>
+    worker processes (by default, one per CPU).
+
+    If <use_mmap> is True, a Huffman coded stream or a file made of blocks is
+    written to <out_file> through a memory map, with the size of the
+    decompressed data read from the header. The BWT, stored and adaptive
+    formats do not record that size, so they are written directly to
+    <out_file>, as is each member stream of an archive.
+
+    The compressed data is read and decoded a chunk at a time, and each piece
+    of output is written as soon as it is decoded, so memory use does not
+    grow with the size of the file. LZ77 also keeps its window of output, and
+    BWT one block of it.
+
+    If <stats> is given, the time, bytes and memory of each stage are added to
+    it (see stats.py). For a Huffman coded stream, the stages are "header",
+    then "read", "decode" and "write" for each chunk. BWT also has the stage
+    "inverse transform" before each write, and the other formats have a
+    single "decompress" stage.
+
     Precondition: The contents of the file <in_file> are not empty.
     """
+    with open(in_file, "rb") as f, \
+            open(out_file, "w+b" if use_mmap else "wb") as g:
+        decompress_stream(f, g, processes, use_mmap, stats)
+
+
+def _open_output(g: BinaryIO, size: int,
+                 use_mmap: bool) -> ContextManager[BinaryIO]:
+    """ Return a context manager for writing <size> bytes to the open file <g>:
+    a memory map of <g>, extended to <size> bytes, if <use_mmap> is True, or
+    else <g> itself.
+
+    Precondition: if <use_mmap> is True, <g> is empty and opened for reading
+    and writing.
+    """
+    if use_mmap and size > 0:
+        g.truncate(size)
+        return mmap.mmap(g.fileno(), size)
+    return contextlib.nullcontext(g)
+
+
+def decompress_stream(f: BinaryIO, g: BinaryIO,
+                       processes: Optional[int] = None,
+                       use_mmap: bool = False,
+                       stats: Optional[Stats] = None) -> None:
+    """ Decompress the compressed data in the open file <f> into the open file
+    <g>, detecting its format from the header. If <use_mmap> is True, <g> is
+    written through a memory map as in decompress_file. If <stats> is given,
+    the stages are measured in it as in decompress_file.
+    """
+    num_nodes = f.read(1)[0]
+    fmt = f.read(1)[0] if num_nodes == FORMAT_MARKER else None
+    if fmt == FORMAT_INDEXED:
+        f.read(4)
+        f.read(8 * bytes_to_int(f.read(4)))
+        decompress_stream(f, g, processes, use_mmap, stats)
+        return
+    elif fmt == FORMAT_ARCHIVE:
+        raise ValueError("Archives are extracted with archive.extract_all")
+    elif fmt == FORMAT_BWT:
+        inverse = bwt.InverseTransform()
+
+        def write(data: bytes) -> None:
+            """ Write the text of the blocks completed by <data> to <g>."""
+            with _stage(stats, "inverse transform") as record:
+                text = inverse.decode(data)
+                record.bytes_in += len(data)
+                record.bytes_out += len(text)
+            _write_chunk(g, text, stats)
+
+        # the transformed data is a Huffman coded stream of its own
+        num_nodes = f.read(1)[0]
+        fmt = f.read(1)[0] if num_nodes == FORMAT_MARKER else None
+        decoder, size = _read_stream_header(f, num_nodes, fmt, stats)
+        decode_chunks(decoder, f, size, write, stats)
+        if inverse.pending:
+            raise ValueError("The BWT data ends in the middle of a block")
+        return
+    elif fmt in (FORMAT_BLOCKS, FORMAT_ADAPTIVE, FORMAT_STORED):
+        with _stage(stats, "decompress") as record:
+            start, out_start = f.tell(), g.tell()
+            if fmt == FORMAT_BLOCKS:
+                _decompress_blocks(f, g, processes, use_mmap)
+            elif fmt == FORMAT_ADAPTIVE:
+                adaptive.decode_stream(f, g)
+            else:
+                shutil.copyfileobj(f, g, CHUNK_SIZE)
+            # each of these reads its input to the end
+            record.bytes_in += f.tell() - start
+            record.bytes_out += g.seek(0, io.SEEK_END) - out_start
+        return
+
+    decoder, size = _read_stream_header(f, num_nodes, fmt, stats)
+    with _open_output(g, size, use_mmap) as out:
+        decode_chunks(decoder, f, size,
+                       functools.partial(_write_chunk, out, stats=stats),
+                       stats)
+
+
+def _read_stream_header(f: BinaryIO, num_nodes: int, fmt: Optional[int],
+                        stats: Optional[Stats]) \
+        -> Tuple[Union[HuffmanDecoder, LZ77Decoder], int]:
+    """ Read the header of a stream coded with a Huffman code from the open
+    file <f>, as the stage "header" of <stats>, and return a decoder for the
+    stream and the number of symbols in it. <num_nodes> and <fmt> are as for
+    _read_decoder.
+    """
+    with _stage(stats, "header") as record:
+        start = f.tell()
+        decoder = _read_decoder(f, num_nodes, fmt)
+        size = bytes_to_int(f.read(4))
+        record.bytes_in += f.tell() - start
+    return decoder, size
+
+
+def decode_chunks(decoder: Union[HuffmanDecoder, LZ77Decoder], f: BinaryIO,
+                   size: int, write: Callable[[bytes], None],
+                   stats: Optional[Stats]) -> None:
+    """ Decode <size> symbols with <decoder> from the open file <f>, reading
+    CHUNK_SIZE compressed bytes at a time, and pass the symbols decoded from
+    each chunk to <write>. The stages "read" and "decode" of each chunk are
+    measured in <stats>.
+
+    Only one chunk of compressed data and the symbols decoded from it are held
+    in memory at a time.
+    """
+    # give the decoder an empty piece after the last chunk, to mark the end
+    # of the data
+    while size > 0:
+        with _stage(stats, "read") as record:
+            text = f.read(CHUNK_SIZE)
+            record.bytes_out += len(text)
+        with _stage(stats, "decode") as record:
+            result = decoder.decode(text, size)
+            record.bytes_in += len(text)
+            record.bytes_out += len(result)
+        if not text and not result:
+            break
+        size -= len(result)
+        write(result)
+
+
+def _write_chunk(out: BinaryIO, data: bytes, stats: Optional[Stats]) -> None:
+    """ Write <data> to the open file <out>, as the stage "write" of <stats>.
+    """
+    with _stage(stats, "write") as record:
+        out.write(data)
+        record.bytes_in += len(data)
+
+
+def _read_decoder(f: BinaryIO, num_nodes: int, fmt: Optional[int]) \
+        -> Union[HuffmanDecoder, LZ77Decoder]:
+    """ Read the header describing the codes of a stream from the open file
+    <f> and return a decoder for them. <num_nodes> is the first byte of the
+    stream, and <fmt> the format byte that follows FORMAT_MARKER or None, both
+    already read.
+    """
+    if fmt is None:
+        return HuffmanDecoder(header_codes(memoryview(f.read(num_nodes * 4)),
+                                           num_nodes - 1))
+    elif fmt == FORMAT_CANONICAL:
+        return HuffmanDecoder(canonical_codes(read_lengths(f)))
+    elif fmt == FORMAT_CONTEXT:
+        has_own = f.read(32)
+        codes = [canonical_codes(read_lengths(f))]
+        code_of = [0] * 256
+        for prev in range(256):
+            if get_bit(has_own[prev // 8], 7 - prev % 8):
+                code_of[prev] = len(codes)
+                codes.append(canonical_codes(read_lengths(f)))
+        return ContextDecoder(codes, code_of)
+    elif fmt == FORMAT_CODEBOOK:
+        return _codebook_decoder(bytes_to_int(f.read(4)),
+                                 CODEBOOK_DIR).copy()
+    elif fmt == FORMAT_LZ77:
+        window = bytes_to_int(f.read(4))
+        literals = _nibbles_to_lengths(f.read(
+            (lz77.NUM_LITERAL_SYMBOLS + 1) // 2), lz77.NUM_LITERAL_SYMBOLS)
+        count = f.read(1)[0]
+        distances = _nibbles_to_lengths(f.read((count + 1) // 2), count)
+        return LZ77Decoder(canonical_codes(literals),
+                           canonical_codes(distances), window)
+    raise ValueError("Unknown compressed format {}".format(fmt))
+
+
+def decompress_range(in_file: str, start: int, length: int) -> bytes:
+    """ Return <length> bytes of the original data compressed in <in_file>,
+    starting at byte <start>, or fewer if the data ends first.
+
+    Only the last seek index entry at or before <start> is read, and only the
+    compressed bits from there are decoded, so the time taken depends on
+    <length> and the index interval rather than on the size of the file.
+
+    Precondition: <in_file> was compressed with a seek index, or stored
+    uncompressed (see compress_file).
+    """
     with open(in_file, "rb") as f:
+        fmt = f.read(2)
+        if fmt == bytes([FORMAT_MARKER, FORMAT_STORED]):
+            f.seek(max(start, 0), 1)
+            return f.read(max(length, 0)) if start >= 0 else b''
+        if fmt != bytes([FORMAT_MARKER, FORMAT_INDEXED]):
+            raise ValueError("{} has no seek index".format(in_file))
+        interval = bytes_to_int(f.read(4))
+        if interval == 0:
+            raise ValueError("{} has an invalid seek index".format(in_file))
+        num_entries = bytes_to_int(f.read(4))
+        index_pos = f.tell()
+        f.seek(8 * num_entries, 1)
         num_nodes = f.read(1)[0]
-        buf = f.read(num_nodes * 4)
-        node_lst = bytes_to_nodes(buf)
-        # use generate_tree_general or generate_tree_postorder here
-        tree = generate_tree_general(node_lst, num_nodes - 1)
+        fmt = f.read(1)[0] if num_nodes == FORMAT_MARKER else None
+        decoder = _read_decoder(f, num_nodes, fmt)
         size = bytes_to_int(f.read(4))
-        with open(out_file, "wb") as g:
-            text = f.read()
-            g.write(decompress_bytes(tree, text, size))
+        length = min(length, size - start)
+        if start < 0 or length <= 0:
+            return b''
+
+        # only the one index entry needed is read
+        stream_pos = f.tell()
+        entry = start // interval
+        f.seek(index_pos + 8 * entry)
+        offset = bytes_to_int(f.read(8))
+        skip = start - entry * interval
+        f.seek(stream_pos + offset // 8)
+        text = f.read(CHUNK_SIZE)
+        result = decoder.resume(text[0], offset % 8)
+        result += decoder.decode(text[1:], skip + length - len(result))
+        while len(result) < skip + length:
+            text = f.read(CHUNK_SIZE)
+            if not text:
+                break
+            result += decoder.decode(text, skip + length - len(result))
+        return result[skip:skip + length]
+
+
+def read_lengths(f: BinaryIO) -> Dict[int, int]:
+    """ Read code lengths, as written by lengths_to_bytes, from the open file
+    <f> and return them.
+    """
+    count = f.read(1)[0]
+    lengths = {}
+    if count:
+        buf = f.read(2 * count)
+        for i in range(0, len(buf), 2):
+            lengths[buf[i]] = buf[i + 1]
+    else:
+        buf = f.read(256)
+        for symbol in range(256):
+            if buf[symbol]:
+                lengths[symbol] = buf[symbol]
+    return lengths
+
+
+def _decompress_block(data: bytes) -> bytes:
+    """ Return the decompressed form of <data>, a single compressed stream as
+    produced by _compress_block.
+    """
+    g = io.BytesIO()
+    decompress_stream(io.BytesIO(data), g)
+    return g.getvalue()
+
+
+def _decompress_blocks(f: BinaryIO, g: BinaryIO,
+                       processes: Optional[int], use_mmap: bool) -> None:
+    """ Decompress FORMAT_BLOCKS from the open file <f>, positioned after the
+    format byte, into the open file <g>, using a pool of <processes> processes.
+    If <use_mmap> is True, <g> is written through a memory map as in
+    decompress_file.
+    """
+    num_blocks = bytes_to_int(f.read(4))
+    index = f.read(8 * num_blocks)
+    sizes = [bytes_to_int(index[i:i + 4]) for i in range(0, len(index), 8)]
+    size = sum([bytes_to_int(index[i:i + 4]) for i in range(4, len(index), 8)])
+    with _open_output(g, size, use_mmap) as out:
+        for block in _map_blocks(_decompress_block, _read_pieces(f, sizes),
+                                 processes):
+            out.write(block)
+
+
+# ====================
+# Order-1 context modelling
+
+def build_context_dict(text: bytes) -> Dict[int, Dict[int, int]]:
+    """ Return a dictionary which maps each byte that precedes another byte in
+    <text> to the frequency dictionary of the bytes that follow it. The first
+    byte of <text> is taken to follow a 0 byte. Symbols in each frequency
+    dictionary are in increasing order.
+
+    >>> d = build_context_dict(bytes([65, 66, 65, 66, 67]))
+    >>> d == {0: {65: 1}, 65: {66: 2}, 66: {65: 1, 67: 1}}
+    True
+    """
+    if USE_NUMPY:
+        symbols = np.frombuffer(text, np.uint8).astype(np.int64)
+        keys = np.concatenate(([0], symbols[:-1])) << 8 | symbols
+        counts = np.bincount(keys, minlength=1 << 16)
+        result = {}
+        for key in np.flatnonzero(counts).tolist():
+            result.setdefault(key >> 8, {})[key & 0xFF] = int(counts[key])
+        return result
+    pairs = {}
+    prev = 0
+    for b in text:
+        key = prev << 8 | b
+        pairs[key] = pairs.get(key, 0) + 1
+        prev = b
+    result = {}
+    for key in sorted(pairs):
+        result.setdefault(key >> 8, {})[key & 0xFF] = pairs[key]
+    return result
+
+
+def context_cost(lengths: Dict[int, int], freq_dict: Dict[int, int]) -> int:
+    """ Return the number of bits taken by the text with the frequencies
+    <freq_dict> using codes with the code lengths <lengths>.
+    """
+    return sum([freq_dict[symbol] * lengths[symbol] for symbol in freq_dict])
+
+
+def context_code_lengths(contexts: Dict[int, Dict[int, int]]) \
+        -> Tuple[Dict[int, int], Dict[int, Dict[int, int]]]:
+    """ Return the code lengths for the context frequencies <contexts>, as
+    returned by build_context_dict: the lengths of a code shared by most
+    contexts, and a dictionary mapping each other context to the lengths of
+    its own code.
+
+    A context gets its own code when that saves more bits than the code's
+    header takes, compared to the code for all the text. At most
+    MAX_CONTEXT_CODES contexts, those that save the most, get their own code,
+    and the shared code is then built for the contexts left over.
+    """
+    total = {}
+    for prev in contexts:
+        for symbol in contexts[prev]:
+            total[symbol] = total.get(symbol, 0) + contexts[prev][symbol]
+    shared = code_lengths(build_huffman_tree(total))
+
+    savings = []
+    own = {}
+    for prev in contexts:
+        own[prev] = code_lengths(build_huffman_tree(contexts[prev]))
+        saving = (context_cost(shared, contexts[prev]) -
+                  context_cost(own[prev], contexts[prev]) -
+                  8 * len(lengths_to_bytes(own[prev])))
+        if saving > 0:
+            savings.append((saving, prev))
+    savings.sort(reverse=True)
+    chosen = {prev for _, prev in savings[:MAX_CONTEXT_CODES]}
+
+    rest = {}
+    for prev in contexts:
+        if prev not in chosen:
+            for symbol in contexts[prev]:
+                rest[symbol] = rest.get(symbol, 0) + contexts[prev][symbol]
+    shared = code_lengths(build_huffman_tree(rest or {0: 1}))
+    return shared, {prev: own[prev] for prev in sorted(chosen)}
+
+
+def compress_context(text: bytes) -> bytes:
+    """ Return <text> compressed with an order-1 context model: each byte is
+    coded with a code chosen by the byte before it.
+
+    The result is FORMAT_MARKER, FORMAT_CONTEXT, a 32-byte bitmap of the
+    contexts with their own code, the code lengths of the shared code and then
+    of each of those contexts' codes (see lengths_to_bytes), the size of
+    <text>, and the compressed bits.
+
+    Precondition: <text> is not empty.
+
+    >>> text = b'abracadabra, abracadabra'
+    >>> compressed = compress_context(text)
+    >>> g = io.BytesIO()
+    >>> decompress_stream(io.BytesIO(compressed), g)
+    >>> g.getvalue() == text
+    True
+    """
+    contexts = build_context_dict(text)
+    shared, own = context_code_lengths(contexts)
+    has_own = bytearray(32)
+    header = lengths_to_bytes(shared)
+    for prev in own:
+        has_own[prev // 8] |= 1 << (7 - prev % 8)
+        header += lengths_to_bytes(own[prev])
+
+    codes = [canonical_codes(shared)] * 256
+    for prev in own:
+        codes[prev] = canonical_codes(own[prev])
+    return (bytes([FORMAT_MARKER, FORMAT_CONTEXT]) + bytes(has_own) +
+            header + int32_to_bytes(len(text)) +
+            _encode_context(text, codes, contexts))
+
+
+def _encode_context(text: bytes, codes: List[Dict[int, str]],
+                    contexts: Dict[int, Dict[int, int]]) -> bytes:
+    """ Return the compressed bits of <text>, coding each byte with the codes
+    <codes> of the byte before it, padded to a whole number of bytes.
+    <contexts> are the context frequencies of <text>.
+    """
+    values, lengths = [0] * (1 << 16), [0] * (1 << 16)
+    for prev in range(256):
+        for symbol in codes[prev]:
+            code = codes[prev][symbol]
+            values[prev << 8 | symbol] = int(code, 2)
+            lengths[prev << 8 | symbol] = len(code)
+
+    if USE_NUMPY and max(lengths) < 63:
+        value_table = np.array(values, np.int64)
+        length_table = np.array(lengths, np.int64)
+        symbols = np.frombuffer(text, np.uint8)
+        pieces = []
+        # the bits of the last incomplete byte of each slice are written
+        # before the next slice, as HuffmanEncoder does
+        carry, carry_bits = 0, 0
+        for i in range(0, len(text), NUMPY_SLICE):
+            piece = symbols[i:i + NUMPY_SLICE].astype(np.int64)
+            prev = symbols[i - 1] if i else 0
+            keys = np.concatenate(([prev], piece[:-1])) << 8 | piece
+            result, num_bits = _pack_codes(value_table[keys],
+                                           length_table[keys],
+                                           carry, carry_bits)
+            carry_bits = num_bits % 8
+            if carry_bits:
+                carry = result[-1] >> (8 - carry_bits)
+                result = result[:-1]
+            pieces.append(result)
+        if carry_bits:
+            pieces.append(bytes([carry << (8 - carry_bits) & 0xFF]))
+        return b''.join(pieces)
+
+    num_bits = 0
+    for prev in contexts:
+        num_bits += context_cost(
+            {s: lengths[prev << 8 | s] for s in contexts[prev]}, contexts[prev])
+    writer = BitWriter(num_bits)
+    write = writer.write
+    prev = 0
+    for byte in text:
+        key = prev << 8 | byte
+        write(values[key], lengths[key])
+        prev = byte
+    return writer.getvalue()
+
+
+class ContextDecoder(HuffmanDecoder):
+    """ A table-driven decoder for an order-1 context model, as produced by
+    compress_context.
+
+    The tries of all the codes share the decoder's arrays, each with its own
+    root. After decoding a symbol, decoding continues at the root of the trie
+    for the code that follows that symbol, so the decode table works as for
+    HuffmanDecoder.
+    """
+    # === Private Attributes ===
+    # _next: the root of the trie where decoding continues after each symbol
+    _next: List[int]
+
+    def __init__(self, codes: List[Dict[int, str]],
+                 code_of: List[int]) -> None:
+        """ Create a new decoder for the list of codes <codes>, where the code
+        for the byte after each byte b is codes[code_of[b]].
+        """
+        self._left, self._right = [], []
+        roots = []
+        for code in codes:
+            roots.append(len(self._left))
+            self._left.append(0)
+            self._right.append(0)
+            self._insert(code, roots[-1])
+        self._next = [roots[code_of[prev]] for prev in range(256)]
+        self.state = self._next[0]
+        self._table = [None] * (len(self._left) << 8)
+
+    def _restart(self, symbol: int) -> int:
+        """ Return the node where decoding continues after <symbol>.
+        """
+        return self._next[symbol]
+
+
+# ====================
+# LZ77 front end
+
+def compress_lz77(text: bytes, window: int = lz77.WINDOW,
+                  effort: int = lz77.EFFORT) -> bytes:
+    """ Return <text> compressed with an LZ77 stage followed by Huffman coding,
+    like DEFLATE.
+
+    The tokens found by lz77.find_matches, with matches up to <window> bytes
+    back and the effort level <effort>, are turned into literal/length and
+    distance symbols, each coded with a canonical code of at most
+    LZ77_MAX_LENGTH bits, and the extra bits of each symbol follow its code.
+
+    The result is FORMAT_MARKER, FORMAT_LZ77, <window>, the code lengths of the
+    literal/length symbols and then, after their number, of the distance
+    symbols (see _lengths_to_nibbles), the size of <text>, and the compressed
+    bits.
+
+    Precondition: <text> is not empty and 0 < <window> <= lz77.MAX_WINDOW.
+
+    >>> text = b'abracadabra, abracadabra, abracadabra'
+    >>> compressed = compress_lz77(text)
+    >>> g = io.BytesIO()
+    >>> decompress_stream(io.BytesIO(compressed), g)
+    >>> g.getvalue() == text
+    True
+    """
+    symbols = []
+    literal_freq, distance_freq = {}, {}
+    for length, distance in lz77.find_matches(text, window, effort):
+        if distance == 0:
+            symbols.append((length, 0, 0, None, 0, 0))
+            literal_freq[length] = literal_freq.get(length, 0) + 1
+            continue
+        symbol = lz77.length_symbol(length) + lz77.distance_symbol(distance)
+        symbols.append(symbol)
+        literal_freq[symbol[0]] = literal_freq.get(symbol[0], 0) + 1
+        distance_freq[symbol[3]] = distance_freq.get(symbol[3], 0) + 1
+
+    literals = code_lengths(build_huffman_tree(
+        literal_freq, max_length=LZ77_MAX_LENGTH))
+    distances = code_lengths(build_huffman_tree(
+        distance_freq or {0: 1}, max_length=LZ77_MAX_LENGTH))
+    literal_codes = canonical_codes(literals)
+    distance_codes = canonical_codes(distances)
+
+    writer = BitWriter()
+    write = writer.write
+    for literal, extra, value, distance, d_extra, d_value in symbols:
+        code = literal_codes[literal]
+        write(int(code, 2) << extra | value, len(code) + extra)
+        if distance is not None:
+            code = distance_codes[distance]
+            write(int(code, 2) << d_extra | d_value, len(code) + d_extra)
+
+    count = max(distances) + 1
+    return (bytes([FORMAT_MARKER, FORMAT_LZ77]) + int32_to_bytes(window) +
+            _lengths_to_nibbles(literals, lz77.NUM_LITERAL_SYMBOLS) +
+            bytes([count]) + _lengths_to_nibbles(distances, count) +
+            int32_to_bytes(len(text)) + writer.getvalue())
+
+
+def _lengths_to_nibbles(lengths: Dict[int, int], count: int) -> bytes:
+    """ Return the code lengths <lengths> of the symbols 0 to <count> - 1, 4
+    bits each, with 0 for symbols without a code.
+
+    Precondition: no length is more than 15.
+
+    >>> list(_lengths_to_nibbles({0: 1, 1: 2, 2: 2}, 3))
+    [18, 32]
+    """
+    result = bytearray((count + 1) // 2)
+    for symbol in lengths:
+        result[symbol // 2] |= lengths[symbol] << (4 if symbol % 2 == 0 else 0)
+    return bytes(result)
+
+
+def _nibbles_to_lengths(data: bytes, count: int) -> Dict[int, int]:
+    """ Return the code lengths written by _lengths_to_nibbles in <data> for
+    <count> symbols.
+
+    >>> _nibbles_to_lengths(bytes([18, 32]), 3) == {0: 1, 1: 2, 2: 2}
+    True
+    """
+    lengths = {}
+    for symbol in range(count):
+        length = data[symbol // 2] >> (4 if symbol % 2 == 0 else 0) & 15
+        if length:
+            lengths[symbol] = length
+    return lengths
+
+
+def _code_table(codes: Dict[int, str]) -> Tuple[List[int], List[int]]:
+    """ Return tables indexed by the next LZ77_MAX_LENGTH bits of compressed
+    text, giving the symbol of <codes> whose code starts those bits and the
+    length of that code.
+
+    Precondition: no code in <codes> is longer than LZ77_MAX_LENGTH.
+    """
+    symbols = [0] * (1 << LZ77_MAX_LENGTH)
+    lengths = [LZ77_MAX_LENGTH] * (1 << LZ77_MAX_LENGTH)
+    for symbol in codes:
+        spare = LZ77_MAX_LENGTH - len(codes[symbol])
+        start, end = int(codes[symbol], 2) << spare, \
+            int(codes[symbol], 2) + 1 << spare
+        symbols[start:end] = [symbol] * (end - start)
+        lengths[start:end] = [len(codes[symbol])] * (end - start)
+    return symbols, lengths
+
+
+class LZ77Decoder:
+    """ A decoder of the compressed bits of compress_lz77.
+
+    Compressed text may be fed to the decoder in consecutive pieces, ended by
+    an empty piece. Only the last <window> bytes of output are kept for
+    matches to copy from, so memory use does not depend on the size of the
+    data.
+    """
+    # === Private Attributes ===
+    # _literals, _literal_lengths: the code table of the literal/length
+    #     symbols (see _code_table)
+    # _distances, _distance_lengths: the code table of the distance symbols
+    # _window: the largest distance of a match
+    # _history: the last bytes of output, at most <_window> of them between
+    #     calls to decode
+    # _rest: the compressed bytes not yet read into _buffer
+    # _buffer, _num_bits: the <_num_bits> compressed bits read but not used
+    _literals: List[int]
+    _literal_lengths: List[int]
+    _distances: List[int]
+    _distance_lengths: List[int]
+    _window: int
+    _history: bytearray
+    _rest: bytes
+    _buffer: int
+    _num_bits: int
+
+    def __init__(self, literal_codes: Dict[int, str],
+                 distance_codes: Dict[int, str], window: int) -> None:
+        """ Create a new decoder for the literal/length codes <literal_codes>
+        and distance codes <distance_codes>, with matches up to <window> bytes
+        back.
+        """
+        self._literals, self._literal_lengths = _code_table(literal_codes)
+        self._distances, self._distance_lengths = _code_table(distance_codes)
+        self._window = window
+        self._history = bytearray()
+        self._rest = b''
+        self._buffer, self._num_bits = 0, 0
+
+    def decode(self, text: bytes, size: int) -> bytes:
+        """ Return at most <size> bytes decoded from <text>, following the text
+        decoded so far. An empty <text> marks the end of the compressed text.
+
+        Tokens that are cut off at the end of <text> are decoded on the next
+        call, once the rest of their bits are available.
+        """
+        literals, literal_lengths = self._literals, self._literal_lengths
+        distances, distance_lengths = \
+            self._distances, self._distance_lengths
+        out = self._history
+        start = len(out)
+        end = start + size
+        data = self._rest + text
+        pos = 0
+        buffer, num_bits = self._buffer, self._num_bits
+        top = LZ77_MAX_LENGTH
+        mask = (1 << top) - 1
+        while len(out) < end:
+            # a token takes at most 15 + 5 + 15 + 22 bits
+            while num_bits < 64 and pos < len(data):
+                piece = data[pos:pos + 6]
+                pos += len(piece)
+                buffer = buffer << 8 * len(piece) | \
+                    int.from_bytes(piece, "big")
+                num_bits += 8 * len(piece)
+            if num_bits < 64:
+                if text:
+                    break
+                buffer <<= 64 - num_bits
+                num_bits = 64
+
+            index = buffer >> (num_bits - top) & mask
+            symbol = literals[index]
+            num_bits -= literal_lengths[index]
+            if symbol < lz77.LENGTH_SYMBOL:
+                out.append(symbol)
+                buffer &= (1 << num_bits) - 1
+                continue
+            symbol -= lz77.LENGTH_SYMBOL
+            extra = lz77.LENGTH_EXTRA[symbol]
+            num_bits -= extra
+            length = lz77.LENGTH_BASE[symbol] + \
+                (buffer >> num_bits & ((1 << extra) - 1))
+
+            index = buffer >> (num_bits - top) & mask
+            distance, extra = lz77.distance_base(distances[index])
+            num_bits -= distance_lengths[index] + extra
+            distance += buffer >> num_bits & ((1 << extra) - 1)
+            buffer &= (1 << num_bits) - 1
+
+            first = len(out) - distance
+            if distance >= length:
+                out += out[first:first + length]
+            else:
+                # the match overlaps the bytes it produces
+                out += (out[first:] * (length // distance + 1))[:length]
+
+        self._rest = data[pos:]
+        self._buffer, self._num_bits = buffer, num_bits
+        result = bytes(out[start:end])
+        del out[:max(0, len(out) - self._window)]
+        return result
+
+
+# ====================
+# Burrows-Wheeler pre-stage
+
+def compress_bwt(text: bytes, block_size: int = bwt.BLOCK_SIZE) -> bytes:
+    """ Return <text> compressed with a Huffman code after the Burrows-Wheeler
+    transform, move-to-front and run-length coding of each block of
+    <block_size> bytes (see bwt.transform).
+
+    The result is FORMAT_MARKER, FORMAT_BWT, and then the transformed text
+    compressed as with compress_file(canonical=True).
+
+    Precondition: <text> is not empty.
+
+    >>> text = b'abracadabra, abracadabra, abracadabra'
+    >>> compressed = compress_bwt(text)
+    >>> g = io.BytesIO()
+    >>> decompress_stream(io.BytesIO(compressed), g)
+    >>> g.getvalue() == text
+    True
+    """
+    data = bwt.transform(text, block_size)
+    header, codes = tree_header(
+        build_huffman_tree(build_frequency_dict(data)), True)
+    return (bytes([FORMAT_MARKER, FORMAT_BWT]) + header +
+            int32_to_bytes(len(data)) + compress_bytes(data, codes))
+
+
+# ====================
+# Pre-trained codebooks
+
+def train_codebook(paths: Iterable[str]) -> int:
+    """ Train a codebook on the files <paths>, save it in CODEBOOK_DIR, and
+    return its ID.
+
+    The codebook has a canonical code for every byte, built from the
+    frequencies of the bytes in <paths> plus one, so that it can code any
+    data, with no code longer than CODEBOOK_MAX_LENGTH bits. Its ID is the
+    CRC-32 of its code lengths.
+
+    Files compressed with a codebook need it to be decompressed, so a saved
+    codebook is never overwritten: raise a ValueError if a different codebook
+    with the same ID is already saved.
+    """
+    freq = dict.fromkeys(range(256), 1)
+    for path in paths:
+        with open(path, "rb") as f:
+            chunk = f.read(CHUNK_SIZE)
+            while chunk:
+                chunk_freq = build_frequency_dict(chunk)
+                for symbol in chunk_freq:
+                    freq[symbol] += chunk_freq[symbol]
+                chunk = f.read(CHUNK_SIZE)
+    data = lengths_to_bytes(code_lengths(build_huffman_tree(
+        freq, max_length=CODEBOOK_MAX_LENGTH)))
+    codebook_id = zlib.crc32(data)
+    os.makedirs(CODEBOOK_DIR, exist_ok=True)
+    try:
+        with open(codebook_path(codebook_id), "xb") as f:
+            f.write(data)
+    except FileExistsError:
+        with open(codebook_path(codebook_id), "rb") as f:
+            if f.read() != data:
+                raise ValueError("A different codebook with ID {:08x} is "
+                                 "already saved".format(codebook_id))
+    return codebook_id
+
+
+def codebook_path(codebook_id: int, directory: Optional[str] = None) -> str:
+    """ Return the name of the file of the codebook <codebook_id> in
+    <directory>, by default CODEBOOK_DIR, which is where compress_file and
+    decompress_file look for it.
+
+    >>> os.path.basename(codebook_path(48879))
+    '0000beef.codebook'
+    """
+    return os.path.join(directory or CODEBOOK_DIR,
+                        "{:08x}.codebook".format(codebook_id))
+
+
+def load_codebook(codebook_id: int) -> Dict[int, str]:
+    """ Return the codes of the codebook <codebook_id> saved in CODEBOOK_DIR.
+    Codebooks are read once and then cached, and each call returns a new
+    copy of the codes.
+
+    Raise a ValueError if there is no such codebook.
+    """
+    return dict(_load_codebook(codebook_id, CODEBOOK_DIR))
+
+
+@functools.lru_cache(maxsize=None)
+def _load_codebook(codebook_id: int, directory: str) -> Dict[int, str]:
+    """ Return the codes of the codebook <codebook_id> saved in <directory>.
+    The result is cached, and must not be changed.
+    """
+    try:
+        with open(codebook_path(codebook_id, directory), "rb") as f:
+            return canonical_codes(read_lengths(f))
+    except FileNotFoundError:
+        raise ValueError("Unknown codebook {:08x}".format(codebook_id))
+
+
+@functools.lru_cache(maxsize=None)
+def _codebook_decoder(codebook_id: int, directory: str) -> HuffmanDecoder:
+    """ Return a decoder for the codebook <codebook_id> in <directory>. The
+    decoder is cached, with the entries of its table filled in so far, and
+    must not be used itself: each stream is decoded by a copy of it.
+    """
+    return HuffmanDecoder(_load_codebook(codebook_id, directory))
+
+
+def compress_codebook(text: bytes, codebook_id: int) -> bytes:
+    """ Return <text> compressed with the codebook <codebook_id> saved in
+    CODEBOOK_DIR.
+
+    The result is FORMAT_MARKER, FORMAT_CODEBOOK, <codebook_id>, the size of
+    <text>, and the compressed bits.
+    """
+    codes = _load_codebook(codebook_id, CODEBOOK_DIR)
+    return (bytes([FORMAT_MARKER, FORMAT_CODEBOOK]) +
+            int32_to_bytes(codebook_id) + int32_to_bytes(len(text)) +
+            compress_bytes(text, codes))
 
 
 # ====================
@@ -433,6 +2219,13 @@ def improve_tree(tree: HuffmanTree, freq_dict: Dict[int, int]) -> None:
     by swapping nodes. The improvements are with respect to the dictionary of
     symbol frequencies <freq_dict>.
 
+    The leaves are listed from the shallowest to the deepest, and the symbols
+    of the tree from the most to the least frequent, and each leaf gets the
+    symbol at the same position. A symbol that is not in <freq_dict> has
+    frequency 0. This takes O(n log n) time for n leaves, and no other
+    arrangement of the symbols in this shape has a smaller average code
+    length. Symbols with equal frequencies keep their order.
+
     >>> left = HuffmanTree(None, HuffmanTree(99, None, None), \
     HuffmanTree(100, None, None))
     >>> right = HuffmanTree(None, HuffmanTree(101, None, None), \
@@ -444,105 +2237,142 @@ def improve_tree(tree: HuffmanTree, freq_dict: Dict[int, int]) -> None:
     >>> improve_tree(tree, freq)
     >>> avg_length(tree, freq)
     2.31
+    >>> tree = HuffmanTree(None, HuffmanTree(1), HuffmanTree(None, \
+    HuffmanTree(2), HuffmanTree(None, HuffmanTree(3), HuffmanTree(4))))
+    >>> improve_tree(tree, {1: 1, 2: 1, 3: 5, 4: 5})
+    >>> get_codes(tree)
+    {3: '0', 4: '10', 1: '110', 2: '111'}
     """
-    # TODO: Implement this function
-
-    if not tree.is_leaf():
-        tree_dict = get_codes(tree)
-        tree_dict_c = {}
-
-        for value in tree_dict:
-            if value in freq_dict:
-                tree_dict_c[value] = freq_dict[value]
-
-        tree_dict_c_inv = {}
-        for key in tree_dict_c:
-            tree_dict_c_inv[tree_dict_c[key]] = key
-
-        left_h = _huffman_tree_height(tree.left)
-        right_h = _huffman_tree_height(tree.right)
-
-        if left_h >= right_h:
-            _improve_tree_helper_left(tree, tree_dict_c_inv)
-        else:
-            _improve_tree_helper_right(tree, tree_dict_c_inv)
-
-
-def _improve_tree_helper_right(tree: HuffmanTree, freq_dict_inv: dict) -> dict:
-    """ Mutates the tree to fit the docstring description of
-    improve_tree.
-    """
-    if not tree.right.is_leaf():
-        freq_dict_inv = _improve_tree_helper_right(tree.right, freq_dict_inv)
-    if not tree.left.is_leaf():
-        freq_dict_inv = _improve_tree_helper_right(tree.left, freq_dict_inv)
-    if tree.left.is_leaf():
-        lowest = min(freq_dict_inv)
-        tree.left.symbol = freq_dict_inv[lowest]
-        del freq_dict_inv[lowest]
-    if tree.right.is_leaf():
-        lowest = min(freq_dict_inv)
-        tree.right.symbol = freq_dict_inv[lowest]
-        del freq_dict_inv[lowest]
-    return freq_dict_inv
-
-
-def _improve_tree_helper_left(tree: HuffmanTree, freq_dict_inv: dict) -> dict:
-    """ Mutates the tree to fit the docstring description of
-    improve_tree.
-    """
-    if not tree.left.is_leaf():
-        freq_dict_inv = _improve_tree_helper_left(tree.left, freq_dict_inv)
-    if not tree.right.is_leaf():
-        freq_dict_inv = _improve_tree_helper_left(tree.right, freq_dict_inv)
-    if tree.left.is_leaf():
-        lowest = min(freq_dict_inv)
-        tree.left.symbol = freq_dict_inv[lowest]
-        del freq_dict_inv[lowest]
-    if tree.right.is_leaf():
-        lowest = min(freq_dict_inv)
-        tree.right.symbol = freq_dict_inv[lowest]
-        del freq_dict_inv[lowest]
-    return freq_dict_inv
-
-
-def _huffman_tree_height(tree: HuffmanTree) -> int:
-    """ Returns the height of the Huffman Tree.
-
-    """
-    if tree.is_leaf():
-        return 1
-    else:
-        l_h = _huffman_tree_height(tree.left)
-        r_h = _huffman_tree_height(tree.right)
-
-        return 1 + max(l_h, r_h)
+    arrays = tree.arrays
+    leaves = arrays.leaves_by_depth(tree.index)
+    symbols = sorted((arrays.symbol[leaf] for leaf in leaves),
+                     key=lambda symbol: freq_dict.get(symbol, 0),
+                     reverse=True)
+    for leaf, symbol in zip(leaves, symbols):
+        if arrays.symbol[leaf] != symbol:
+            arrays.symbol[leaf] = symbol
+            arrays.changed(leaf)
 
 
 if __name__ == "__main__":
-    import doctest
-    doctest.testmod()
-
-    import python_ta
-    python_ta.check_all(config={
-        'allowed-io': ['compress_file', 'decompress_file'],
-        'allowed-import-modules': [
-            'python_ta', 'doctest', 'typing', '__future__',
-            'time', 'utils', 'huffman', 'random'
-        ],
-        'disable': ['W0401']
-    })
-
-    mode = input("Press c to compress, d to decompress, or other key to exit: ")
-    if mode == "c":
-        fname = input("File to compress: ")
-        start = time.time()
-        compress_file(fname, fname + ".huf")
-        print("Compressed {} in {} seconds."
-              .format(fname, time.time() - start))
-    elif mode == "d":
-        fname = input("File to decompress: ")
-        start = time.time()
-        decompress_file(fname, fname + ".orig")
-        print("Decompressed {} in {} seconds."
-              .format(fname, time.time() - start))
+    import argparse
+    import asyncio
+    import json
+    import sys
+    parser = argparse.ArgumentParser(
+        description="Compress (c) or decompress (d) files with Huffman "
+                    "coding. With no mode, ask for one file instead.")
+    parser.add_argument("mode", nargs="?", choices=["c", "d"],
+                        help="c to compress, d to decompress")
+    parser.add_argument("files", nargs="*", metavar="FILE",
+                        help="the files to compress or decompress")
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+                        help="the number of worker processes (default: one "
+                             "per CPU)")
+    parser.add_argument("-o", "--out-dir", default=None,
+                        help="the directory for the output files (default: "
+                             "next to each input)")
+    parser.add_argument("--stats", action="store_true",
+                        help="print the time, bytes and peak memory of each "
+                             "stage as JSON")
+    parser.add_argument("--check", action="store_true",
+                        help="run the doctests and python_ta, and exit")
+    args = parser.parse_args()
+
+    if args.check:
+        import doctest
+        doctest.testmod()
+
+        import python_ta
+        python_ta.check_all(config={
+            'allowed-io': ['compress_file', 'decompress_file',
+                           '_read_stream_header', 'decode_chunks',
+                           '_write_chunk', '_print_avg_length',
+                           '_compress_file_streaming', '_compress_file_blocks',
+                           'decompress_stream',
+                           '_decompress_blocks', 'read_lengths',
+                           '_open_input', '_input_pieces', '_open_output',
+                           '_read_decoder',
+                           'decompress_range', '_file_frequencies',
+                           'train_codebook',
+                           '_load_codebook', '_read_file', '_write_file',
+                           'report'],
+            'allowed-import-modules': [
+                'python_ta', 'doctest', 'typing', '__future__',
+                'time', 'utils', 'huffman', 'stats', 'adaptive', 'lz77',
+                'bwt', 'random', 'argparse', 'asyncio', 'json', 'sys',
+                'service', 'io', 'os', 'functools', 'heapq', 'mmap',
+                'contextlib', 'copy', 'shutil', 'multiprocessing',
+                'collections',
+                'numpy', 'zlib'
+            ],
+            'disable': ['W0401']
+        })
+        sys.exit()
+
+    if args.mode is None:
+        run_stats = Stats() if args.stats else None
+        mode = input(
+            "Press c to compress, d to decompress, or other key to exit: ")
+        if mode == "c":
+            fname = input("File to compress: ")
+            start = time.time()
+            compress_file(fname, fname + ".huf", stats=run_stats)
+            print("Compressed {} in {} seconds."
+                  .format(fname, time.time() - start))
+        elif mode == "d":
+            fname = input("File to decompress: ")
+            start = time.time()
+            decompress_file(fname, fname + ".orig", stats=run_stats)
+            print("Decompressed {} in {} seconds."
+                  .format(fname, time.time() - start))
+        if run_stats is not None:
+            print(run_stats.to_json())
+        sys.exit()
+
+    # the files are processed by service, which imports this module under
+    # its own name for the worker processes
+    import service
+    if not args.files:
+        parser.error("no files given")
+    if args.jobs is not None and args.jobs < 1:
+        parser.error("-j must be at least 1")
+    suffix = ".huf" if args.mode == "c" else ".orig"
+    out_paths = {}
+    for fname in args.files:
+        out_path = os.path.abspath(
+            service.out_path_for(fname, args.out_dir, suffix))
+        if out_path in out_paths:
+            parser.error("{} and {} would both be written to {}".format(
+                out_paths[out_path], fname, out_path))
+        out_paths[out_path] = fname
+    if args.out_dir is not None:
+        os.makedirs(args.out_dir, exist_ok=True)
+    finished = []
+
+    def report(file_result: service.FileResult) -> None:
+        """ Print the progress made by finishing <file_result>."""
+        finished.append(file_result)
+        if file_result.error is not None:
+            status = "error: " + file_result.error
+        else:
+            sizes = [file_result.size, file_result.compressed_size]
+            if args.mode == "d":
+                sizes.reverse()
+            status = "{} -> {} bytes in {:.3f} seconds".format(
+                sizes[0], sizes[1], file_result.seconds)
+        print("[{}/{}] {}: {}".format(len(finished), len(args.files),
+                                      file_result.path, status),
+              file=sys.stderr, flush=True)
+
+    run_many = service.compress_many if args.mode == "c" \
+        else service.decompress_many
+    options = {"stats": Stats()} if args.stats else {}
+    results = asyncio.run(run_many(args.files, args.out_dir, args.jobs,
+                                   on_result=report, **options))
+    if args.stats:
+        print(json.dumps([{"path": file_result.path,
+                           "stats": file_result.stats}
+                          for file_result in results], indent=2))
+    sys.exit(1 if any(file_result.error is not None
+                      for file_result in results) else 0)
@@ -13,7 +13,221 @@ All of the files in this directory and all subdirectories are:
 Copyright (c) 2020 Bogdan Simion, Michael Liut, Paul Vrbik, Dan Zingaro
 """
 from __future__ import annotations
-from typing import Optional, Any
+from typing import Dict, List, Optional, Any, Tuple
+
+
+class TreeArrays:
+    """ The nodes of one or more Huffman trees, stored in parallel arrays
+    indexed by node.
+
+    A HuffmanTree is a view of one node of a TreeArrays, so a tree built
+    directly in arrays (see add and join) needs no object per node, and
+    traversals work on the arrays without recursion. The codes of the tree
+    rooted at each node are cached until a node below it changes.
+
+    When one tree is made a subtree of a tree in other arrays, the smaller
+    arrays are absorbed into the larger. The absorbed arrays are left empty,
+    with a forward to where their nodes went, which their views follow.
+
+    Public Attributes:
+    ===========
+    symbol: the symbol of each node, or None
+    number: the number of each node, or None
+    left: the left child of each node, or -1
+    right: the right child of each node, or -1
+    parent: the parent of each node, or -1
+    """
+    __slots__ = ['symbol', 'number', 'left', 'right', 'parent', '_codes',
+                 '_forward']
+    symbol: List[Optional[int]]
+    number: List[Optional[int]]
+    left: List[int]
+    right: List[int]
+    parent: List[int]
+    # === Private Attributes ===
+    # _codes: the cached codes of the tree rooted at each node
+    # _forward: the arrays these were absorbed into, and the offset of their
+    #     nodes there, or None
+    _codes: Dict[int, Dict[int, str]]
+    _forward: Optional[Tuple[TreeArrays, int]]
+
+    def __init__(self) -> None:
+        """ Create new empty arrays."""
+        self.symbol, self.number = [], []
+        self.left, self.right, self.parent = [], [], []
+        self._codes = {}
+        self._forward = None
+
+    def __len__(self) -> int:
+        """ Return the number of nodes in these arrays."""
+        return len(self.symbol)
+
+    def add(self, symbol: Optional[int]) -> int:
+        """ Add a node with <symbol> and no parent or children, and return its
+        index.
+        """
+        self.symbol.append(symbol)
+        self.number.append(None)
+        self.left.append(-1)
+        self.right.append(-1)
+        self.parent.append(-1)
+        return len(self.symbol) - 1
+
+    def join(self, left: int, right: int) -> int:
+        """ Add an internal node with the nodes <left> and <right>, which have
+        no parents, as its children, and return its index.
+        """
+        node = self.add(None)
+        self.left[node], self.right[node] = left, right
+        self.parent[left] = self.parent[right] = node
+        return node
+
+    def view(self, index: int) -> HuffmanTree:
+        """ Return a HuffmanTree for node <index>.
+
+        >>> arrays = TreeArrays()
+        >>> tree = arrays.view(arrays.join(arrays.add(3), arrays.add(4)))
+        >>> tree.left.symbol, tree.right.symbol
+        (3, 4)
+        """
+        tree = HuffmanTree.__new__(HuffmanTree)
+        tree._arrays, tree._index = self, index
+        return tree
+
+    def changed(self, node: int) -> None:
+        """ Record that node <node> has changed, dropping the cached codes of
+        every tree that contains it.
+        """
+        codes, parent = self._codes, self.parent
+        while codes and node != -1:
+            codes.pop(node, None)
+            node = parent[node]
+
+    def absorb(self, other: TreeArrays) -> None:
+        """ Move all the nodes of <other> to the end of these arrays, leaving
+        <other> empty with a forward to them.
+        """
+        offset = len(self.symbol)
+        if offset and len(other.symbol) == 1:
+            # a single node, such as a new leaf, is simply added
+            self.add(other.symbol[0])
+            self.number[offset] = other.number[0]
+            if other._codes:
+                self._codes[offset] = other._codes[0]
+            other.__init__()
+            other._forward = (self, offset)
+            return
+
+        def shift(links: List[int]) -> List[int]:
+            """ Return <links> moved by <offset>."""
+            return [link + offset if link != -1 else -1 for link in links]
+
+        self.symbol += other.symbol
+        self.number += other.number
+        self.left += shift(other.left)
+        self.right += shift(other.right)
+        self.parent += shift(other.parent)
+        for root in other._codes:
+            self._codes[root + offset] = other._codes[root]
+        other.__init__()
+        other._forward = (self, offset)
+
+    def copy(self, source: TreeArrays, root: int) -> int:
+        """ Add a copy of the tree rooted at node <root> of <source>, which may
+        be these arrays, and return the index of the copy of <root>, which has
+        no parent.
+        """
+        copied = -1
+        # each node to copy, with the index of the copy of its parent and
+        # whether it is the right child, or -1 for the root
+        stack = [(root, -1, False)]
+        while stack:
+            node, parent, is_right = stack.pop()
+            new = self.add(source.symbol[node])
+            self.number[new] = source.number[node]
+            if parent == -1:
+                copied = new
+            else:
+                self.parent[new] = parent
+                if is_right:
+                    self.right[parent] = new
+                else:
+                    self.left[parent] = new
+            if source.right[node] != -1:
+                stack.append((source.right[node], new, True))
+            if source.left[node] != -1:
+                stack.append((source.left[node], new, False))
+        return copied
+
+    def is_leaf(self, index: int) -> bool:
+        """ Return True iff node <index> has no children."""
+        return self.left[index] == -1 and self.right[index] == -1
+
+    def postorder(self, root: int, right_first: bool = False) -> List[int]:
+        """ Return the internal nodes of the tree rooted at <root>, in
+        postorder, visiting right children before left children if
+        <right_first> is True.
+        """
+        left, right = self.left, self.right
+        first, second = (right, left) if right_first else (left, right)
+        result = []
+        stack = [root] if not self.is_leaf(root) else []
+        while stack:
+            node = stack.pop()
+            result.append(node)
+            for child in (first[node], second[node]):
+                if child != -1 and (left[child] != -1 or right[child] != -1):
+                    stack.append(child)
+        # the reverse of a preorder visiting <second> first is a postorder
+        # visiting <first> first
+        result.reverse()
+        return result
+
+    def leaves_by_depth(self, root: int) -> List[int]:
+        """ Return the leaves of the tree rooted at <root>, level by level, so
+        that no leaf comes after a deeper one.
+        """
+        leaves = []
+        level = [root]
+        while level:
+            next_level = []
+            for node in level:
+                if self.left[node] == -1 and self.right[node] == -1:
+                    leaves.append(node)
+                else:
+                    next_level += [child for child in (self.left[node],
+                                                       self.right[node])
+                                   if child != -1]
+            level = next_level
+        return leaves
+
+    def codes(self, root: int) -> Dict[int, str]:
+        """ Return the codes of the leaves of the tree rooted at <root>: "0"
+        for each step left and "1" for each step right. The result is cached,
+        and must not be changed.
+        """
+        codes = self._codes.get(root)
+        if codes is None:
+            codes = {}
+            if self.is_leaf(root):
+                if self.symbol[root] is not None:
+                    codes[self.symbol[root]] = ""
+            else:
+                left, right, symbol = self.left, self.right, self.symbol
+                stack = [(root, "")]
+                while stack:
+                    node, code = stack.pop()
+                    if left[node] == -1 and right[node] == -1:
+                        codes[symbol[node]] = code
+                        continue
+                    if right[node] != -1:
+                        stack.append((right[node], code + "1"))
+                    if left[node] != -1:
+                        stack.append((left[node], code + "0"))
+            self._codes[root] = codes
+        return codes
+
+
 
 
 class HuffmanTree:
@@ -23,25 +237,242 @@ class HuffmanTree:
     Each Huffman tree node has a number attribute that can be used for
     node-numbering.
 
+    A HuffmanTree is a view of one node of a TreeArrays (see arrays), and its
+    attributes are read from and written to the arrays. Reading a subtree
+    gives a new view of the child node, equal to any other view of it, and
+    changes through either are seen by both.
+
+    A tree that is not yet a subtree of another becomes the subtree it is
+    given to be, so later changes to it change the tree it is in. A tree that
+    is already a subtree, or would make a tree its own subtree, is copied
+    instead, so that giving a subtree a second parent leaves its first one
+    unchanged.
+
     Public Attributes:
     ===========
     symbol: symbol located in this Huffman tree node, if any
     number: the number of this Huffman tree node
     left: left subtree of this Huffman tree
     right: right subtree of this Huffman tree
+    arrays: the arrays holding the nodes of this Huffman tree
+    index: the index of this Huffman tree's root in <arrays>
     """
-    symbol: int
-    number: int
+    __slots__ = ['_arrays', '_index', '_symbol']
+    symbol: Optional[int]
+    number: Optional[int]
     left: Optional[HuffmanTree]
     right: Optional[HuffmanTree]
+    # === Private Attributes ===
+    # _arrays: the arrays this node was last found in, or None if it has not
+    #     been placed in any yet
+    # _index: the index of this node in _arrays
+    # _symbol: the symbol of this node while it is not placed
+    _arrays: Optional[TreeArrays]
+    _index: int
+    _symbol: Optional[int]
 
     def __init__(self, symbol: Optional[int] = None,
                  left: Optional[HuffmanTree] = None,
                  right: Optional[HuffmanTree] = None) -> None:
         """ Create a new Huffman tree with the given parameters."""
-        self.symbol = symbol
-        self.left, self.right = left, right
-        self.number = None
+        # a node without children is only placed in arrays when it is needed,
+        # usually when it becomes a subtree
+        self._arrays, self._index, self._symbol = None, -1, symbol
+        if left is None and right is None:
+            return
+        if left is not None and right is not None and left is not right:
+            a, b = left._arrays, right._arrays
+            if a is not None and a._forward is not None:
+                left._resolve()
+                a = left._arrays
+            if b is not None and b._forward is not None:
+                right._resolve()
+                b = right._arrays
+            if (a is None or a.parent[left._index] == -1) and \
+                    (b is None or b.parent[right._index] == -1) and \
+                    (a is not b or a is None or left._index != right._index):
+                self._join(left, right, symbol)
+                return
+        for child in (left, right):
+            if child is not None and child._arrays is not None:
+                child._resolve()
+                if self._arrays is None or \
+                        len(child._arrays) > len(self._arrays):
+                    self._arrays = child._arrays
+        if self._arrays is None:
+            self._arrays = TreeArrays()
+        self._index = self._arrays.add(symbol)
+        if left is not None:
+            self._set_child(False, left)
+        if right is not None:
+            self._set_child(True, right)
+
+    def _join(self, left: HuffmanTree, right: HuffmanTree,
+              symbol: Optional[int]) -> None:
+        """ Make this node, with <symbol>, the parent of the distinct nodes
+        <left> and <right>, which have no parents and are resolved.
+
+        This is the usual case when building a tree bottom up. The smaller
+        arrays of the two are absorbed into the larger, so that each node is
+        moved O(log n) times.
+        """
+        a, b = left._arrays, right._arrays
+        if a is None or (b is not None and len(b.symbol) > len(a.symbol)):
+            a, b = b, a
+        if a is None:
+            # two new leaves: lay out all three nodes at once
+            a = TreeArrays()
+            a.symbol = [left._symbol, right._symbol, symbol]
+            a.number = [None, None, None]
+            a.left, a.right, a.parent = [-1, -1, 0], [-1, -1, 1], [2, 2, -1]
+            left._arrays, left._index = a, 0
+            right._arrays, right._index = a, 1
+            self._arrays, self._index = a, 2
+            return
+        if b is not None and b is not a:
+            a.absorb(b)
+            left._resolve()
+            right._resolve()
+        if left._arrays is None:
+            left._arrays, left._index = a, a.add(left._symbol)
+        if right._arrays is None:
+            right._arrays, right._index = a, a.add(right._symbol)
+        self._arrays = a
+        self._index = a.join(left._index, right._index)
+        a.symbol[self._index] = symbol
+
+    def _resolve(self) -> None:
+        """ Place this node in new arrays if it is not placed yet, or else
+        follow the forwards of absorbed arrays to where it is now.
+        """
+        if self._arrays is None:
+            self._place(TreeArrays())
+        while self._arrays._forward is not None:
+            self._arrays, offset = self._arrays._forward
+            self._index += offset
+
+    def _place(self, arrays: TreeArrays) -> None:
+        """ Add this node to <arrays> if it is not placed yet."""
+        if self._arrays is None:
+            self._arrays = arrays
+            self._index = arrays.add(self._symbol)
+
+    @property
+    def arrays(self) -> TreeArrays:
+        """ Return the arrays holding the nodes of this Huffman tree."""
+        self._resolve()
+        return self._arrays
+
+    @property
+    def index(self) -> int:
+        """ Return the index of this Huffman tree's root in its arrays."""
+        self._resolve()
+        return self._index
+
+    @property
+    def symbol(self) -> Optional[int]:
+        """ Return the symbol of this node."""
+        if self._arrays is None:
+            return self._symbol
+        self._resolve()
+        return self._arrays.symbol[self._index]
+
+    @symbol.setter
+    def symbol(self, symbol: Optional[int]) -> None:
+        """ Set the symbol of this node."""
+        if self._arrays is None:
+            self._symbol = symbol
+            return
+        self._resolve()
+        self._arrays.symbol[self._index] = symbol
+        self._arrays.changed(self._index)
+
+    @property
+    def number(self) -> Optional[int]:
+        """ Return the number of this node."""
+        self._resolve()
+        return self._arrays.number[self._index]
+
+    @number.setter
+    def number(self, number: Optional[int]) -> None:
+        """ Set the number of this node."""
+        self._resolve()
+        self._arrays.number[self._index] = number
+
+    @property
+    def left(self) -> Optional[HuffmanTree]:
+        """ Return the left subtree of this node."""
+        self._resolve()
+        child = self._arrays.left[self._index]
+        return self._arrays.view(child) if child != -1 else None
+
+    @left.setter
+    def left(self, tree: Optional[HuffmanTree]) -> None:
+        """ Make <tree> the left subtree of this node."""
+        self._set_child(False, tree)
+
+    @property
+    def right(self) -> Optional[HuffmanTree]:
+        """ Return the right subtree of this node."""
+        self._resolve()
+        child = self._arrays.right[self._index]
+        return self._arrays.view(child) if child != -1 else None
+
+    @right.setter
+    def right(self, tree: Optional[HuffmanTree]) -> None:
+        """ Make <tree> the right subtree of this node."""
+        self._set_child(True, tree)
+
+    def _set_child(self, is_right: bool, tree: Optional[HuffmanTree]) -> None:
+        """ Make <tree> the right subtree of this node if <is_right>, or else
+        the left, as described in the class docstring.
+
+        >>> x = HuffmanTree(None, HuffmanTree(1), HuffmanTree(2))
+        >>> y = HuffmanTree(None, x.left, HuffmanTree(9))
+        >>> x.left, y.left.symbol
+        (HuffmanTree(1, None, None), 1)
+        >>> y.left.symbol = 3
+        >>> x.left.symbol
+        1
+        """
+        self._resolve()
+        child = -1
+        if tree is not None:
+            tree._place(self._arrays)
+            tree._resolve()
+            if tree._arrays is not self._arrays and \
+                    tree._arrays.parent[tree._index] == -1:
+                if len(tree._arrays) > len(self._arrays):
+                    tree._arrays.absorb(self._arrays)
+                else:
+                    self._arrays.absorb(tree._arrays)
+                self._resolve()
+                tree._resolve()
+            child = tree._index
+            if tree._arrays is not self._arrays or \
+                    tree._arrays.parent[child] != -1 or \
+                    self._is_below(child):
+                child = self._arrays.copy(tree._arrays, child)
+        arrays, index = self._arrays, self._index
+        children = arrays.right if is_right else arrays.left
+        if children[index] != -1:
+            arrays.parent[children[index]] = -1
+        children[index] = child
+        if child != -1:
+            arrays.parent[child] = index
+        arrays.changed(index)
+
+    def _is_below(self, node: int) -> bool:
+        """ Return True iff this node is node <node> of its arrays or in the
+        tree rooted at it.
+        """
+        parent = self._arrays.parent
+        index = self._index
+        while index != -1:
+            if index == node:
+                return True
+            index = parent[index]
+        return False
 
     def __eq__(self, other: Any) -> bool:
         """ Return True iff this HuffmanTree is equivalent to <other>, or False
@@ -55,9 +486,20 @@ class HuffmanTree:
         >>> a == b
         False
         """
-        return (isinstance(self, type(other)) and
-                self.symbol == other.symbol and
-                self.left == other.left and self.right == other.right)
+        if not isinstance(self, type(other)):
+            return False
+        a, b = self.arrays, other.arrays
+        stack = [(self._index, other._index)]
+        while stack:
+            x, y = stack.pop()
+            if a.symbol[x] != b.symbol[y]:
+                return False
+            for u, v in ((a.left[x], b.left[y]), (a.right[x], b.right[y])):
+                if (u == -1) != (v == -1):
+                    return False
+                if u != -1:
+                    stack.append((u, v))
+        return True
 
     def __lt__(self, other: Any) -> bool:
         """ Return True iff this HuffmanTree is less than <other>."""
@@ -66,8 +508,20 @@ class HuffmanTree:
     def __repr__(self) -> str:
         """ Return constructor-style string representation of this HuffmanTree.
         """
-        return 'HuffmanTree({}, {}, {})'.format(self.symbol,
-                                                self.left, self.right)
+        arrays = self.arrays
+        parts = []
+        stack = [self._index]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, str):
+                parts.append(node)
+            elif node == -1:
+                parts.append('None')
+            else:
+                parts.append('HuffmanTree({}, '.format(arrays.symbol[node]))
+                stack.extend([')', arrays.right[node], ', ',
+                              arrays.left[node]])
+        return ''.join(parts)
 
     def is_leaf(self) -> bool:
         """ Return True iff this HuffmanTree is a leaf, otherwise False.
@@ -76,7 +530,9 @@ class HuffmanTree:
         >>> t.is_leaf()
         True
         """
-        return not self.left and not self.right
+        if self._arrays is None:
+            return True
+        return self.arrays.is_leaf(self._index)
 
     def num_nodes_to_bytes(self) -> bytes:
         """ Return the number of nodes required to represent this Huffman tree
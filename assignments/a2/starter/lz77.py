@@ -0,0 +1,207 @@
+"""
+LZ77 match finding, as a front end to Huffman coding in the style of DEFLATE.
+
+Huffman coding alone only exploits how often each byte occurs. LZ77 also
+exploits repeated strings: text is split into tokens, each either a literal
+byte or a match, which repeats <length> bytes starting <distance> bytes back.
+Matches are found with a hash chain over the last <window> bytes: positions
+are chained by the hash of the 3 bytes that start there, and the chain of the
+current position is searched for the longest match.
+
+Literals and lengths then share one alphabet of symbols, and distances get an
+alphabet of their own, as in DEFLATE: larger lengths and distances are grouped
+into one symbol each, followed by extra bits that pick one of the group.
+"""
+from __future__ import annotations
+from typing import List, Tuple
+
+# The shortest and longest matches.
+MIN_MATCH = 3
+MAX_MATCH = 258
+
+# The default and largest windows, in bytes.
+WINDOW = 1 << 15
+MAX_WINDOW = 1 << 24
+
+# For each effort level: the most candidates checked on a hash chain, the
+# match length that ends the search early, and the match length under which
+# the next position is also searched for a longer match (0 for none). Higher
+# levels search harder, trading CPU for compression, like zlib's levels.
+EFFORTS = {1: (4, 8, 0), 2: (8, 16, 0), 3: (32, 32, 0),
+           4: (16, 16, 4), 5: (32, 32, 16), 6: (128, 128, 16),
+           7: (256, 128, 32), 8: (1024, MAX_MATCH, 128),
+           9: (4096, MAX_MATCH, MAX_MATCH)}
+EFFORT = 6
+
+# The first literal/length symbol for lengths. Literals are symbols 0 to 255.
+LENGTH_SYMBOL = 256
+
+# The smallest length and the number of extra bits of each length symbol,
+# from DEFLATE.
+LENGTH_BASE = [3, 4, 5, 6, 7, 8, 9, 10, 11, 13, 15, 17, 19, 23, 27, 31, 35,
+               43, 51, 59, 67, 83, 99, 115, 131, 163, 195, 227, 258]
+LENGTH_EXTRA = [0, 0, 0, 0, 0, 0, 0, 0, 1, 1, 1, 1, 2, 2, 2, 2, 3, 3, 3, 3,
+                4, 4, 4, 4, 5, 5, 5, 5, 0]
+
+# The number of literal/length symbols.
+NUM_LITERAL_SYMBOLS = LENGTH_SYMBOL + len(LENGTH_BASE)
+
+# The length symbol of each match length.
+_LENGTH_CODE = [0] * (MAX_MATCH + 1)
+for _i in range(len(LENGTH_BASE)):
+    for _length in range(LENGTH_BASE[_i],
+                         LENGTH_BASE[_i] + (1 << LENGTH_EXTRA[_i])):
+        _LENGTH_CODE[_length] = _i
+_LENGTH_CODE[MAX_MATCH] = len(LENGTH_BASE) - 1
+
+
+def length_symbol(length: int) -> Tuple[int, int, int]:
+    """ Return the literal/length symbol of the match length <length>, with
+    the number of extra bits that follow it and their value.
+
+    >>> length_symbol(3)
+    (256, 0, 0)
+    >>> length_symbol(14)
+    (265, 1, 1)
+    >>> length_symbol(258)
+    (284, 0, 0)
+    """
+    i = _LENGTH_CODE[length]
+    return LENGTH_SYMBOL + i, LENGTH_EXTRA[i], length - LENGTH_BASE[i]
+
+
+def distance_symbol(distance: int) -> Tuple[int, int, int]:
+    """ Return the distance symbol of <distance>, with the number of extra
+    bits that follow it and their value.
+
+    As in DEFLATE, symbols 0 to 3 are the distances 1 to 4, and after that each
+    number of extra bits is used by two symbols. Unlike DEFLATE, the symbols go
+    on past 29, to cover distances up to MAX_WINDOW.
+
+    >>> distance_symbol(4)
+    (3, 0, 0)
+    >>> distance_symbol(7)
+    (5, 1, 0)
+    >>> distance_symbol(32768)
+    (29, 13, 8191)
+    """
+    value = distance - 1
+    if value < 4:
+        return value, 0, 0
+    extra = value.bit_length() - 2
+    symbol = 2 * extra + 2 + (value >> extra & 1)
+    return symbol, extra, value & ((1 << extra) - 1)
+
+
+def distance_base(symbol: int) -> Tuple[int, int]:
+    """ Return the smallest distance of the distance symbol <symbol>, and the
+    number of extra bits that follow it.
+
+    >>> distance_base(5)
+    (7, 1)
+    >>> distance_base(29)
+    (24577, 13)
+    """
+    if symbol < 4:
+        return symbol + 1, 0
+    extra = (symbol >> 1) - 1
+    return ((2 | symbol & 1) << extra) + 1, extra
+
+
+def find_matches(text: bytes, window: int = WINDOW,
+                 effort: int = EFFORT) -> List[Tuple[int, int]]:
+    """ Return the tokens of <text>, in order. A token (length, distance) with
+    a <distance> greater than 0 is a match, and a token (byte, 0) is the
+    literal <byte>.
+
+    Matches are at least MIN_MATCH and at most MAX_MATCH bytes long, and reach
+    at most <window> bytes back. <effort> is a key of EFFORTS.
+
+    >>> find_matches(b'abcabcabcd')
+    [(97, 0), (98, 0), (99, 0), (6, 3), (100, 0)]
+    """
+    max_chain, nice, max_lazy = EFFORTS[effort]
+    n = len(text)
+    head = {}
+    # the previous position with the same hash as each of the last
+    # <window> positions, or -1
+    prev = [-1] * max(1, min(window, n))
+    size = len(prev)
+
+    def insert(i: int) -> None:
+        """ Add position <i> to its hash chain."""
+        key = text[i] << 16 | text[i + 1] << 8 | text[i + 2]
+        prev[i % size] = head.get(key, -1)
+        head[key] = i
+
+    def longest(i: int) -> Tuple[int, int]:
+        """ Return the longest match at position <i> found, as a length and a
+        distance, or a length under MIN_MATCH if there is none.
+        """
+        limit = min(MAX_MATCH, n - i)
+        best, best_distance = MIN_MATCH - 1, 0
+        if limit < MIN_MATCH:
+            return best, best_distance
+        j = head.get(text[i] << 16 | text[i + 1] << 8 | text[i + 2], -1)
+        chain = max_chain
+        while j >= 0 and i - j <= window and chain > 0:
+            # only a candidate that beats the best match so far is extended
+            if text[j + best] == text[i + best] and \
+                    text[j:j + best] == text[i:i + best]:
+                best = _match_length(text, j, i, best + 1, limit)
+                best_distance = i - j
+                if best >= nice or best == limit:
+                    break
+            j = prev[j % size]
+            chain -= 1
+        return best, best_distance
+
+    tokens = []
+    i = 0
+    found = None
+    while i < n:
+        length, distance = found or longest(i)
+        found = None
+        if i + MIN_MATCH <= n:
+            insert(i)
+        if MIN_MATCH <= length < max_lazy and i + 1 < n:
+            # a longer match at the next position beats this one
+            found = longest(i + 1)
+            if found[0] > length:
+                tokens.append((text[i], 0))
+                i += 1
+                continue
+            found = None
+        if length >= MIN_MATCH:
+            tokens.append((length, distance))
+            for k in range(i + 1, min(i + length, n - MIN_MATCH + 1)):
+                insert(k)
+            i += length
+        else:
+            tokens.append((text[i], 0))
+            i += 1
+    return tokens
+
+
+def _match_length(text: bytes, j: int, i: int, length: int,
+                  limit: int) -> int:
+    """ Return the number of bytes, up to <limit>, that are the same in <text>
+    from positions <j> and <i>, given that the first <length> are.
+    """
+    if text[j:j + limit] == text[i:i + limit]:
+        return limit
+    while text[j + length] == text[i + length]:
+        length += 1
+    return length
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
+
+    import python_ta
+    python_ta.check_all(config={
+        'allowed-import-modules': [
+            'python_ta', 'doctest', '__future__', 'typing'
+        ]
+    })
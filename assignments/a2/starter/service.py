@@ -0,0 +1,261 @@
+"""
+An asyncio API for compressing or decompressing many files concurrently.
+
+Each file is compressed with compress_file in a bounded pool of worker
+processes, so that as many files are compressed at once as there are workers,
+and reading and writing one file overlaps with compressing the others. At most
+a fixed number of files are queued for the pool at a time: paths are only
+taken from the input when a slot is free, so a long or endless iterable of
+paths does not fill memory with pending work.
+
+>>> import asyncio
+>>> results = asyncio.run(compress_many(['no such file']))
+>>> results[0].error is not None
+True
+"""
+from __future__ import annotations
+import asyncio
+import contextlib
+import io
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, Iterable, List, Optional
+from compress import compress_file, decompress_file
+from stats import Stats
+
+
+class FileResult:
+    """ The result of compressing one file.
+
+    Public Attributes:
+    ===========
+    path: the file that was compressed
+    out_path: the compressed file
+    size: the size of <path> in bytes, or 0 if it could not be read
+    compressed_size: the size of <out_path> in bytes, or 0 on error
+    seconds: the time taken to compress the file, in the worker
+    error: a description of the error that stopped compression, or None
+    stats: the statistics of each stage (see Stats.to_dict), if a Stats
+        object was passed as the option "stats", or None
+    """
+    path: str
+    out_path: str
+    size: int
+    compressed_size: int
+    seconds: float
+    error: Optional[str]
+    stats: Optional[Dict[str, Any]]
+
+    def __init__(self, path: str, out_path: str) -> None:
+        """ Create a new result for compressing <path> into <out_path>, with
+        nothing done yet.
+        """
+        self.path, self.out_path = path, out_path
+        self.size, self.compressed_size = 0, 0
+        self.seconds = 0.0
+        self.error = None
+        self.stats = None
+
+    def __repr__(self) -> str:
+        """ Return a string representation of this FileResult."""
+        return 'FileResult({!r}, {} -> {}, {})'.format(
+            self.path, self.size, self.compressed_size,
+            self.error or 'ok')
+
+
+def out_path_for(path: str, out_dir: Optional[str] = None,
+                 suffix: str = ".huf") -> str:
+    """ Return the name of the output file for <path>: <path> with <suffix>
+    appended, in <out_dir> if it is given.
+
+    >>> out_path_for('files/a.txt')
+    'files/a.txt.huf'
+    >>> out_path_for('files/a.txt', 'out')
+    'out/a.txt.huf'
+    >>> out_path_for('files/a.txt.huf', suffix='.orig')
+    'files/a.txt.huf.orig'
+    """
+    if out_dir is None:
+        return path + suffix
+    return os.path.join(out_dir, os.path.basename(path) + suffix)
+
+
+def _compress_one(path: str, out_path: str,
+                  options: Dict[str, Any]) -> FileResult:
+    """ Compress <path> into <out_path> with the keyword arguments <options>
+    to compress_file, and return the result. This runs in a worker process.
+    """
+    return _run_one(compress_file, path, out_path, options)
+
+
+def _decompress_one(path: str, out_path: str,
+                    options: Dict[str, Any]) -> FileResult:
+    """ Decompress <path> into <out_path> with the keyword arguments <options>
+    to decompress_file, and return the result, in which the sizes are those
+    of <out_path> and <path>. This runs in a worker process.
+    """
+    result = _run_one(decompress_file, path, out_path, options)
+    if result.error is None:
+        result.size, result.compressed_size = \
+            result.compressed_size, result.size
+    return result
+
+
+def _run_one(func: Callable[..., None], path: str, out_path: str,
+             options: Dict[str, Any]) -> FileResult:
+    """ Call <func>(<path>, <out_path>, **<options>) and return the result,
+    with the size of <path> as its size and the size of <out_path> as its
+    compressed size. Any exception raised by <func>, such as for a file that
+    is not in the expected format, becomes the error of the result, and
+    whatever <func> wrote to <out_path> is removed.
+    """
+    result = FileResult(path, out_path)
+    start = time.perf_counter()
+    called = False
+    try:
+        result.size = os.path.getsize(path)
+        if result.size == 0:
+            result.error = "empty file"
+            return result
+        # compress_file prints the bits per symbol of each file
+        with contextlib.redirect_stdout(io.StringIO()):
+            called = True
+            func(path, out_path, **options)
+        result.compressed_size = os.path.getsize(out_path)
+        stats = options.get("stats")
+        if isinstance(stats, Stats):
+            result.stats = stats.to_dict()
+    except Exception as e:  # one bad file must not stop the others
+        result.error = "{}: {}".format(_error_name(e), e)
+        if called:
+            try:
+                os.remove(out_path)
+            except OSError:
+                pass
+    result.seconds = time.perf_counter() - start
+    return result
+
+
+def _error_name(e: BaseException) -> str:
+    """ Return the name of the type of <e>, with its module unless it is a
+    builtin.
+
+    >>> import struct
+    >>> _error_name(ValueError()), _error_name(struct.error())
+    ('ValueError', 'struct.error')
+    """
+    name = type(e).__name__
+    if type(e).__module__ != "builtins":
+        name = type(e).__module__ + "." + name
+    return name
+
+
+async def run_many(func: Callable[[str, str, Dict[str, Any]], FileResult],
+                   paths: Iterable[str], out_dir: Optional[str] = None,
+                   processes: Optional[int] = None,
+                   max_pending: Optional[int] = None,
+                   on_result: Optional[Callable[[FileResult], None]] = None,
+                   suffix: str = ".huf",
+                   **options: Any) -> List[FileResult]:
+    """ Return the results of calling <func>(path, out path, <options>) for
+    each of the <paths>, in the same order, where the out path is given by
+    out_path_for(path, <out_dir>, <suffix>).
+
+    The calls run in a pool of <processes> worker processes (by default, one
+    per CPU), with at most <max_pending> of them (by default, twice the number
+    of processes) submitted at a time. If <on_result> is given, it is called
+    with each result as soon as it is ready.
+
+    If a worker process dies, every call that was running in the pool gets a
+    result with an error, and the rest run in a new pool. A path whose out
+    path is the same as that of an earlier path gets a result with an error
+    instead of overwriting the earlier output.
+    """
+    loop = asyncio.get_running_loop()
+    processes = processes or os.cpu_count() or 1
+    slots = asyncio.Semaphore(max_pending or 2 * processes)
+    # the pool in use is the last one; the others are broken
+    pools = [ProcessPoolExecutor(processes)]
+    out_paths = set()
+
+    async def run(path: str) -> FileResult:
+        """ Run <func> on <path> in the pool, freeing a slot after."""
+        out_path = out_path_for(path, out_dir, suffix)
+        pool = pools[-1]
+        try:
+            if os.path.abspath(out_path) in out_paths:
+                result = FileResult(path, out_path)
+                result.error = "duplicate output path " + out_path
+            else:
+                out_paths.add(os.path.abspath(out_path))
+                result = await loop.run_in_executor(pool, func, path,
+                                                    out_path, options)
+        except BrokenProcessPool as e:
+            result = FileResult(path, out_path)
+            result.error = "{}: {}".format(_error_name(e), e)
+            if pools[-1] is pool:
+                pools.append(ProcessPoolExecutor(processes))
+        finally:
+            slots.release()
+        if on_result is not None:
+            on_result(result)
+        return result
+
+    try:
+        tasks = []
+        for path in paths:
+            await slots.acquire()
+            tasks.append(asyncio.ensure_future(run(path)))
+        return list(await asyncio.gather(*tasks))
+    finally:
+        for pool in pools:
+            pool.shutdown()
+
+
+async def compress_many(paths: Iterable[str], out_dir: Optional[str] = None,
+                        processes: Optional[int] = None,
+                        max_pending: Optional[int] = None,
+                        on_result: Optional[Callable[[FileResult], None]]
+                        = None,
+                        **options: Any) -> List[FileResult]:
+    """ Compress each of the files <paths> with compress_file and return the
+    results, in the same order. The other keyword arguments <options> are
+    passed to compress_file.
+
+    Each file is compressed into out_path_for(path, <out_dir>). A file that
+    cannot be compressed gets a result with an error, and the other files
+    are still compressed. The rest of the arguments are as for run_many.
+    """
+    return await run_many(_compress_one, paths, out_dir, processes,
+                          max_pending, on_result, **options)
+
+
+async def decompress_many(paths: Iterable[str],
+                          out_dir: Optional[str] = None,
+                          processes: Optional[int] = None,
+                          max_pending: Optional[int] = None,
+                          on_result: Optional[Callable[[FileResult], None]]
+                          = None,
+                          **options: Any) -> List[FileResult]:
+    """ Decompress each of the files <paths> with decompress_file and return
+    the results, in the same order, as for compress_many. Each file is
+    decompressed into out_path_for(path, <out_dir>, ".orig").
+    """
+    return await run_many(_decompress_one, paths, out_dir, processes,
+                          max_pending, on_result, ".orig", **options)
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
+
+    import python_ta
+    python_ta.check_all(config={
+        'allowed-import-modules': [
+            'python_ta', 'doctest', '__future__', 'typing', 'asyncio',
+            'contextlib', 'io', 'os', 'time', 'concurrent.futures', 'compress',
+            'stats'
+        ]
+    })
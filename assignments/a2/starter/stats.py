@@ -0,0 +1,165 @@
+"""
+Timing and memory statistics for the stages of compressing or decompressing a
+file.
+
+A Stats object given to compress_file or decompress_file records each stage of
+the work, such as reading the input, counting frequencies, building the tree,
+encoding and writing. For each stage it keeps the wall-clock time, the CPU time
+of this process, the bytes that went in and out, and the peak memory allocated,
+measured with tracemalloc. Work done in worker processes counts towards the
+time of the stage that waits for it, but not its CPU time or memory.
+
+Stages that run once per chunk, like decoding, add up into one record.
+
+>>> stats = Stats(trace_memory=False)
+>>> with stats.stage("copy") as record:
+...     record.bytes_in += 4
+...     record.bytes_out += 4
+>>> stats.stages["copy"].calls, stats.stages["copy"].bytes_out
+(1, 4)
+"""
+from __future__ import annotations
+import contextlib
+import json
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, Iterator, Optional
+
+
+class StageStats:
+    """ The statistics of one stage, added up over every time it ran.
+
+    Public Attributes:
+    ===========
+    name: the name of the stage
+    calls: the number of times the stage ran
+    wall_time: the wall-clock time taken, in seconds
+    cpu_time: the CPU time taken by this process, in seconds
+    bytes_in: the number of bytes the stage consumed
+    bytes_out: the number of bytes the stage produced
+    peak_memory: the most memory allocated by one run of the stage and not
+        freed before its peak, in bytes, or None if memory was not traced
+    """
+    name: str
+    calls: int
+    wall_time: float
+    cpu_time: float
+    bytes_in: int
+    bytes_out: int
+    peak_memory: Optional[int]
+
+    def __init__(self, name: str) -> None:
+        """ Create the statistics of the stage <name>, which has not run yet.
+        """
+        self.name = name
+        self.calls = 0
+        self.wall_time, self.cpu_time = 0.0, 0.0
+        self.bytes_in, self.bytes_out = 0, 0
+        self.peak_memory = None
+
+    def __repr__(self) -> str:
+        """ Return a string representation of these statistics."""
+        return 'StageStats({!r}, {:.6f}s, {} -> {} bytes)'.format(
+            self.name, self.wall_time, self.bytes_in, self.bytes_out)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """ Return these statistics as a dictionary that can be saved as JSON.
+
+        >>> StageStats("read").to_dict()["bytes_out"]
+        0
+        """
+        return {"name": self.name, "calls": self.calls,
+                "wall_time": self.wall_time, "cpu_time": self.cpu_time,
+                "bytes_in": self.bytes_in, "bytes_out": self.bytes_out,
+                "peak_memory": self.peak_memory}
+
+
+class Stats:
+    """ The statistics of every stage of compressing or decompressing a file.
+
+    Tracing memory slows Python code down several times, so the times of a
+    run with <trace_memory> are only comparable to other such runs.
+
+    Public Attributes:
+    ===========
+    stages: the statistics of each stage, by name, in the order the stages
+        first ran
+    trace_memory: whether the peak memory of each stage is measured
+    on_stage: a function called with the statistics of a stage, added up so
+        far, each time the stage ends, or None
+    """
+    stages: Dict[str, StageStats]
+    trace_memory: bool
+    on_stage: Optional[Callable[[StageStats], None]]
+
+    def __init__(self, trace_memory: bool = True,
+                 on_stage: Optional[Callable[[StageStats], None]] = None) \
+            -> None:
+        """ Create new statistics with no stages."""
+        self.stages = {}
+        self.trace_memory = trace_memory
+        self.on_stage = on_stage
+
+    @contextlib.contextmanager
+    def stage(self, name: str) -> Iterator[StageStats]:
+        """ Return a context manager that measures the stage <name> while it is
+        open, and gives the stage's statistics, to which the code in it should
+        add the bytes it consumes and produces.
+        """
+        record = self.stages.get(name)
+        if record is None:
+            record = self.stages[name] = StageStats(name)
+        started = False
+        if self.trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                started = True
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield record
+        finally:
+            record.wall_time += time.perf_counter() - wall
+            record.cpu_time += time.process_time() - cpu
+            record.calls += 1
+            if self.trace_memory:
+                peak = tracemalloc.get_traced_memory()[1] - base
+                record.peak_memory = max(record.peak_memory or 0, peak)
+                if started:
+                    tracemalloc.stop()
+            if self.on_stage is not None:
+                self.on_stage(record)
+
+    def wall_time(self) -> float:
+        """ Return the total wall-clock time of all the stages, in seconds.
+        """
+        return sum(record.wall_time for record in self.stages.values())
+
+    def to_dict(self) -> Dict[str, Any]:
+        """ Return these statistics as a dictionary that can be saved as JSON.
+        """
+        return {"wall_time": self.wall_time(),
+                "stages": [record.to_dict()
+                           for record in self.stages.values()]}
+
+    def to_json(self) -> str:
+        """ Return these statistics as a JSON string.
+
+        >>> json.loads(Stats().to_json())
+        {'wall_time': 0, 'stages': []}
+        """
+        return json.dumps(self.to_dict(), indent=2)
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
+
+    import python_ta
+    python_ta.check_all(config={
+        'allowed-import-modules': [
+            'python_ta', 'doctest', '__future__', 'typing', 'contextlib',
+            'json', 'time', 'tracemalloc'
+        ]
+    })
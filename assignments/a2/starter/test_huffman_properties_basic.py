@@ -1,10 +1,22 @@
 from __future__ import annotations
+import asyncio
+import io
+import json
+import os
+import tempfile
+import tracemalloc
 import pytest
-from random import shuffle
+from random import Random, shuffle
+import compress
+import bwt
+import service
+import archive
 from compress import *
+from stats import Stats
 from hypothesis import given, assume, settings
-from hypothesis.strategies import binary, integers, dictionaries, text
-from typing import Dict
+from hypothesis.strategies import binary, integers, dictionaries, text, \
+    lists, tuples
+from typing import Dict, List, Tuple
 
 settings.register_profile("norand", settings(derandomize=True, max_examples=200))
 settings.load_profile("norand")
@@ -40,6 +52,25 @@ def test_get_bit(byte: int, bit_pos: int) -> None:
     assert 0 <= b <= 1
 
 
+@given(lists(tuples(integers(0, 2 ** 20 - 1), integers(1, 20)), 0, 100))
+def test_bit_writer(values: List[Tuple[int, int]]) -> None:
+    """ Test that the bits written by BitWriter fill exactly the bytes needed,
+    with each value's bits in the order they were written.
+    """
+    values = [(value % (1 << length), length) for value, length in values]
+    num_bits = sum(length for _, length in values)
+    writer = BitWriter(num_bits)
+    for value, length in values:
+        writer.write(value, length)
+    result = writer.getvalue()
+    assert len(result) == (num_bits + 7) // 8
+    bits = "".join(byte_to_bits(byte) for byte in result)
+    pos = 0
+    for value, length in values:
+        assert int(bits[pos:pos + length], 2) == value
+        pos += length
+
+
 # === Test the compression code ===
 
 @given(binary(0, 1000))
@@ -62,6 +93,30 @@ def test_build_huffman_tree(d: Dict[int, int]) -> None:
     assert not t.is_leaf()
 
 
+@given(dictionaries(integers(0, 255), integers(1, 1000), dict, 2, 256))
+def test_build_huffman_tree_presorted(d: Dict[int, int]) -> None:
+    """ Test that building the tree from a frequency dictionary sorted by
+    frequency with two queues gives the same tree as with a heap.
+    """
+    d = dict(sorted(d.items(), key=lambda item: item[1]))
+    assert build_huffman_tree(d, True) == build_huffman_tree(d)
+
+
+@given(dictionaries(integers(0, 255), integers(1, 1000), dict, 2, 256),
+       integers(8, 16))
+def test_build_huffman_tree_max_length(d: Dict[int, int],
+                                       max_length: int) -> None:
+    """ Test that a tree built with a limit on code length has no longer codes,
+    is complete, and costs no less than the unlimited Huffman tree.
+    """
+    t = build_huffman_tree(d, max_length=max_length)
+    lengths = code_lengths(t)
+    assert set(lengths) == set(d)
+    assert max(lengths.values()) <= max_length
+    assert sum(2 ** -length for length in lengths.values()) == 1
+    assert avg_length(t, d) >= avg_length(build_huffman_tree(d), d)
+
+
 @given(dictionaries(integers(0, 255), integers(1, 1000), dict, 2, 256))
 def test_get_codes(d: Dict[int, int]) -> None:
     """ Test that the sum of len(code) * freq_dict[code] is optimal, so it
@@ -79,6 +134,35 @@ def test_get_codes(d: Dict[int, int]) -> None:
         sum([d2[k] * len(c2[k]) for k in d2])
 
 
+@given(dictionaries(integers(0, 255), integers(1, 1000), dict, 2, 256))
+def test_get_codes_after_change(d: Dict[int, int]) -> None:
+    """ Test that changing a tree through its subtrees changes its codes, even
+    after they were cached, that giving its subtrees to a new tree leaves it
+    unchanged, and that changing an unrelated tree leaves its codes cached.
+    """
+    t = build_huffman_tree(d)
+    codes = get_codes(t)
+    leaf = t
+    while not leaf.is_leaf():
+        leaf = leaf.left
+    old = leaf.symbol
+    leaf.symbol = 256
+    changed = get_codes(t)
+    assert changed[256] == codes[old] and old not in changed
+    leaf.symbol = old
+    shared = HuffmanTree(None, t.left, t.right)
+    assert shared == t and get_codes(shared) == get_codes(t) == codes
+    leaf.symbol = 256
+    assert get_codes(t) == changed and get_codes(shared) == codes
+    leaf.symbol = old
+    cached = t.arrays.codes(t.index)
+    other = HuffmanTree(None, HuffmanTree(1), HuffmanTree(2))
+    other.left.symbol = 3
+    assert t.arrays.codes(t.index) is cached
+    twice = HuffmanTree(None, t, t)
+    assert twice.left == twice.right == t and get_codes(t) == codes
+
+
 @given(dictionaries(integers(0, 255), integers(1, 1000), dict, 2, 256))
 def test_number_nodes(d: Dict[int, int]) -> None:
     """ If the root is an interior node, it must be numbered two less than the
@@ -104,6 +188,25 @@ def test_avg_length(d: Dict[int, int]) -> None:
     assert 0 <= f <= 8.0
 
 
+@given(dictionaries(integers(0, 5000), integers(1, 20), dict, 2, 1000),
+       integers(0, 2 ** 32))
+def test_improve_tree(d: Dict[int, int], seed: int) -> None:
+    """ Test that improve_tree gives the symbols of a tree built for other
+    frequencies the lowest cost possible in its shape, even when frequencies
+    are equal and there are more than 256 symbols.
+    """
+    t = build_huffman_tree(d)
+    values = list(d.values())
+    Random(seed).shuffle(values)
+    d2 = dict(zip(d, values))
+    depths = sorted(code_lengths(t).values())
+    improve_tree(t, d2)
+    lengths = code_lengths(t)
+    assert set(lengths) == set(d)
+    assert sum(d2[k] * lengths[k] for k in d2) == \
+        sum(f * n for f, n in zip(sorted(values, reverse=True), depths))
+
+
 @given(binary(2, 1000))
 def test_compress_bytes(b: bytes) -> None:
     """ Test that compress_bytes returns a bytes object that is no longer
@@ -148,6 +251,25 @@ def test_tree_to_bytes(b: bytes) -> None:
     assert (4 * (leaf_count - 1)) == len(output_bytes)
 
 
+@given(binary(2, 1000))
+def test_header_codes(b: bytes) -> None:
+    """ Test that reading the codes straight from the bytes of a tree gives
+    the codes of the tree generated from them.
+    """
+    d = build_frequency_dict(b)
+    assume(len(d) > 1)
+    t = build_huffman_tree(d)
+    number_nodes(t)
+    buf = tree_to_bytes(t)
+    root = len(buf) // 4 - 1
+    assert header_codes(memoryview(buf), root) == get_codes(t) == \
+        get_codes(generate_tree_general(bytes_to_nodes(buf), root))
+    with pytest.raises(ValueError):
+        header_codes(bytes([1, 0, 1, 0]), 0)
+    with pytest.raises(ValueError):
+        header_codes(buf, len(buf) // 4)
+
+
 # === Test a roundtrip conversion
 
 @given(binary(1, 1000))
@@ -165,5 +287,501 @@ def test_round_trip_compress_bytes(b: bytes) -> None:
     assert text == decompressed
 
 
+@given(binary(1, 1000), integers(1, 100))
+def test_round_trip_decoder_pieces(b: bytes, piece: int) -> None:
+    """ Test that feeding the compressed text to a HuffmanDecoder in pieces
+    of <piece> bytes produces the original text.
+    """
+    freq = build_frequency_dict(b)
+    assume(len(freq) > 1)
+    tree = build_huffman_tree(freq)
+    compressed = compress_bytes(b, get_codes(tree))
+    decoder = HuffmanDecoder(get_codes(tree))
+    decompressed = b''
+    for i in range(0, len(compressed), piece):
+        decompressed += decoder.decode(compressed[i:i + piece],
+                                       len(b) - len(decompressed))
+    assert b == decompressed
+
+
+@given(binary(1, 1000), integers(1, 100))
+def test_encoder_pieces(b: bytes, piece: int) -> None:
+    """ Test that feeding the text to a HuffmanEncoder in pieces of <piece>
+    bytes produces the same result as compress_bytes.
+    """
+    codes = get_codes(build_huffman_tree(build_frequency_dict(b)))
+    encoder = HuffmanEncoder(codes)
+    compressed = b''
+    for i in range(0, len(b), piece):
+        compressed += encoder.encode(b[i:i + piece])
+    compressed += encoder.flush()
+    assert compressed == compress_bytes(b, codes)
+
+
+def _round_trip_file(b: bytes, use_mmap: bool = False, **kwargs) -> bytes:
+    """ Return the contents of a file holding <b> after compressing it with
+    compress_file, using the keyword arguments <kwargs>, and decompressing it
+    with decompress_file, through memory maps on both sides if <use_mmap> is
+    True.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        name = os.path.join(tmp, "text")
+        with open(name, "wb") as f:
+            f.write(b)
+        compress_file(name, name + ".huf", use_mmap=use_mmap, **kwargs)
+        decompress_file(name + ".huf", name + ".orig", use_mmap=use_mmap)
+        with open(name + ".orig", "rb") as f:
+            return f.read()
+
+
+@settings(max_examples=50)
+@given(binary(1, 3000))
+def test_round_trip_file_streaming(b: bytes) -> None:
+    """ Test that compressing a file in streaming mode and decompressing it
+    produces the original text.
+    """
+    assert _round_trip_file(b, streaming=True) == b
+
+
+@settings(max_examples=20)
+@given(binary(1, 3000), integers(1, 500))
+def test_round_trip_file_blocks(b: bytes, block_size: int) -> None:
+    """ Test that compressing a file in blocks of <block_size> bytes with a
+    pool of processes and decompressing it produces the original text.
+    """
+    assert _round_trip_file(b, block_size=block_size, processes=2) == b
+
+
+@given(dictionaries(integers(0, 255), integers(1, 1000), dict, 2, 256))
+def test_get_codes_canonical(d: Dict[int, int]) -> None:
+    """ Test that canonical codes keep the code lengths of the tree, form a
+    prefix code, and are rebuilt the same from their stored lengths.
+    """
+    t = build_huffman_tree(d)
+    codes = get_codes(t)
+    canonical = get_codes(t, True)
+    assert {k: len(codes[k]) for k in codes} == \
+        {k: len(canonical[k]) for k in canonical}
+    ordered = sorted(canonical.values())
+    for i in range(len(ordered) - 1):
+        assert not ordered[i + 1].startswith(ordered[i])
+    stored = io.BytesIO(lengths_to_bytes(code_lengths(t)))
+    assert canonical_codes(read_lengths(stored)) == canonical
+
+
+@settings(max_examples=50)
+@given(binary(1, 3000))
+def test_round_trip_file_canonical(b: bytes) -> None:
+    """ Test that compressing a file with canonical codes, alone and in blocks,
+    and decompressing it produces the original text.
+    """
+    assert _round_trip_file(b, canonical=True) == b
+    assert _round_trip_file(b, canonical=True, block_size=700,
+                            processes=1) == b
+
+
+@pytest.mark.skipif(not compress.USE_NUMPY, reason="NumPy is not installed")
+@given(binary(1, 3000))
+def test_numpy_matches_python(b: bytes) -> None:
+    """ Test that the NumPy backend counts the same frequencies, in the same
+    order, and encodes the same bytes as the pure Python code.
+    """
+    d = build_frequency_dict(b)
+    codes = get_codes(build_huffman_tree(d))
+    compressed = compress_bytes(b, codes)
+    compress.USE_NUMPY = False
+    try:
+        assert list(build_frequency_dict(b).items()) == list(d.items())
+        assert compress_bytes(b, codes) == compressed
+    finally:
+        compress.USE_NUMPY = True
+
+
+@settings(max_examples=50)
+@given(binary(1, 3000))
+def test_round_trip_file_mmap(b: bytes) -> None:
+    """ Test that compressing and decompressing a file through memory maps,
+    alone and in blocks, produces the original text.
+    """
+    assert _round_trip_file(b, use_mmap=True) == b
+    assert _round_trip_file(b, use_mmap=True, block_size=700,
+                            processes=1) == b
+
+
+@settings(max_examples=50)
+@given(binary(1, 3000), integers(1, 500), integers(0, 3000), integers(0, 500))
+def test_decompress_range(b: bytes, interval: int, start: int,
+                          length: int) -> None:
+    """ Test that decompress_range on a file compressed with a seek index of
+    <interval> bytes returns the requested slice of the original text, and
+    that the whole file still decompresses to the original text.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        name = os.path.join(tmp, "text")
+        with open(name, "wb") as f:
+            f.write(b)
+        compress_file(name, name + ".huf", index_interval=interval)
+        assert decompress_range(name + ".huf", start, length) == \
+            b[start:start + length]
+        with pytest.raises(ValueError):
+            compress_file(name, name + ".huf", index_interval=0)
+    assert _round_trip_file(b, index_interval=interval, canonical=True) == b
+
+
+@settings(max_examples=50)
+@given(binary(0, 3000))
+def test_round_trip_file_adaptive(b: bytes) -> None:
+    """ Test that compressing a file with the adaptive code and decompressing
+    it produces the original text.
+    """
+    assert _round_trip_file(b, adaptive_code=True) == b
+
+
+@settings(max_examples=50)
+@given(binary(1, 3000))
+def test_round_trip_file_auto_select(b: bytes) -> None:
+    """ Test that compressing a file with automatic format selection, alone and
+    in blocks, and decompressing it produces the original text.
+    """
+    assert _round_trip_file(b, auto_select=True) == b
+    assert _round_trip_file(b, auto_select=True, block_size=700,
+                            processes=1) == b
+
+
+def test_auto_select_stored() -> None:
+    """ Test that incompressible data is stored with only 2 bytes of overhead,
+    and that ranges of it can be read back directly.
+    """
+    data = bytes(range(256)) * 10
+    with tempfile.TemporaryDirectory() as tmp:
+        name = os.path.join(tmp, "data")
+        with open(name, "wb") as f:
+            f.write(data)
+        compress_file(name, name + ".huf", auto_select=True)
+        assert os.path.getsize(name + ".huf") == len(data) + 2
+        assert decompress_range(name + ".huf", 300, 10) == data[300:310]
+        # a compressible header does not hide the random data after it
+        data = bytes(20000) + Random(1).randbytes(1 << 20)
+        with open(name, "wb") as f:
+            f.write(data)
+        compress_file(name, name + ".huf", auto_select=True)
+        assert os.path.getsize(name + ".huf") == len(data) + 2
+
+
+def test_conflicting_options() -> None:
+    """ Test that compress_file rejects options that cannot be combined,
+    before writing anything.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        name = os.path.join(tmp, "text")
+        with open(name, "wb") as f:
+            f.write(b"abracadabra")
+        for kwargs in [dict(context=True, canonical=True, max_length=8),
+                       dict(adaptive_code=True, auto_select=True,
+                            use_mmap=True),
+                       dict(lz77_window=64, bwt_block_size=100),
+                       dict(block_size=4, index_interval=4),
+                       dict(block_size=4, streaming=True),
+                       dict(processes=2), dict(lz77_effort=1)]:
+            with pytest.raises(ValueError):
+                compress_file(name, name + ".huf", **kwargs)
+            assert not os.path.exists(name + ".huf")
+
+
+def test_stats() -> None:
+    """ Test that the stages of compressing and decompressing a file are
+    recorded, with the bytes going through them, and that selecting the
+    format does not count the frequencies twice.
+    """
+    data = b'abracadabra' * 1000
+    with tempfile.TemporaryDirectory() as tmp:
+        name = os.path.join(tmp, "data")
+        with open(name, "wb") as f:
+            f.write(data)
+        stats = Stats()
+        compress_file(name, name + ".huf", stats=stats)
+        assert list(stats.stages) == ["read", "frequencies", "tree", "codes",
+                                      "encode", "write"]
+        assert stats.stages["encode"].bytes_in == len(data)
+        assert stats.stages["write"].bytes_in == os.path.getsize(name + ".huf")
+        assert all(record.peak_memory is not None
+                   for record in stats.stages.values())
+        ended = []
+        stats = Stats(trace_memory=False, on_stage=ended.append)
+        decompress_file(name + ".huf", name + ".orig", stats=stats)
+        assert stats.stages["decode"].bytes_out == len(data)
+        assert len(ended) == sum(record.calls
+                                 for record in stats.stages.values())
+        assert json.loads(stats.to_json())["stages"][0]["name"] == "header"
+        # the frequencies counted to select the format are not counted again
+        with open(name + ".huf", "rb") as f:
+            plain = f.read()
+        stats = Stats(trace_memory=False)
+        compress_file(name, name + ".huf", auto_select=True, stats=stats)
+        assert list(stats.stages)[:2] == ["select", "read"]
+        assert "frequencies" not in stats.stages
+        with open(name + ".huf", "rb") as f:
+            assert f.read() == plain
+
+
+def _decompress_peak(data: bytes) -> int:
+    """ Return the peak memory allocated while decompressing a file holding
+    <data> compressed with compress_file, after checking the result.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        name = os.path.join(tmp, "data")
+        with open(name, "wb") as f:
+            f.write(data)
+        compress_file(name, name + ".huf")
+        tracemalloc.start()
+        try:
+            decompress_file(name + ".huf", name + ".orig")
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        with open(name + ".orig", "rb") as f:
+            assert f.read() == data
+    return peak
+
+
+def test_decompress_bounded_memory() -> None:
+    """ Test that decompressing twice as much data, over many chunks, takes
+    little more memory.
+    """
+    size = 1 << 19
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "files",
+                        "Homer-Iliad.txt")
+    with open(path, "rb") as f:
+        text = f.read(2 * size)
+    # decoding the whole file in memory would take over 1.5 * size more
+    assert _decompress_peak(text) < _decompress_peak(text[:size]) + size // 2
+
+
+@given(binary(min_size=1, max_size=2000))
+def test_context_round_trip(b: bytes) -> None:
+    """ Test that the order-1 context mode gives the same results with and
+    without NumPy, and that files compressed with it decompress to the
+    original.
+    """
+    assert _round_trip_file(b, context=True) == b
+    if compress.np is not None:
+        compress.USE_NUMPY = False
+        try:
+            expected = compress_context(b)
+        finally:
+            compress.USE_NUMPY = True
+        assert compress_context(b) == expected
+
+
+def test_context_smaller() -> None:
+    """ Test that the context mode beats a single code when each byte
+    predicts the next.
+    """
+    text = bytes(range(32)) * 200
+    assert len(compress_context(text)) < len(compress_bytes(
+        text, get_codes(build_huffman_tree(build_frequency_dict(text))))) // 2
+
+
+@given(binary(min_size=1, max_size=2000), integers(1, 300),
+       integers(1, 9))
+def test_lz77_round_trip(b: bytes, window: int, effort: int) -> None:
+    """ Test that files compressed with an LZ77 stage decompress to the
+    original, with any window and effort.
+    """
+    assert _round_trip_file(b + b[:500] + b,
+                            lz77_window=window, lz77_effort=effort) == \
+        b + b[:500] + b
+
+
+def test_lz77_decode_pieces() -> None:
+    """ Test that LZ77 output decodes the same when fed one byte at a time,
+    and that matches reach across the pieces.
+    """
+    text = b"the quick brown fox jumps over the lazy dog " * 50
+    f = io.BytesIO(compress_lz77(text, window=64))
+    f.read(2)
+    decoder = compress._read_decoder(f, FORMAT_MARKER, FORMAT_LZ77)
+    size = bytes_to_int(f.read(4))
+    result = b""
+    for byte in f.read():
+        result += decoder.decode(bytes([byte]), size - len(result))
+    result += decoder.decode(b"", size - len(result))
+    assert result == text
+    assert len(compress_lz77(text)) < len(text) // 10
+
+
+@given(binary(min_size=1, max_size=1000), integers(1, 600))
+def test_bwt_round_trip(b: bytes, block_size: int) -> None:
+    """ Test that the BWT stage is undone by decompress_file, with and without
+    NumPy, for any block size.
+    """
+    assert _round_trip_file(b * 3, bwt_block_size=block_size) == b * 3
+    if bwt.np is not None:
+        bwt.np = None
+        try:
+            assert bwt.inverse_transform(bwt.transform(b * 3, block_size)) \
+                == b * 3
+        finally:
+            bwt.np = compress.np
+
+
+def test_compress_many() -> None:
+    """ Test that compress_many compresses every file, reports each file's
+    result in order, and keeps going past files that cannot be compressed,
+    and that decompress_many restores the files.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = []
+        for i in range(6):
+            paths.append(os.path.join(tmp, "f{}".format(i)))
+            with open(paths[-1], "wb") as f:
+                f.write(bytes(range(i + 1)) * 50)
+        paths.insert(3, os.path.join(tmp, "missing"))
+        seen = []
+        results = asyncio.run(service.compress_many(
+            iter(paths), processes=2, max_pending=2, on_result=seen.append,
+            canonical=True))
+        assert [r.path for r in results] == paths
+        assert len(seen) == len(paths)
+        assert results[3].error is not None
+        del results[3]
+        out_dir = os.path.join(tmp, "out")
+        os.mkdir(out_dir)
+        restored = asyncio.run(service.decompress_many(
+            [r.out_path for r in results], out_dir, processes=2,
+            stats=Stats(trace_memory=False)))
+        for result, back in zip(results, restored):
+            assert result.error is None and back.error is None
+            assert back.size == result.size and back.stats is not None
+            with open(result.path, "rb") as f, open(back.out_path, "rb") as g:
+                assert f.read() == g.read()
+
+
+def _compress_or_crash(path: str, out_path: str,
+                       options: Dict[str, object]) -> service.FileResult:
+    """ Compress <path> as service.compress_many does, but kill the worker
+    process instead if <path> ends with "crash".
+    """
+    if path.endswith("crash"):
+        os._exit(1)
+    return service._compress_one(path, out_path, options)
+
+
+def test_run_many_errors() -> None:
+    """ Test that a file in the wrong format, a worker process that dies and
+    a second file with the same output path each give a result with an error,
+    that no partial output is left behind, and the other files are still
+    done.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = [os.path.join(tmp, name) for name in ("a", "crash", "b")]
+        for path in paths:
+            with open(path, "wb") as f:
+                f.write(b"plain text, not compressed")
+        results = asyncio.run(service.run_many(
+            _compress_or_crash, paths, processes=1, max_pending=1))
+        assert [r.error is None for r in results] == [True, False, True]
+        assert "BrokenProcessPool" in results[1].error
+        results = asyncio.run(service.decompress_many(
+            [paths[0] + ".huf", paths[2]], processes=1))
+        assert results[0].error is None and results[1].error is not None
+        assert not os.path.exists(paths[2] + ".orig")
+        os.mkdir(os.path.join(tmp, "sub"))
+        same = os.path.join(tmp, "sub", "a")
+        with open(same, "wb") as f:
+            f.write(b"another file with the same name")
+        results = asyncio.run(service.compress_many(
+            [paths[0], same], tmp, processes=1))
+        assert results[0].error is None
+        assert "duplicate output path" in results[1].error
+
+
+@given(lists(binary(max_size=300), min_size=1, max_size=5))
+def test_archive_round_trip(members: list) -> None:
+    """ Test that every member of an archive, with or without a shared tree,
+    can be extracted on its own or all together.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = []
+        for i, data in enumerate(members):
+            paths.append(os.path.join(tmp, "m{}".format(i)))
+            with open(paths[-1], "wb") as f:
+                f.write(data)
+        for shared_tree in [False, True]:
+            name = os.path.join(tmp, "archive.huf")
+            archive.create_archive(name, paths, shared_tree=shared_tree)
+            assert archive.extract_member(name, "m0") == members[0]
+            out_dir = os.path.join(tmp, "out")
+            directory = archive.extract_all(name, out_dir)
+            assert [entry.size for entry in directory] == \
+                [len(data) for data in members]
+            for i, data in enumerate(members):
+                with open(os.path.join(out_dir, "m{}".format(i)), "rb") as f:
+                    assert f.read() == data
+
+
+def test_archive_unsafe_names() -> None:
+    """ Test that an archive cannot have two members with the same name, that
+    members are never extracted outside the output directory, and that other
+    files are not read as archives.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "m")
+        with open(path, "wb") as f:
+            f.write(b"member")
+        name = os.path.join(tmp, "archive.huf")
+        with pytest.raises(ValueError):
+            archive.create_archive(name, [path, path])
+        out_dir = os.path.join(tmp, "out")
+        for member in ["../escaped", os.path.join(tmp, "escaped"),
+                       "a/../../escaped"]:
+            archive.create_archive(name, [path, path], ["ok", member])
+            with pytest.raises(ValueError):
+                archive.extract_all(name, out_dir)
+            assert not os.path.exists(os.path.join(tmp, "escaped"))
+            assert not os.path.exists(os.path.join(out_dir, "ok"))
+        # a file that is not an archive is rejected before its end is read
+        with pytest.raises(ValueError, match="not an archive"):
+            archive.extract_member(path, "ok")
+
+
+def test_codebook(monkeypatch) -> None:
+    """ Test that a trained codebook codes data with bytes it was not trained
+    on, that the header only refers to it, and that its cached codes and
+    decoder are not shared with callers.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        monkeypatch.setattr(compress, "CODEBOOK_DIR", tmp)
+        sample = os.path.join(tmp, "sample")
+        with open(sample, "wb") as f:
+            f.write(b"the quick brown fox jumps over the lazy dog" * 20)
+        codebook_id = train_codebook([sample])
+        assert train_codebook([sample]) == codebook_id
+        with open(codebook_path(codebook_id), "r+b") as f:
+            last = f.read()[-1]
+            f.seek(-1, os.SEEK_END)
+            f.write(bytes([last ^ 1]))
+        with pytest.raises(ValueError):
+            train_codebook([sample])
+        os.remove(codebook_path(codebook_id))
+        assert train_codebook([sample]) == codebook_id
+        data = b"a lazy fox\x00\xff" * 3
+        assert _round_trip_file(data, codebook=codebook_id) == data
+        compressed = compress_codebook(data, codebook_id)
+        assert len(compressed) < len(data) + 10
+        with pytest.raises(ValueError):
+            load_codebook(codebook_id + 1)
+        load_codebook(codebook_id).clear()
+        assert len(load_codebook(codebook_id)) == 256
+        # streams with the same codebook can be decoded at the same time
+        decoders = [compress._read_decoder(io.BytesIO(compressed[2:6]), 0,
+                                           FORMAT_CODEBOOK) for _ in "ab"]
+        body = compressed[10:]
+        first = decoders[0].decode(body[:2], len(data))
+        assert decoders[1].decode(body, len(data)) == data
+        assert first + decoders[0].decode(body[2:], len(data) - len(first)) \
+            == data
+
+
 if __name__ == "__main__":
     pytest.main("test_huffman_properties_basic.py")
@@ -13,8 +13,13 @@ All of the files in this directory and all subdirectories are:
 Copyright (c) 2020 Bogdan Simion, Michael Liut, Paul Vrbik, Dan Zingaro
 """
 from __future__ import annotations
+import struct
 from typing import List
 
+# The layout of a tree node in a compressed file: the type and data of its
+# left child, then of its right child, a byte each.
+NODE_STRUCT = struct.Struct("4B")
+
 # ====================
 # Helper functions for manipulating bytes
 
@@ -69,14 +74,7 @@ def bytes_to_nodes(buf: bytes) -> List[ReadNode]:
     >>> bytes_to_nodes(bytes([0, 1, 0, 2]))
     [ReadNode(0, 1, 0, 2)]
     """
-    lst = []
-    for i in range(0, len(buf), 4):
-        l_type = buf[i]
-        l_data = buf[i+1]
-        r_type = buf[i+2]
-        r_data = buf[i+3]
-        lst.append(ReadNode(l_type, l_data, r_type, r_data))
-    return lst
+    return [ReadNode(*fields) for fields in NODE_STRUCT.iter_unpack(buf)]
 
 
 def int32_to_bytes(num: int) -> bytes:
@@ -93,6 +91,105 @@ def int32_to_bytes(num: int) -> bytes:
     return num.to_bytes(4, "little")
 
 
+def int64_to_bytes(num: int) -> bytes:
+    """ Return the <num> integer converted to a bytes object.
+    The integer is assumed to contain a 64-bit (8-byte) number, for sizes and
+    offsets that may not fit in 32 bits.
+
+    >>> list(int64_to_bytes(300))
+    [44, 1, 0, 0, 0, 0, 0, 0]
+    """
+    # little-endian representation of 64-bit (8-byte) num
+    return num.to_bytes(8, "little")
+
+
+class BitWriter:
+    """ A writer of bits into a preallocated bytearray.
+    Bits are written most significant first, and are collected in an integer
+    accumulator that is flushed to the buffer several bytes at a time. The
+    last byte is padded with zeroes to the right, as with bits_to_byte.
+
+    When the number of bits is not known in advance, the buffer starts empty
+    and grows as bits are written; the complete bytes written so far can then
+    be taken out of it with take.
+
+    Public Attributes:
+    ===========
+    buffer: the bytes written so far, padded to the size given on creation
+    """
+    buffer: bytearray
+    # === Private Attributes ===
+    # _pos: the index in buffer of the next byte to flush
+    # _acc: the bits written but not yet flushed
+    # _num_bits: the number of bits in _acc
+    _pos: int
+    _acc: int
+    _num_bits: int
+
+    def __init__(self, num_bits: int = 0) -> None:
+        """ Create a new BitWriter with room for exactly <num_bits> bits."""
+        self.buffer = bytearray((num_bits + 7) // 8)
+        self._pos, self._acc, self._num_bits = 0, 0, 0
+
+    def write(self, value: int, length: int) -> None:
+        """ Write the <length> lowest bits of <value>.
+
+        >>> writer = BitWriter(5)
+        >>> writer.write(0b10, 2)
+        >>> writer.write(0b111, 3)
+        >>> writer.getvalue() == bytes([0b10111000])
+        True
+        """
+        self._acc = self._acc << length | value
+        self._num_bits += length
+        if self._num_bits >= 64:
+            self._flush()
+
+    def _flush(self) -> None:
+        """ Move all the complete bytes in the accumulator into the buffer.
+        """
+        count, self._num_bits = divmod(self._num_bits, 8)
+        self.buffer[self._pos:self._pos + count] = \
+            (self._acc >> self._num_bits).to_bytes(count, "big")
+        self._pos += count
+        self._acc &= (1 << self._num_bits) - 1
+
+    def take(self) -> bytes:
+        """ Return the complete bytes written since the last call to take,
+        and remove them from the buffer. Any bits of an incomplete last byte
+        are kept.
+
+        >>> writer = BitWriter()
+        >>> writer.write(0b101, 3)
+        >>> writer.take()
+        b''
+        >>> writer.write(0b11111, 5)
+        >>> writer.write(0b1, 1)
+        >>> writer.take() == bytes([0b10111111])
+        True
+        >>> writer.getvalue() == bytes([0b10000000])
+        True
+        """
+        self._flush()
+        result = bytes(self.buffer[:self._pos])
+        del self.buffer[:self._pos]
+        self._pos = 0
+        return result
+
+    def getvalue(self) -> bytes:
+        """ Return the bytes written so far (since the last call to take, if
+        any), with the last byte padded with zeroes to the right.
+        """
+        self._flush()
+        if self._num_bits:
+            last = self._acc << (8 - self._num_bits) & 0xFF
+            if self._pos < len(self.buffer):
+                self.buffer[self._pos] = last
+            else:
+                self.buffer.append(last)
+        return bytes(self.buffer)
+
+
 class ReadNode:
     """ A node as read from a compressed file.
     Each node consists of type and data information as described in the handout.
@@ -105,6 +202,7 @@ class ReadNode:
     r_type: 0/1 (if the corresponding HuffmanTree's right is a leaf)
     r_data: a symbol or the node number of a HuffmanTree's right
     """
+    __slots__ = ['l_type', 'l_data', 'r_type', 'r_data']
     l_type: int
     l_data: int
     r_type: int
@@ -129,6 +227,6 @@ if __name__ == '__main__':
     import python_ta
     python_ta.check_all(config={
         'allowed-import-modules': [
-            'python_ta', 'doctest', '__future__', 'typing'
+            'python_ta', 'doctest', '__future__', 'typing', 'struct'
         ]
     })